@@ -0,0 +1,344 @@
+# --- Benchmark các luồng dữ liệu của dashboard trên dữ liệu giả lập ---
+# Sinh qtrr/cp/summary/giá ngày theo quy mô tuỳ chọn vào một thư mục tạm (cùng cấu trúc
+# result/, data/, Volume/result/ như khi chạy thật), rồi đo từng bước load / compute /
+# filter / style / export bằng đúng các hàm của risk_warnings, volume_engine, styling,
+# exporting. Mỗi bước ghi thời gian, bộ nhớ đỉnh (tracemalloc), số dòng vào/ra.
+#
+# Chạy:
+#   python benchmark.py                                  # toàn thị trường: 1600 mã, 20 năm, 10 năm giá ngày
+#   python benchmark.py --tickers 200 --years 5 --days 500 --out bench.json
+#   python benchmark.py --no-excel                       # bỏ bước parse Excel (ghi thẳng vào cache)
+#   python benchmark.py --compare bench_old.json         # so sánh với lần chạy trước
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Thư mục cache của data_cache được đọc lúc import -> đặt trước khi import các module của repo
+_WORKSPACE = Path(tempfile.mkdtemp(prefix="qtrr_bench_"))
+os.environ["QTRR_CACHE_DIR"] = str(_WORKSPACE / ".cache")
+os.environ["QTRR_SNAPSHOT_DIR"] = str(_WORKSPACE / "snapshots")
+os.environ["QTRR_STORE_DIR"] = str(_WORKSPACE / "store")
+
+import data_cache  # noqa: E402
+import exporting  # noqa: E402
+import fundamentals_store  # noqa: E402
+import risk_engine  # noqa: E402
+import risk_warnings  # noqa: E402
+import styling  # noqa: E402
+import volume_engine  # noqa: E402
+
+REPO_DIR = Path(__file__).resolve().parent
+EXCHANGES = ["HOSE", "HNX", "Upcom"]
+INDUSTRIES = [
+    "Ngân hàng", "Bất động sản", "Xây dựng và Vật liệu", "Thực phẩm và đồ uống", "Hóa chất",
+    "Dịch vụ tài chính", "Tài nguyên Cơ bản", "Hàng & Dịch vụ Công nghiệp", "Công nghệ Thông tin",
+    "Điện, nước & xăng dầu khí đốt", "Bán lẻ", "Bảo hiểm", "Y tế", "Du lịch và Giải trí",
+    "Hàng cá nhân & Gia dụng", "Ô tô và phụ tùng", "Dầu khí", "Truyền thông", "Viễn thông",
+]
+MODELS = ["Ngân hàng", "Chứng khoán", "Bảo hiểm", "Phi tài chính"]
+
+
+# --- Sinh dữ liệu ---
+def make_tickers(n):
+    letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    return ["".join(t) for t in itertools.islice(itertools.product(letters, repeat=3), n)]
+
+
+def make_cp(tickers, rng):
+    return pd.DataFrame({
+        "Ticker": tickers,
+        "ComGroupCode": rng.choice(EXCHANGES, len(tickers)),
+        "nganh": rng.choice(INDUSTRIES, len(tickers)),
+    })
+
+
+def make_summary(tickers, rng):
+    return pd.DataFrame({
+        "Mã": tickers,
+        "Điểm": rng.choice(list("ABCDE"), len(tickers)),
+        "Tỷ lệ cho vay": rng.choice(["0%", "30%", "50%"], len(tickers)),
+        "Mô hình": rng.choice(MODELS, len(tickers), p=[0.03, 0.03, 0.02, 0.92]),
+    })
+
+
+def make_qtrr(cp, years, end_year, rng):
+    # Mỗi mã: 4 quý + 1 báo cáo năm cho mỗi năm, kỳ mới nhất trước (như qtrr_output1.xlsx)
+    periods = [(y, q) for y in range(end_year, end_year - years, -1) for q in (5, 4, 3, 2, 1)]
+    n_periods = len(periods)
+    n = len(cp) * n_periods
+    year = np.tile([p[0] for p in periods], len(cp))
+    length = np.tile([p[1] for p in periods], len(cp))
+    scale = np.repeat(rng.lognormal(26, 1.5, len(cp)), n_periods)
+
+    revenue = scale * rng.lognormal(0, 0.3, n)
+    net_income = revenue * rng.normal(0.06, 0.08, n)
+    gross_margin = rng.normal(0.2, 0.1, n)
+    return pd.DataFrame({
+        "Ticker": np.repeat(cp["Ticker"].to_numpy(), n_periods),
+        "Nganh": np.repeat(cp["nganh"].to_numpy(), n_periods),
+        "YearReport": year,
+        "LengthReport": length,
+        "LoaiBaoCao": np.where(length == 5, "Năm", "Quý"),
+        "KyBaoCao": [f"{y}_Y" if q == 5 else f"{y}_Q{q}" for y, q in zip(year, length)],
+        "Doanh thu thuần": revenue,
+        "Lưu chuyển tiền thuần từ HĐKD": revenue * rng.normal(0.05, 0.15, n),
+        "LNST": net_income,
+        "Cổ đông của công ty mẹ": net_income * 0.9,
+        "Hệ số lợi nhuận gộp": gross_margin,
+        "Mức biến động tăng/giảm doanh thu thuần kỳ phân tích so với kỳ gốc": revenue * rng.normal(0.1, 0.3, n),
+        "Tỷ lệ (%) doanh thu thuần kỳ phân tích so với kỳ gốc (%)": rng.normal(110, 40, n),
+        "Mức biến động tăng/giảm LNST kỳ phân tích so với kỳ gốc": net_income * rng.normal(0.1, 0.5, n),
+        "Tỷ lệ % LNST kỳ phân tích so với kỳ gốc (%)": rng.normal(110, 150, n),
+        "Biên lợi nhuận gộp": gross_margin,
+        "Biên lợi nhuận ròng": net_income / revenue,
+        "Vốn chủ sở hữu": scale * 3,
+        "Vốn cổ phần": np.round(scale * 2, -7),
+    })
+
+
+def new_quarter(qtrr):
+    # Báo cáo của quý tiếp theo cho mọi mã (copy quý mới nhất, đổi kỳ và số liệu)
+    quarterly = qtrr[qtrr["LengthReport"] != 5]
+    year, quarter = max(zip(quarterly["YearReport"], quarterly["LengthReport"]))
+    latest = qtrr[(qtrr["YearReport"] == year) & (qtrr["LengthReport"] == quarter)]
+    year, quarter = (year + 1, 1) if quarter == 4 else (year, quarter + 1)
+    new = latest.assign(YearReport=year, LengthReport=quarter, KyBaoCao=f"{year}_Q{quarter}")
+    return new.assign(**{c: new[c] * 1.05 for c in ["Doanh thu thuần", "LNST"] if c in new.columns})
+
+
+def make_prices(tickers, days, end_date, rng):
+    dates = pd.bdate_range(end=end_date, periods=days)
+    n = len(tickers) * days
+    close = np.repeat(rng.lognormal(3, 1, len(tickers)), days) * np.exp(
+        np.cumsum(rng.normal(0, 0.02, n).reshape(len(tickers), days), axis=1).ravel()
+    )
+    return pd.DataFrame({
+        "time": np.tile(dates.strftime("%Y-%m-%d"), len(tickers)),
+        "symbol": np.repeat(tickers, days),
+        "close": close.round(2),
+        "volume": np.repeat(rng.lognormal(11, 1.5, len(tickers)), days) * rng.lognormal(0, 0.5, n),
+    })
+
+
+def write_workspace(data, excel):
+    # Cùng đường dẫn tương đối như khi chạy thật (chạy với cwd = workspace)
+    for d in ["result", "result1", "data", os.path.join("Volume", "result")]:
+        os.makedirs(d, exist_ok=True)
+    data["cp"].to_csv(risk_warnings.CP_PATH, index=False)
+    data["prices"].to_csv(risk_warnings.PRICE_PATH, index=False)
+    hose = data["cp"][data["cp"]["ComGroupCode"] == "HOSE"].head(70)
+    pd.DataFrame({"symbol": hose["Ticker"], "Lý do": "Cảnh báo"}).to_csv(risk_warnings.HOSE_MARGIN_PATH, index=False)
+    if excel:
+        engine = "xlsxwriter" if exporting.HAS_XLSXWRITER else "openpyxl"
+        data["qtrr"].to_excel(risk_warnings.QTRR_PATH, index=False, engine=engine)
+        data["summary"].to_excel(risk_warnings.SUMMARY_PATH, index=False, engine=engine)
+    else:
+        # Không có Excel: đặt file rỗng làm nguồn và ghi thẳng dữ liệu vào cache dạng cột / kho qtrr
+        for path, df in [(risk_warnings.QTRR_PATH, risk_engine.compact_qtrr(data["qtrr"].copy())),
+                         (risk_warnings.SUMMARY_PATH, data["summary"])]:
+            Path(path).touch()
+            version = risk_engine.QTRR_SCHEMA_VERSION if path == risk_warnings.QTRR_PATH else None
+            data_cache.load_columnar(path, reader=lambda _p, df=df: df, version=version)
+            if path == risk_warnings.QTRR_PATH:
+                fundamentals_store.ingest(df, data_cache.source_signature(path))
+
+
+# --- Đo ---
+class Bench:
+    def __init__(self):
+        self.stages = []
+
+    def run(self, name, fn, rows_in=None):
+        # Chạy fn() một lần, ghi thời gian + bộ nhớ đỉnh của riêng bước này
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        result = fn()
+        seconds = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] - base
+        stage = {
+            "name": name,
+            "seconds": round(seconds, 4),
+            "peak_mb": round(peak / 2**20, 2),
+            "rows_in": rows_in,
+        }
+        out = result[0] if isinstance(result, tuple) else result
+        if isinstance(out, (bytes, str)):
+            stage["bytes_out"] = len(out)  # HTML của Styler / file Excel, CSV
+        elif isinstance(out, (pd.DataFrame, pd.Series)):
+            stage["rows_out"] = len(out)
+        self.stages.append(stage)
+        out_desc = f"{stage['bytes_out']} bytes" if "bytes_out" in stage else stage.get("rows_out")
+        print(f"{name:<36} {seconds:>9.3f}s {peak / 2**20:>9.1f} MB  rows {rows_in} -> {out_desc}")
+        return result
+
+
+def run_stages(bench, data, excel):
+    n_qtrr = len(data["qtrr"])
+    n_prices = len(data["prices"])
+
+    # 1. Load
+    if excel:
+        bench.run("load.qtrr_parse", lambda: risk_warnings.load_qtrr(), n_qtrr)
+        bench.run("load.summary_parse", risk_warnings.load_summary)
+    qtrr = bench.run("load.qtrr_cache", lambda: risk_warnings.load_qtrr(), n_qtrr)
+    bench.run("load.cp", risk_warnings.load_cp)
+    bench.run("load.prices", risk_warnings.load_prices, n_prices)
+    flags = bench.run("load.warning_flags_build", risk_warnings.load_warning_flags, n_qtrr)
+
+    # 2. Compute (bảng gốc của từng nhóm)
+    signals, tail = bench.run("compute.volume_signals", lambda: volume_engine.compute_volume_signals(data["prices"]), n_prices)
+    bench.run("compute.volume_write_csv", lambda: signals.to_csv(risk_warnings.VOLUME_PATH, index=False), len(signals))
+    bench.run("compute.volume_partitions", lambda: volume_engine.write_partitions(
+        signals, volume_engine.PARTITION_DIR, risk_warnings.VOLUME_PATH, replace=True), len(signals))
+    tables = {}
+    for name in risk_warnings.GROUPS:
+        tables[name] = bench.run(f"compute.{name}", risk_warnings.GROUPS[name][0], n_qtrr)
+    dim = bench.run("compute.ticker_dim", risk_warnings.load_ticker_dim)
+
+    # Kho qtrr: ingest lại toàn bộ vs. ingest khi có thêm một quý mới cho mọi mã
+    store_dir = _WORKSPACE / "store_bench"
+    bench.run("compute.store_ingest_full", lambda: fundamentals_store.ingest(qtrr, store_dir=store_dir), n_qtrr)
+    next_quarter = risk_engine.compact_qtrr(pd.concat([data["qtrr"], new_quarter(data["qtrr"])], ignore_index=True))
+    bench.run("compute.store_ingest_new_quarter", lambda: fundamentals_store.ingest(next_quarter, store_dir=store_dir),
+              len(next_quarter))
+
+    # 3. Filter (lựa chọn mặc định trên dashboard: kỳ mới nhất)
+    options = risk_engine.period_options(qtrr)
+    latest_year, quarters = next(iter(options["Quý"].items()))
+    latest = [int(risk_engine.period_index(latest_year, quarters[0]))]
+    results = {
+        "Tăng trưởng ảo": bench.run("filter.financial", lambda: risk_warnings.financial_warnings(
+            tables["tang_truong_ao"], "Quý", latest_year, latest), len(tables["tang_truong_ao"])),
+        "BCTC âm": bench.run("filter.cash_flow", lambda: risk_warnings.cash_flow_warnings(
+            tables["bctc_am"], "Quý", min_streak=2), len(tables["bctc_am"])),
+        "So sánh ngành": bench.run("filter.industry", lambda: risk_warnings.industry_comparison(
+            tables["so_sanh_nganh"], "Quý", latest_year, latest, []), len(tables["so_sanh_nganh"])),
+        "Khối lượng giao dịch": tables["khoi_luong"],
+        "Room margin": bench.run("filter.room_margin", lambda: risk_warnings.room_margin(
+            tables["room_margin"], 1.0), len(tables["room_margin"])),
+    }
+    # Ma trận rủi ro: đã sắp theo điểm (chỉ lọc) và sắp lại toàn thị trường theo cột khác
+    matrix = tables["ma_tran_rui_ro"]
+    results["Ma trận rủi ro"] = bench.run("filter.risk_matrix", lambda: risk_warnings.risk_matrix(matrix, "Quý"), len(matrix))
+    bench.run("filter.risk_matrix_sort", lambda: risk_warnings.risk_matrix(
+        matrix, "Quý", sort_col=risk_engine.industry_columns(risk_engine.DEFAULT_INDUSTRY_METRICS[0])[1], ascending=True), len(matrix))
+    bench.run("filter.room_margin_grid", lambda: risk_warnings.room_margin_grid(
+        tables["room_margin"], np.arange(0.5, 50.5, 0.5)), len(tables["room_margin"]))
+    df = results["Tăng trưởng ảo"]
+    bench.run("filter.exchange_sector", lambda: df[risk_engine.ticker_filter_mask(
+        dim, risk_engine.ticker_codes(dim, df["Mã CP"]), ["HOSE"], ["Ngân hàng", "Bất động sản"])], len(df))
+    del flags
+
+    # 4. Style (Styler của dashboard, render ra HTML)
+    for group, df in results.items():
+        bench.run(f"style.{group}", lambda: styling.style_warning_table(df, group).to_html(), len(df))
+
+    # 5. Export
+    for group, df in results.items():
+        bench.run(f"export.excel.{group}", lambda: exporting.excel_bytes({"Data": df}), len(df))
+    bench.run("export.csv.so_sanh_nganh_full", lambda: exporting.csv_bytes(tables["so_sanh_nganh"]), len(tables["so_sanh_nganh"]))
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline_path):
+    # In tỷ lệ thời gian / bộ nhớ so với một lần chạy trước (JSON của benchmark.py)
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {s["name"]: s for s in json.load(f)["stages"]}
+    print(f"\n{'stage':<36} {'base s':>9} {'now s':>9} {'x':>6} {'base MB':>9} {'now MB':>9}")
+    for stage in current["stages"]:
+        old = baseline.get(stage["name"])
+        if old is None:
+            continue
+        ratio = stage["seconds"] / old["seconds"] if old["seconds"] else float("nan")
+        print(f"{stage['name']:<36} {old['seconds']:>9.3f} {stage['seconds']:>9.3f} {ratio:>6.2f} "
+              f"{old['peak_mb']:>9.1f} {stage['peak_mb']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark load/compute/filter/style/export của dashboard trên dữ liệu giả lập.")
+    parser.add_argument("--tickers", type=int, default=1600, help="Số mã")
+    parser.add_argument("--years", type=int, default=20, help="Số năm báo cáo (4 quý + 1 năm mỗi năm)")
+    parser.add_argument("--days", type=int, default=2500, help="Số phiên giá ngày mỗi mã")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-excel", action="store_true", help="Không ghi/parse file Excel (bỏ bước load.*_parse)")
+    parser.add_argument("--out", help="Ghi kết quả JSON vào file (mặc định in ra màn hình)")
+    parser.add_argument("--compare", help="File JSON của lần chạy trước để so sánh")
+    parser.add_argument("--keep", action="store_true", help="Giữ lại thư mục dữ liệu giả lập")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    tickers = make_tickers(args.tickers)
+    cp = make_cp(tickers, rng)
+    end_date = datetime(2025, 6, 30)
+    data = {
+        "cp": cp,
+        "summary": make_summary(tickers, rng),
+        "qtrr": make_qtrr(cp, args.years, end_date.year, rng),
+        "prices": make_prices(tickers, args.days, end_date, rng),
+    }
+
+    os.chdir(_WORKSPACE)
+    setup_started = time.perf_counter()
+    write_workspace(data, excel=not args.no_excel)
+    print(f"Dữ liệu giả lập: {len(data['qtrr'])} dòng qtrr, {len(data['prices'])} dòng giá "
+          f"({time.perf_counter() - setup_started:.1f}s) tại {_WORKSPACE}")
+
+    bench = Bench()
+    tracemalloc.start()
+    try:
+        run_stages(bench, data, excel=not args.no_excel)
+    finally:
+        tracemalloc.stop()
+        os.chdir(REPO_DIR)
+        if not args.keep:
+            import shutil
+            shutil.rmtree(_WORKSPACE, ignore_errors=True)
+
+    result = {
+        "meta": {
+            "commit": git_commit(),
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "params": {k: v for k, v in vars(args).items() if k not in ("out", "compare", "keep")},
+            "rows": {"qtrr": len(data["qtrr"]), "prices": len(data["prices"])},
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            # ru_maxrss: KB trên Linux
+            "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        },
+        "stages": bench.stages,
+    }
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"Đã ghi {args.out}")
+    else:
+        json.dump(result, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    if args.compare:
+        compare(result, args.compare)
+
+
+if __name__ == "__main__":
+    main()
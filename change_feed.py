@@ -0,0 +1,239 @@
+# --- Thay đổi cảnh báo giữa hai phiên bản dữ liệu (change feed) ---
+# Mỗi lần batch ghi snapshot mới, bảng gốc của từng nhóm được so với snapshot trước:
+#   1. mỗi bảng được rút gọn thành các dòng cảnh báo (Xem, Mã CP) -> Kỳ, Mức, Chi tiết
+#      (vd. BCTC âm: Mức = số kỳ CFO âm liên tiếp của kỳ mới nhất, chỉ giữ Mức >= 2)
+#   2. hai phiên bản được ghép theo hash của khoá (Index.get_indexer), không so từng dòng
+#      -> Mới / Hết cảnh báo / Tăng mức / Giảm mức / Đổi nội dung
+# Các thay đổi được nối vào một file lịch sử gọn (snapshots/changes.*, giữ KEEP_DAYS ngày)
+# để dashboard xem lại nhanh ("Thay đổi mới").
+# Room margin không có ở đây: đó là hạn mức tính theo vốn nhập vào, không phải cờ cảnh báo.
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import data_cache
+import risk_engine
+
+HISTORY_NAME = "changes"
+KEEP_DAYS = 90
+# BCTC âm: số kỳ CFO âm liên tiếp tối thiểu để tính là cảnh báo
+MIN_STREAK = 2
+
+ADDED, REMOVED, ESCALATED, EASED, CHANGED = "Mới", "Hết cảnh báo", "Tăng mức", "Giảm mức", "Đổi nội dung"
+KINDS = [ADDED, ESCALATED, CHANGED, EASED, REMOVED]
+SIGNAL_COLS = ["Xem", "Mã CP", "Kỳ", "Mức", "Chi tiết"]
+KEY_COLS = ["Xem", "Mã CP"]
+HISTORY_COLS = ["Thời điểm", "Phiên bản", "Nhóm", "Thay đổi", "Xem", "Mã CP", "Kỳ", "Mức trước", "Mức", "Chi tiết"]
+
+# tên nhóm (risk_warnings.GROUPS) -> tên hiển thị
+GROUP_LABELS = {
+    "tang_truong_ao": "Tăng trưởng ảo",
+    "bctc_am": "BCTC âm",
+    "so_sanh_nganh": "So sánh ngành",
+    "gdkq_hose": "GDKQ HOSE",
+    "gdkq_hnx_khong_ky_quy": "GDKQ HNX - Không được ký quỹ",
+    "gdkq_hnx_tinh_trang": "GDKQ HNX - Tình trạng chứng khoán",
+    "khoi_luong": "Khối lượng giao dịch",
+}
+
+
+# --- Bảng gốc của nhóm -> các dòng cảnh báo ---
+def _signals(view, ticker, period, level, detail):
+    df = pd.DataFrame({
+        "Xem": view, "Mã CP": ticker, "Kỳ": period, "Mức": level, "Chi tiết": detail,
+    })
+    df = df.astype({"Xem": str, "Mã CP": str, "Kỳ": str, "Chi tiết": str, "Mức": "int64"})
+    df["Mã CP"] = df["Mã CP"].str.strip().str.upper()
+    if df.duplicated(KEY_COLS).any():
+        # Nhiều dòng cho cùng (Xem, Mã CP) (vd. một mã có nhiều lý do trong danh sách GDKQ):
+        # gộp mọi nội dung (sắp xếp, không phụ thuộc thứ tự dòng trong file), lấy mức cao nhất
+        df = df.groupby(KEY_COLS, sort=False, as_index=False).agg({
+            "Kỳ": "first", "Mức": "max", "Chi tiết": lambda s: "; ".join(sorted(set(s) - {""})),
+        })
+    return df.reset_index(drop=True)
+
+
+def _latest(table):
+    # Kỳ mới nhất của mỗi (view, Ticker)
+    table = table.sort_values("PeriodIdx", ascending=False, kind="stable")
+    return table.drop_duplicates(["view", "Ticker"])
+
+
+def _fake_growth(table):
+    df = _latest(table)
+    df = df[df[risk_engine.FAKE_GROWTH_COL] == "🚩"]
+    return _signals(df["view"].to_numpy(), df["Ticker"].to_numpy(), df["KyBaoCao"].to_numpy(), 1,
+                    "🚩 CFO âm, doanh thu dương 2 kỳ liên tiếp")
+
+
+def _negative_streak(table):
+    col = risk_engine.negative_streak_col(risk_engine.CFO_COL)
+    df = table[table[col] >= MIN_STREAK]
+    return _signals(df["view"].to_numpy(), df["Ticker"].to_numpy(), df["KyBaoCao"].to_numpy(), df[col].to_numpy(),
+                    "CFO âm " + df[col].astype(str) + " kỳ liên tiếp")
+
+
+def _below_industry(table):
+    # Mức = số chỉ số mặc định (BLN Gộp, BLN Ròng) thấp hơn trung bình ngành ở kỳ mới nhất
+    df = _latest(table)
+    level = np.zeros(len(df), dtype=np.int64)
+    detail = pd.Series("", index=df.index)
+    for metric in risk_engine.DEFAULT_INDUSTRY_METRICS:
+        diff_col = risk_engine.industry_columns(metric)[1]
+        if diff_col not in df.columns:
+            continue
+        below = (df[diff_col] < 0).to_numpy()
+        level += below
+        label = risk_engine.INDUSTRY_METRICS[metric][0]
+        detail = detail.where(~below, detail + np.where(detail == "", "", ", ") + label)
+    keep = level > 0
+    df = df[keep]
+    return _signals(df["view"].to_numpy(), df["Ticker"].to_numpy(), df["KyBaoCao"].to_numpy(), level[keep],
+                    "Dưới TB ngành: " + detail[keep])
+
+
+def _margin_list(table):
+    col = risk_engine.ticker_column(table)
+    if col is None:
+        return pd.DataFrame(columns=SIGNAL_COLS)
+    reason = next((c for c in ["Lý do", "LÝ DO"] if c in table.columns), None)
+    detail = table[reason].fillna("").to_numpy() if reason else ""
+    return _signals("", table[col].to_numpy(), "", 1, detail)
+
+
+def _volume_breakout(table):
+    flags = [table.get(c, pd.Series(False, index=table.index)).fillna(False).astype(bool).to_numpy()
+             for c in ["Đột biến Vol 100", "Đột biến Vol 200"]]
+    level = np.select([flags[1], flags[0]], [2, 1], default=0)
+    keep = level > 0
+    df = table[keep]
+    return _signals("", df["Mã CP"].to_numpy(), df["Ngày"].to_numpy(), level[keep],
+                    np.where(level[keep] == 2, "Đột biến Vol 200", "Đột biến Vol 100"))
+
+
+SIGNALS = {
+    "tang_truong_ao": _fake_growth,
+    "bctc_am": _negative_streak,
+    "so_sanh_nganh": _below_industry,
+    "gdkq_hose": _margin_list,
+    "gdkq_hnx_khong_ky_quy": _margin_list,
+    "gdkq_hnx_tinh_trang": _margin_list,
+    "khoi_luong": _volume_breakout,
+}
+
+
+def signals(name, table):
+    if table is None or table.empty:
+        return pd.DataFrame(columns=SIGNAL_COLS)
+    return SIGNALS[name](table)
+
+
+# --- So sánh hai phiên bản ---
+def _key_hash(df):
+    return pd.util.hash_pandas_object(df[KEY_COLS].astype(str), index=False).to_numpy()
+
+
+def diff_signals(old, new):
+    # Ghép hai bảng cảnh báo theo hash của (Xem, Mã CP); trả về các dòng thay đổi (cột Thay đổi, Mức trước...)
+    position = pd.Index(_key_hash(old)).get_indexer(_key_hash(new))
+    matched = position >= 0
+    old_level = np.full(len(new), np.nan)
+    old_level[matched] = old["Mức"].to_numpy()[position[matched]]
+    old_detail = np.full(len(new), "", dtype=object)
+    old_detail[matched] = old["Chi tiết"].to_numpy(object)[position[matched]]
+
+    level = new["Mức"].to_numpy()
+    kind = np.select(
+        [~matched, level > old_level, level < old_level, new["Chi tiết"].to_numpy(object) != old_detail],
+        [ADDED, ESCALATED, EASED, CHANGED],
+        default="",
+    )
+    changes = new.assign(**{"Thay đổi": kind, "Mức trước": old_level})[kind != ""]
+
+    removed = np.ones(len(old), dtype=bool)
+    removed[position[matched]] = False
+    gone = old[removed].assign(**{"Thay đổi": REMOVED, "Mức trước": old["Mức"][removed].astype("float64"), "Mức": 0})
+    return pd.concat([changes, gone], ignore_index=True)
+
+
+def diff_snapshot(run_dir, manifest, previous):
+    # Thay đổi của mọi nhóm giữa snapshot (run_dir, manifest) và snapshot trước (prev_dir, prev_manifest).
+    # Nhóm có cùng phiên bản file nguồn (và cùng version logic) với lần trước thì bỏ qua (không đổi).
+    if previous is None:
+        return pd.DataFrame(columns=HISTORY_COLS)
+    prev_dir, prev_manifest = previous
+    same_logic = prev_manifest.get("versions") == manifest.get("versions")
+    frames = []
+    for name, entry in manifest["groups"].items():
+        prev_entry = prev_manifest["groups"].get(name)
+        if name not in SIGNALS or prev_entry is None or (same_logic and prev_entry["sources"] == entry["sources"]):
+            continue
+        try:
+            old = signals(name, data_cache.read_frame(Path(prev_dir) / prev_entry["file"]))
+            new = signals(name, data_cache.read_frame(Path(run_dir) / entry["file"]))
+        except Exception:
+            continue  # Snapshot trước đã bị xoá/hỏng -> không so được nhóm này
+        frames.append(diff_signals(old, new).assign(**{"Nhóm": GROUP_LABELS[name]}))
+    if not frames:
+        return pd.DataFrame(columns=HISTORY_COLS)
+    changes = pd.concat(frames, ignore_index=True)
+    return changes.assign(**{"Thời điểm": manifest["created"], "Phiên bản": manifest["run_id"]})[HISTORY_COLS]
+
+
+# --- Lịch sử ---
+def history_path(snapshot_dir):
+    # File lịch sử hiện có (Arrow / Parquet / pickle tuỳ môi trường), None nếu chưa có
+    for suffix in (".arrow", ".parquet", ".pkl"):
+        path = Path(snapshot_dir) / f"{HISTORY_NAME}{suffix}"
+        if path.exists():
+            return path
+    return None
+
+
+def read_history(snapshot_dir):
+    path = history_path(snapshot_dir)
+    if path is None:
+        return pd.DataFrame(columns=HISTORY_COLS)
+    return data_cache.read_frame(path)
+
+
+def append_history(snapshot_dir, changes, keep_days=KEEP_DAYS):
+    # Nối thay đổi của lần chạy này vào lịch sử, bỏ các dòng cũ hơn keep_days ngày.
+    # Trả về số dòng đã thêm.
+    if changes.empty:
+        return 0
+    history = read_history(snapshot_dir)
+    cutoff = (datetime.now() - timedelta(days=keep_days)).isoformat(timespec="seconds")
+    history = history[history["Thời điểm"].astype(str) >= cutoff]
+    combined = pd.concat([history.astype(object), changes.astype(object)], ignore_index=True)
+    combined = combined.astype({
+        "Thời điểm": str, "Phiên bản": str, "Kỳ": str, "Chi tiết": str, "Mã CP": str,
+        "Nhóm": "category", "Thay đổi": "category", "Xem": "category",
+        "Mức trước": "float64", "Mức": "int64",
+    })
+    old_path = history_path(snapshot_dir)
+    path = data_cache.write_frame(
+        combined, Path(snapshot_dir) / f"{HISTORY_NAME}.parquet", Path(snapshot_dir) / f"{HISTORY_NAME}.pkl"
+    )
+    if old_path is not None and old_path != path:
+        old_path.unlink(missing_ok=True)
+    return len(changes)
+
+
+def filter_changes(history, runs=None, since=None, groups=None, kinds=None):
+    # runs: chỉ các phiên bản (run_id) này; since: chỉ thay đổi từ thời điểm này (chuỗi ISO).
+    # Mới nhất trước, trong cùng lần cập nhật theo nhóm và mã.
+    mask = np.ones(len(history), dtype=bool)
+    if runs is not None:
+        mask &= history["Phiên bản"].isin(runs).to_numpy()
+    if since is not None:
+        mask &= (history["Thời điểm"] >= since).to_numpy()
+    if groups:
+        mask &= history["Nhóm"].isin(groups).to_numpy()
+    if kinds:
+        mask &= history["Thay đổi"].isin(kinds).to_numpy()
+    df = history[mask]
+    df = df.sort_values(["Thời điểm", "Nhóm", "Mã CP"], ascending=[False, True, True], kind="stable")
+    return df.drop(columns=["Phiên bản"]).reset_index(drop=True)
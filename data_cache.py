@@ -0,0 +1,280 @@
+# --- Columnar cache cho các file dữ liệu nguồn (xlsx/csv) ---
+# Mỗi file nguồn được parse một lần rồi lưu dạng cột (Arrow IPC, fallback Parquet / pickle)
+# trong CACHE_DIR. Tên file cache chứa mtime + size của file nguồn nên khi file
+# nguồn thay đổi thì cache cũ tự động không còn được dùng (và được xoá bằng prune_stale
+# sau khi batch đã publish phiên bản mới).
+#
+# File Arrow IPC (không nén) được memory-map khi đọc: các cột số và mã của cột category
+# trỏ thẳng vào vùng map (không copy), nên mọi process/worker Streamlit đọc cùng một
+# phiên bản dữ liệu dùng chung page cache của OS thay vì mỗi process một bản trên heap.
+# Mảng đọc ra là read-only -> không sửa DataFrame tại chỗ (tạo cột mới / copy trước).
+import json
+import os
+import pickle
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import profiling
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow là optional, fallback sang pickle
+    pa = ipc = pq = None
+
+try:
+    import python_calamine  # noqa: F401  (optional: đọc xlsx nhanh hơn openpyxl nhiều lần)
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    EXCEL_ENGINE = None  # mặc định của pandas (openpyxl)
+
+CACHE_DIR = Path(os.environ.get("QTRR_CACHE_DIR", ".cache"))
+# QTRR_MMAP=0: không ghi file Arrow, quay về Parquet (đọc vào heap của từng process)
+USE_MMAP = os.environ.get("QTRR_MMAP", "1") == "1"
+ARROW_INDEX_KEY = "qtrr.index"
+
+
+def source_signature(path):
+    # (mtime_ns, size) của file nguồn; None nếu file không tồn tại
+    try:
+        st_ = os.stat(path)
+    except OSError:
+        return None
+    return (st_.st_mtime_ns, st_.st_size)
+
+
+def _cache_stem(path):
+    # result/qtrr_output1.xlsx -> result__qtrr_output1.xlsx
+    return str(Path(path)).replace(os.sep, "__").replace("/", "__")
+
+
+def _cache_files(stem, signature):
+    stem = f"{stem}-{signature[0]}-{signature[1]}"
+    return CACHE_DIR / f"{stem}.arrow", CACHE_DIR / f"{stem}.parquet", CACHE_DIR / f"{stem}.pkl"
+
+
+def read_excel(path, **kwargs):
+    return pd.read_excel(path, engine=EXCEL_ENGINE, **kwargs)
+
+
+def _read_source(path, reader):
+    if reader is not None:
+        return reader(path)
+    if str(path).lower().endswith(".csv"):
+        return pd.read_csv(path)
+    return read_excel(path)
+
+
+def _cache_source(name):
+    # Tên file cache -> (stem file nguồn, chữ ký); None nếu không phải file cache.
+    # "warning_flags.v4.q3@result__qtrr_output1.xlsx-<mtime>-<size>.arrow" -> ("result__qtrr_output1.xlsx", (mtime, size))
+    stem, _, suffix = name.rpartition(".")
+    parts = stem.rsplit("-", 2)
+    if suffix not in ("arrow", "parquet", "pkl") or len(parts) != 3 or not (parts[1].isdigit() and parts[2].isdigit()):
+        return None
+    return parts[0].split("@")[-1], (int(parts[1]), int(parts[2]))
+
+
+def prune_stale(*signature_maps):
+    # Xoá các bản cache (nguồn + dẫn xuất) của phiên bản file nguồn cũ.
+    # signature_maps: các dict {file nguồn: chữ ký còn dùng}. Chỉ gọi sau khi phiên bản mới đã được
+    # publish (risk_warnings.run_batch): trước đó request vẫn đọc cache của chữ ký đang publish.
+    keep = {}
+    for signatures in signature_maps:
+        for path, sig in signatures.items():
+            keep.setdefault(_cache_stem(path), set()).add(tuple(sig) if sig else None)
+    removed = 0
+    for f in CACHE_DIR.glob("*"):
+        source = _cache_source(f.name)
+        if source is None:
+            continue
+        stem, signature = source
+        base = next((k for k in keep if stem == k or stem.startswith(f"{k}.v")), None)
+        if base is None or signature in keep[base]:
+            continue
+        try:
+            f.unlink()
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def _arrow_table(df):
+    # DataFrame -> pyarrow.Table để ghi IPC. Chỉ nhận những gì đọc lại được nguyên vẹn:
+    # tên cột là str, cột số/ngày (numpy), category, chuỗi. Index khác RangeIndex mặc định
+    # được ghi thành các cột đầu bảng, tên các level lưu trong metadata của schema.
+    # Kiểu khác (object lẫn kiểu, Int64...) -> ValueError, write_frame dùng Parquet.
+    if not df.columns.is_unique or not all(isinstance(c, str) for c in df.columns):
+        raise ValueError("tên cột phải là str và không trùng")
+    index_names = []
+    index = df.index
+    if not (isinstance(index, pd.RangeIndex) and index.start == 0 and index.step == 1):
+        index_names = [
+            name if name is not None else f"__index_level_{i}__" for i, name in enumerate(index.names)
+        ]
+        if not all(isinstance(n, str) for n in index_names) or set(index_names) & set(df.columns):
+            raise ValueError("tên level của index phải là str và khác tên cột")
+        df = df.reset_index(names=index_names)
+    arrays = []
+    for name in df.columns:
+        s = df[name]
+        if isinstance(s.dtype, np.dtype) and s.dtype.kind == "f":
+            # NaN giữ nguyên là giá trị (không đổi thành null) -> đọc lại không cần copy
+            arrays.append(pa.array(s.to_numpy(), from_pandas=False))
+        elif (isinstance(s.dtype, np.dtype) and s.dtype.kind in "biuM") or isinstance(
+            s.dtype, (pd.CategoricalDtype, pd.StringDtype, pd.DatetimeTZDtype)
+        ):
+            arrays.append(pa.Array.from_pandas(s))
+        else:
+            raise ValueError(f"cột {name!r}: kiểu {s.dtype} không ghi Arrow")
+    metadata = {ARROW_INDEX_KEY: json.dumps(index_names)} if index_names else None
+    return pa.Table.from_arrays(arrays, names=list(df.columns), metadata=metadata)
+
+
+def _write_arrow(df, path):
+    table = _arrow_table(df)
+    with pa.OSFile(str(path), "wb") as sink:
+        with ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+def _arrow_column(column):
+    # Cột Arrow (trên vùng memory map) -> mảng pandas, không copy khi có thể
+    if column.num_chunks == 1 and pa.types.is_dictionary(column.type):
+        chunk = column.chunk(0)
+        indices = chunk.indices
+        if indices.null_count:
+            indices = indices.fill_null(-1)
+        dtype = pd.CategoricalDtype(chunk.dictionary.to_pandas(), ordered=chunk.type.ordered)
+        return pd.Categorical.from_codes(indices.to_numpy(zero_copy_only=False), dtype=dtype, validate=False)
+    # Cột số không có null -> numpy view trên buffer Arrow
+    return column.to_pandas().array
+
+
+def _read_arrow(path, columns=None):
+    table = ipc.open_file(pa.memory_map(str(path), "r")).read_all()
+    index_names = json.loads((table.schema.metadata or {}).get(ARROW_INDEX_KEY.encode(), b"[]"))
+    if columns is not None:
+        keep = set(columns) | set(index_names)
+        table = table.select([c for c in table.column_names if c in keep])
+    df = pd.DataFrame(
+        {name: _arrow_column(table.column(name)) for name in table.column_names},
+        index=pd.RangeIndex(table.num_rows),
+        copy=False,
+    )
+    if index_names:
+        df = df.set_index(index_names)
+        df.index.names = [None if n.startswith("__index_level_") else n for n in index_names]
+    if columns is not None:
+        df = df[[c for c in columns if c in df.columns]]
+    return df
+
+
+def write_frame(df, parquet_path, pickle_path):
+    # Ghi DataFrame ra Arrow IPC <tên>.arrow cạnh parquet_path (fallback Parquet, rồi pickle),
+    # trả về đường dẫn file đã ghi
+    parquet_path, pickle_path = Path(parquet_path), Path(pickle_path)
+    parquet_path.parent.mkdir(parents=True, exist_ok=True)
+    # Ghi ra file tạm rồi os.replace để process khác không đọc phải file ghi dở
+    if pa is not None and USE_MMAP:
+        arrow_path = parquet_path.with_suffix(".arrow")
+        tmp = arrow_path.with_name(f"{arrow_path.name}.{os.getpid()}.tmp")
+        try:
+            _write_arrow(df, tmp)
+            os.replace(tmp, arrow_path)
+            return arrow_path
+        except Exception:
+            # Kiểu cột không ghi được Arrow IPC -> dùng Parquet
+            if tmp.exists():
+                tmp.unlink()
+    if pq is not None:
+        tmp = parquet_path.with_name(f"{parquet_path.name}.{os.getpid()}.tmp")
+        try:
+            df.to_parquet(tmp)
+            os.replace(tmp, parquet_path)
+            return parquet_path
+        except Exception:
+            # Cột object lẫn kiểu dữ liệu không ghi được Parquet -> dùng pickle
+            if tmp.exists():
+                tmp.unlink()
+    tmp = pickle_path.with_name(f"{pickle_path.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, pickle_path)
+    return pickle_path
+
+
+def read_frame(cache_path, columns=None):
+    cache_path = Path(cache_path)
+    if cache_path.suffix == ".arrow":
+        return _read_arrow(cache_path, columns)
+    if cache_path.suffix == ".parquet":
+        if columns is not None:
+            names = pq.ParquetFile(cache_path).schema_arrow.names
+            columns = [c for c in columns if c in names]
+        return pd.read_parquet(cache_path, columns=columns)
+    with open(cache_path, "rb") as f:
+        df = pickle.load(f)
+    if columns is not None:
+        df = df[[c for c in columns if c in df.columns]]
+    return df
+
+
+def load_columnar(path, columns=None, reader=None, signature=None, version=None):
+    # Đọc file nguồn qua cache dạng cột.
+    # columns: chỉ đọc các cột cần thiết (cột không có trong file sẽ bị bỏ qua).
+    # reader: hàm parse file nguồn (mặc định read_excel / read_csv theo đuôi file).
+    # version: đổi khi reader đổi kết quả (vd. schema) để không dùng lại cache cũ.
+    if signature is None:
+        signature = source_signature(path)
+    if signature is None:
+        raise FileNotFoundError(path)
+
+    stem = _cache_stem(path) if version is None else f"{_cache_stem(path)}.v{version}"
+    return _load_or_build(stem, signature, lambda: _read_source(path, reader), columns)
+
+
+def load_derived(name, source_path, builder, version=1, columns=None, signature=None):
+    # Bảng dẫn xuất (vd. bảng cờ cảnh báo) tính từ một file nguồn: chỉ build lại
+    # khi file nguồn thay đổi hoặc khi tăng version của logic tính toán.
+    if signature is None:
+        signature = source_signature(source_path)
+    if signature is None:
+        raise FileNotFoundError(source_path)
+    stem = f"{name}.v{version}@{_cache_stem(source_path)}"
+    return _load_or_build(stem, signature, builder, columns)
+
+
+def _load_or_build(stem, signature, builder, columns):
+    arrow_path, parquet_path, pickle_path = _cache_files(stem, signature)
+    for cache_path in (arrow_path, parquet_path, pickle_path):
+        if cache_path.exists() and (cache_path.suffix == ".pkl" or pa is not None):
+            try:
+                return read_frame(cache_path, columns)
+            except Exception:
+                # File cache hỏng -> build lại từ nguồn
+                break
+
+    # Parse file nguồn / tính bảng dẫn xuất (hiện trong expander debug nếu xảy ra trong request)
+    with profiling.span(f"build:{stem}"):
+        df = builder()
+    try:
+        # Bản cache của chữ ký cũ không xoá ở đây (có thể vẫn đang được publish), xem prune_stale
+        cache_path = write_frame(df, parquet_path, pickle_path)
+        if cache_path.suffix == ".arrow":
+            # Dùng bản memory-map ngay cả ở process vừa build (bản trên heap được giải phóng)
+            return read_frame(cache_path, columns)
+    except OSError:
+        pass  # Không ghi được cache (read-only FS...) thì vẫn trả dữ liệu
+    if columns is not None:
+        df = df[[c for c in columns if c in df.columns]]
+    return df
+
+
+def data_version(*paths):
+    # Phiên bản của một nhóm file nguồn = tuple chữ ký của từng file
+    return tuple(source_signature(p) for p in paths)
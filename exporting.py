@@ -0,0 +1,97 @@
+# --- Xuất dữ liệu (Excel/CSV) theo yêu cầu ---
+# File chỉ được tạo khi người dùng bấm nút tải (st.download_button nhận callable),
+# kết quả được cache theo hash của trạng thái bộ lọc + phiên bản dữ liệu.
+import hashlib
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import pandas as pd
+
+import filter_memo
+
+try:
+    import xlsxwriter  # noqa: F401  (optional: ghi Excel constant-memory)
+    HAS_XLSXWRITER = True
+except ImportError:
+    HAS_XLSXWRITER = False
+
+EXCEL_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+CSV_MIME = "text/csv"
+FORMATS = ["Excel", "CSV"]
+
+# Trên ngưỡng này Excel được ghi bằng xlsxwriter constant-memory (nếu có cài)
+STREAMING_ROW_THRESHOLD = 50_000
+# Số file đã tạo được giữ lại trong bộ nhớ
+MAX_CACHED_EXPORTS = 16
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def state_key(*parts):
+    # Hash ổn định cho trạng thái bộ lọc (list/set được chuẩn hoá thành tuple đã sắp xếp)
+    return hashlib.sha1(repr(filter_memo.normalize(parts)).encode("utf-8")).hexdigest()
+
+
+def _safe_sheet_name(name):
+    # Excel: tối đa 31 ký tự, không chứa []:*?/\
+    for ch in '[]:*?/\\':
+        name = name.replace(ch, " ")
+    return name[:31] or "Sheet"
+
+
+def excel_bytes(sheets, streaming=None):
+    # sheets: {tên sheet: DataFrame}
+    if streaming is None:
+        streaming = sum(len(df) for df in sheets.values()) > STREAMING_ROW_THRESHOLD
+    buffer = BytesIO()
+    if streaming and HAS_XLSXWRITER:
+        writer = pd.ExcelWriter(buffer, engine="xlsxwriter", engine_kwargs={"options": {"constant_memory": True}})
+    else:
+        writer = pd.ExcelWriter(buffer, engine="openpyxl")
+    with writer:
+        for name, df in sheets.items():
+            df.to_excel(writer, index=False, sheet_name=_safe_sheet_name(name))
+    return buffer.getvalue()
+
+
+def csv_bytes(df):
+    # utf-8-sig để Excel mở đúng tiếng Việt
+    return df.to_csv(index=False).encode("utf-8-sig")
+
+
+def file_info(fmt, base_name):
+    # (tên file, mime) theo định dạng
+    if fmt == "CSV":
+        return f"{base_name}.csv", CSV_MIME
+    return f"{base_name}.xlsx", EXCEL_MIME
+
+
+def cached(key, build):
+    # Trả bytes đã tạo cho key, nếu chưa có thì gọi build() (LRU, tối đa MAX_CACHED_EXPORTS)
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    data = build()
+    with _lock:
+        _cache[key] = data
+        _cache.move_to_end(key)
+        while len(_cache) > MAX_CACHED_EXPORTS:
+            _cache.popitem(last=False)
+    return data
+
+
+def deferred(key, df, fmt="Excel", sheet_name="Data"):
+    # Callable cho st.download_button: chỉ chạy khi người dùng bấm tải
+    def build():
+        if fmt == "CSV":
+            return csv_bytes(df)
+        return excel_bytes({sheet_name: df})
+    return lambda: cached((key, fmt), build)
+
+
+def deferred_sheets(key, build_sheets):
+    # Như deferred() nhưng cho file Excel nhiều sheet; build_sheets() -> {tên: DataFrame}
+    return lambda: cached((key, "sheets"), lambda: excel_bytes(build_sheets()))
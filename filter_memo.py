@@ -0,0 +1,96 @@
+# --- Memo kết quả lọc theo trạng thái bộ lọc ---
+# Kết quả lọc (DataFrame, chỉ đọc) được giữ trong một LRU dùng chung cho mọi session,
+# key là tuple đã chuẩn hoá của (phiên bản dữ liệu, nhóm, các lựa chọn trên widget).
+# Cùng bộ lọc (rất hay gặp khi nhiều người cùng xem một nhóm) thì trả về ngay.
+# Giới hạn theo số kết quả và tổng dung lượng, đặt bằng env hoặc configure().
+import os
+import threading
+from collections import OrderedDict
+
+import profiling
+
+MAX_ENTRIES = int(os.environ.get("QTRR_FILTER_MEMO_ENTRIES", 128))
+MAX_MB = float(os.environ.get("QTRR_FILTER_MEMO_MB", 256))
+
+_cache = OrderedDict()  # key -> (DataFrame, số byte)
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "evictions": 0, "bytes": 0}
+
+
+def normalize(v):
+    # Giá trị hashable, ổn định: dict/set -> tuple đã sắp xếp, list/tuple -> tuple (giữ thứ tự).
+    # Lựa chọn không phụ thuộc thứ tự (mã, sàn, ngành...) nên truyền vào dạng set/frozenset.
+    if isinstance(v, dict):
+        return tuple(sorted((k, normalize(x)) for k, x in v.items()))
+    if isinstance(v, (list, tuple, set, frozenset)):
+        items = [normalize(x) for x in v]
+        return tuple(sorted(items, key=repr)) if isinstance(v, (set, frozenset)) else tuple(items)
+    if hasattr(v, "tolist"):
+        return normalize(v.tolist())  # numpy array/scalar
+    return v
+
+
+def configure(max_entries=None, max_mb=None):
+    global MAX_ENTRIES, MAX_MB
+    with _lock:
+        if max_entries is not None:
+            MAX_ENTRIES = max_entries
+        if max_mb is not None:
+            MAX_MB = max_mb
+        _evict()
+
+
+def clear():
+    with _lock:
+        _cache.clear()
+        _stats["bytes"] = 0
+
+
+def stats():
+    with _lock:
+        return {**_stats, "entries": len(_cache)}
+
+
+def _nbytes(df):
+    # DataFrame, hoặc tuple mảng numpy (vd. danh sách dòng theo mã)
+    if isinstance(df, tuple):
+        return sum(_nbytes(v) for v in df)
+    try:
+        return int(df.memory_usage(index=True, deep=True).sum())
+    except Exception:
+        return int(getattr(df, "nbytes", 0))
+
+
+def _evict():
+    # Bỏ kết quả dùng lâu nhất cho tới khi nằm trong giới hạn (gọi khi đang giữ _lock)
+    budget = MAX_MB * 2**20
+    while _cache and (len(_cache) > MAX_ENTRIES or _stats["bytes"] > budget):
+        _, (_, size) = _cache.popitem(last=False)
+        _stats["bytes"] -= size
+        _stats["evictions"] += 1
+
+
+def cached(key, build):
+    # Kết quả cho key, nếu chưa có thì build() rồi giữ lại. Kết quả dùng chung -> không sửa tại chỗ.
+    key = normalize(key)
+    with _lock:
+        entry = _cache.get(key)
+        if entry is not None:
+            _cache.move_to_end(key)
+            _stats["hits"] += 1
+    profiling.count_cache("filter_memo", hit=entry is not None)
+    if entry is not None:
+        return entry[0]
+
+    df = build()
+    size = _nbytes(df)
+    with _lock:
+        _stats["misses"] += 1
+        if MAX_ENTRIES > 0 and size <= MAX_MB * 2**20:
+            old = _cache.pop(key, None)
+            if old is not None:
+                _stats["bytes"] -= old[1]
+            _cache[key] = (df, size)
+            _stats["bytes"] += size
+            _evict()
+    return df
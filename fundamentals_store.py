@@ -0,0 +1,297 @@
+# --- Kho dữ liệu cơ bản (qtrr) append-only theo (mã, kỳ) ---
+# Mỗi khi qtrr_output1.xlsx được ghi lại (thường chỉ thêm một quý mới hoặc vài mã điều chỉnh số liệu),
+# file được so sánh với phiên bản trước theo khoá (Ticker, KyBaoCao) + hash của cả dòng:
+#   - chỉ các dòng mới / bị điều chỉnh / bị xoá được ghi thêm vào log (segments/, không sửa segment cũ)
+#   - cờ cảnh báo (chuỗi kỳ âm, tăng trưởng ảo) chỉ tính lại cho các mã bị ảnh hưởng
+#   - rank ngành chỉ tính lại cho các nhóm (view, kỳ, ngành) bị ảnh hưởng
+# Trạng thái mới nhất (qtrr, bảng cờ, bảng so sánh ngành) được lưu sẵn để dashboard/batch đọc
+# (risk_warnings.load_qtrr / load_warning_flags / load_industry_table dùng kho này khi build cache).
+#
+# Chạy:
+#   python fundamentals_store.py             # ingest file qtrr hiện tại (nếu đã đổi)
+#   python fundamentals_store.py --full      # tính lại toàn bộ cờ/rank (không dùng bản trước)
+#   python fundamentals_store.py --log 5     # xem 5 lần ingest gần nhất
+import argparse
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import data_cache
+import profiling
+import risk_engine
+
+QTRR_PATH = os.path.join("result", "qtrr_output1.xlsx")
+STORE_DIR = Path(os.environ.get("QTRR_STORE_DIR", os.path.join("store", "qtrr")))
+MANIFEST_NAME = "manifest.json"
+SEGMENT_DIR = "segments"
+LOCK_NAME = ".lock"
+# File khoá cũ hơn mức này được coi là bị bỏ lại (process ingest bị tắt giữa chừng)
+LOCK_TIMEOUT_SECONDS = 10 * 60
+
+KEY_COLS = ["Ticker", "KyBaoCao"]
+# Quá tỷ lệ mã bị ảnh hưởng này (vd. quý mới của cả thị trường) thì tính lại toàn bộ nhanh hơn ghép
+INCREMENTAL_MAX_SHARE = 0.5
+OP_COL = "_op"  # "upsert" (dòng mới/điều chỉnh) hoặc "delete" (dòng không còn trong file)
+SEQ_COL = "_seq"
+# Các bảng lưu sẵn của trạng thái mới nhất -> version của logic tính bảng đó
+ARTIFACTS = {
+    "qtrr": risk_engine.QTRR_SCHEMA_VERSION,
+    "flags": risk_engine.FLAG_STORE_VERSION,
+    "industry": risk_engine.INDUSTRY_TABLE_VERSION,
+}
+
+_lock = threading.Lock()
+
+
+def read_manifest(store_dir=STORE_DIR):
+    # {"signature", "versions", "artifacts": {tên: file}, "segments": [...]}; None nếu kho trống
+    try:
+        with open(Path(store_dir) / MANIFEST_NAME, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_manifest(store_dir, manifest):
+    path = Path(store_dir) / MANIFEST_NAME
+    tmp = path.with_name(f"{MANIFEST_NAME}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+@contextmanager
+def _store_lock(store_dir):
+    # Một process/thread ingest tại một thời điểm (dashboard và refresher có thể cùng gặp file mới)
+    path = Path(store_dir) / LOCK_NAME
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with _lock:
+        while True:
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - os.stat(path).st_mtime > LOCK_TIMEOUT_SECONDS:
+                        os.unlink(path)
+                        continue
+                except OSError:
+                    continue
+                time.sleep(0.2)
+        try:
+            os.write(fd, str(os.getpid()).encode())
+            os.close(fd)
+            yield
+        finally:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+def row_keys(df):
+    # Khoá (mã, kỳ) của từng dòng dưới dạng hash uint64 (theo giá trị, không phụ thuộc category)
+    return pd.util.hash_pandas_object(df[KEY_COLS], index=False).to_numpy()
+
+
+def row_hashes(df):
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+
+def diff(old, new):
+    # So sánh hai phiên bản qtrr (đã compact, cùng cột) theo khoá.
+    # Trả về (mask dòng mới/điều chỉnh trong new, mask dòng bị xoá trong old, vị trí trong old của từng dòng new)
+    position = pd.Index(row_keys(old)).get_indexer(row_keys(new))
+    matched = position >= 0
+    changed = ~matched
+    changed[matched] = row_hashes(old)[position[matched]] != row_hashes(new)[matched]
+    removed = np.ones(len(old), dtype=bool)
+    removed[position[matched]] = False
+    return changed, removed, position
+
+
+def _row_position(df_qtrr):
+    # Hàm vị trí dòng trong df_qtrr theo khoá (mã, kỳ), dùng để giữ thứ tự dòng khi ghép bảng
+    index = pd.Index(row_keys(df_qtrr))
+    return lambda df: index.get_indexer(row_keys(df))
+
+
+def _read_artifact(store_dir, manifest, name, columns=None):
+    return data_cache.read_frame(Path(store_dir) / manifest["artifacts"][name], columns)
+
+
+def _previous(store_dir, manifest, columns):
+    # Các bảng của phiên bản trước còn dùng được (đúng version logic, cùng cột qtrr)
+    if manifest is None:
+        return {}
+    previous = {}
+    for name, version in ARTIFACTS.items():
+        if manifest.get("versions", {}).get(name) != version or name not in manifest.get("artifacts", {}):
+            continue
+        try:
+            previous[name] = _read_artifact(store_dir, manifest, name)
+        except Exception:
+            continue
+    if "qtrr" not in previous or list(previous["qtrr"].columns) != list(columns):
+        return {}
+    return previous
+
+
+def ingest(df_qtrr, signature=None, store_dir=STORE_DIR, full=False):
+    # Ghi phiên bản mới của qtrr (đã compact) vào kho; trả về thống kê của lần ingest.
+    # full=True: bỏ qua bản trước, tính lại toàn bộ cờ và rank.
+    store_dir = Path(store_dir)
+    started = time.perf_counter()
+    manifest = read_manifest(store_dir)
+    previous = {} if full else _previous(store_dir, manifest, df_qtrr.columns)
+    old = previous.get("qtrr")
+
+    if old is None:
+        changed, removed = np.ones(len(df_qtrr), dtype=bool), np.zeros(0, dtype=bool)
+        position = np.full(len(df_qtrr), -1)
+    else:
+        changed, removed, position = diff(old, df_qtrr)
+
+    with profiling.span("store:recompute", rows_in=int(changed.sum() + removed.sum())):
+        tickers = pd.unique(np.concatenate([
+            df_qtrr["Ticker"].to_numpy(object)[changed],
+            old["Ticker"].to_numpy(object)[removed] if old is not None else np.zeros(0, dtype=object),
+        ]))
+        if len(tickers) > INCREMENTAL_MAX_SHARE * df_qtrr["Ticker"].nunique():
+            previous = {"qtrr": old}
+        if "flags" in previous:
+            flags = risk_engine.update_warning_flags(previous["flags"], df_qtrr, tickers)
+        else:
+            flags = risk_engine.build_warning_flags(df_qtrr)
+
+        if "industry" in previous:
+            # Nhóm bị ảnh hưởng: nhóm mới của dòng mới/điều chỉnh + nhóm cũ của dòng điều chỉnh/bị xoá
+            # (dòng đổi ngành ảnh hưởng cả hai ngành)
+            old_rows = np.concatenate([np.flatnonzero(removed), position[changed & (position >= 0)]])
+            groups = np.unique(np.concatenate([
+                risk_engine.industry_group_keys(df_qtrr[changed]),
+                risk_engine.industry_group_keys(old.iloc[old_rows]),
+            ]))
+            industry = risk_engine.update_industry_table(
+                previous["industry"], df_qtrr, groups, _row_position(df_qtrr)
+            )
+        else:
+            industry = risk_engine.build_industry_table(df_qtrr)
+
+    seq = (manifest or {}).get("seq", 0) + 1
+    segments = list((manifest or {}).get("segments", []))
+    if old is None or changed.any() or removed.any():
+        # Log append-only: chỉ các dòng mới/điều chỉnh và khoá của dòng bị xoá
+        segment = pd.concat(
+            [
+                df_qtrr[changed].assign(**{OP_COL: "upsert"}),
+                old[removed].assign(**{OP_COL: "delete"}) if old is not None else None,
+            ],
+            ignore_index=True,
+        )
+        path = data_cache.write_frame(
+            segment, store_dir / SEGMENT_DIR / f"{seq:06d}.parquet", store_dir / SEGMENT_DIR / f"{seq:06d}.pkl"
+        )
+        segments.append({
+            "seq": seq,
+            "file": f"{SEGMENT_DIR}/{path.name}",
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "signature": list(signature) if signature else None,
+            "full": old is None,
+            "upserts": int(changed.sum()),
+            "deletes": int(removed.sum()),
+            "tickers": len(tickers),
+        })
+
+    artifacts = {}
+    for name, table in (("qtrr", df_qtrr), ("flags", flags), ("industry", industry)):
+        path = data_cache.write_frame(table, store_dir / f"{name}-{seq:06d}.parquet", store_dir / f"{name}-{seq:06d}.pkl")
+        artifacts[name] = path.name
+    _write_manifest(store_dir, {
+        "seq": seq,
+        "signature": list(signature) if signature else None,
+        "versions": ARTIFACTS,
+        "artifacts": artifacts,
+        "segments": segments,
+    })
+    # Bảng của phiên bản trước không còn được trỏ tới (process khác đang map thì vẫn đọc được)
+    for name in (manifest or {}).get("artifacts", {}).values():
+        if name not in artifacts.values():
+            try:
+                (store_dir / name).unlink()
+            except OSError:
+                pass
+    return {
+        "seq": seq,
+        "full": old is None,
+        "rows": len(df_qtrr),
+        "upserts": int(changed.sum()),
+        "deletes": int(removed.sum()),
+        "tickers": len(tickers),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def refresh(path=QTRR_PATH, store_dir=STORE_DIR, full=False):
+    # Ingest file qtrr nếu kho chưa có đúng phiên bản trên đĩa; trả về manifest hiện tại
+    with _store_lock(store_dir):
+        signature = data_cache.source_signature(path)
+        if signature is None:
+            raise FileNotFoundError(path)
+        manifest = read_manifest(store_dir)
+        if not full and manifest and manifest.get("signature") == list(signature) and manifest.get("versions") == ARTIFACTS:
+            return manifest
+        with profiling.span("store:parse"):
+            df_qtrr = risk_engine.compact_qtrr(data_cache.read_excel(path))
+        ingest(df_qtrr, signature, store_dir, full=full)
+        return read_manifest(store_dir)
+
+
+def load(name, path=QTRR_PATH, store_dir=STORE_DIR, columns=None):
+    # Bảng "qtrr" / "flags" / "industry" của phiên bản hiện tại của file qtrr
+    manifest = refresh(path, store_dir)
+    return _read_artifact(store_dir, manifest, name, columns)
+
+
+def read_log(store_dir=STORE_DIR, since=0):
+    # Các dòng mới/điều chỉnh/bị xoá của các lần ingest có seq > since, kèm cột _seq
+    manifest = read_manifest(store_dir) or {"segments": []}
+    frames = [
+        data_cache.read_frame(Path(store_dir) / s["file"]).assign(**{SEQ_COL: s["seq"]})
+        for s in manifest["segments"] if s["seq"] > since
+    ]
+    if not frames:
+        return pd.DataFrame()
+    # Category của từng segment khác nhau -> ghép dạng chuỗi
+    return pd.concat(
+        [f.astype({c: object for c in f.columns if isinstance(f[c].dtype, pd.CategoricalDtype)}) for f in frames],
+        ignore_index=True,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest qtrr_output1.xlsx vào kho dữ liệu cơ bản (chỉ phần thay đổi).")
+    parser.add_argument("--qtrr", default=QTRR_PATH, help="File qtrr")
+    parser.add_argument("--store", default=str(STORE_DIR), help="Thư mục kho")
+    parser.add_argument("--full", action="store_true", help="Tính lại toàn bộ cờ và rank ngành")
+    parser.add_argument("--log", type=int, metavar="N", help="Chỉ in N lần ingest gần nhất")
+    args = parser.parse_args()
+
+    if args.log is None:
+        started = time.perf_counter()
+        refresh(args.qtrr, args.store, full=args.full)
+        print(f"Đã cập nhật kho {args.store} ({time.perf_counter() - started:.2f}s)")
+    manifest = read_manifest(args.store) or {"segments": []}
+    for s in manifest["segments"][-(args.log or 1):]:
+        print(f"#{s['seq']} {s['created']}: +{s['upserts']} dòng mới/điều chỉnh, -{s['deletes']} dòng xoá, {s['tickers']} mã")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+# --- Đo thời gian xử lý từng lần chạy lại của dashboard (opt-in) ---
+# Bật cho mọi session bằng QTRR_PROFILE=1, hoặc cho một session bằng ?debug=1 trên URL.
+# Mỗi lần Streamlit chạy lại script được ghi: các span (tên, thời gian, số dòng vào/ra),
+# số lần gọi/miss của từng cache loader. Kết quả hiện trong expander debug của ui_new.py
+# và được ghi thêm một dòng JSON vào PROFILE_LOG để phân tích sau.
+# Khi không bật, span() / track_cache() chỉ tốn một lần đọc threading.local.
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+ENABLED = os.environ.get("QTRR_PROFILE", "0") == "1"
+PROFILE_LOG = Path(os.environ.get("QTRR_PROFILE_LOG", os.path.join("logs", "profile.jsonl")))
+
+# Mỗi session Streamlit chạy script trong thread riêng -> lần chạy hiện tại lưu theo thread
+_local = threading.local()
+_log_lock = threading.Lock()
+
+
+class Run:
+    def __init__(self, name):
+        self.name = name
+        self.created = datetime.now().isoformat(timespec="seconds")
+        self.started = time.perf_counter()
+        self.seconds = None
+        self.context = {}
+        self.spans = []
+        self.caches = {}
+        self.depth = 0
+
+    def count(self, cache_name, key):
+        counts = self.caches.setdefault(cache_name, {"calls": 0, "misses": 0})
+        counts[key] += 1
+
+    def to_dict(self):
+        return {
+            "event": "run",
+            "name": self.name,
+            "created": self.created,
+            "seconds": self.seconds,
+            "context": self.context,
+            "spans": self.spans,
+            "caches": {
+                name: {**counts, "hits": counts["calls"] - counts["misses"]}
+                for name, counts in self.caches.items()
+            },
+        }
+
+
+def current():
+    return getattr(_local, "run", None)
+
+
+def start_run(name, enabled=True):
+    # Bắt đầu ghi cho lần chạy lại này; luôn bỏ lần chạy trước của thread nếu nó bị dừng giữa chừng (st.stop, lỗi)
+    _local.run = Run(name) if enabled else None
+    return _local.run
+
+
+def finish_run():
+    # Kết thúc lần chạy hiện tại, ghi log; trả về Run (None nếu không bật)
+    run = current()
+    if run is None:
+        return None
+    _local.run = None
+    run.seconds = round(time.perf_counter() - run.started, 4)
+    write_log(run.to_dict())
+    return run
+
+
+def annotate(**context):
+    # Thông tin kèm theo lần chạy (vd. nhóm cảnh báo đang xem)
+    run = current()
+    if run is not None:
+        run.context.update(context)
+
+
+def write_log(record):
+    try:
+        with _log_lock:
+            PROFILE_LOG.parent.mkdir(parents=True, exist_ok=True)
+            with open(PROFILE_LOG, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+    except OSError:
+        pass  # Không ghi được log thì vẫn hiển thị trong expander
+
+
+@contextmanager
+def span(name, rows_in=None):
+    # with span("filter.x", rows_in=len(df)) as sp: ...; sp["rows_out"] = len(out)
+    run = current()
+    if run is None:
+        yield {}
+        return
+    record = {"name": name, "depth": run.depth, "start": round(time.perf_counter() - run.started, 4)}
+    if rows_in is not None:
+        record["rows_in"] = rows_in
+    run.spans.append(record)
+    run.depth += 1
+    started = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = round(time.perf_counter() - started, 4)
+        run.depth -= 1
+
+
+def count_cache(name, hit):
+    # Đếm một lần gọi cache tự quản lý (không qua st.cache_*), vd. filter_memo
+    run = current()
+    if run is not None:
+        run.count(name, "calls")
+        if not hit:
+            run.count(name, "misses")
+
+
+def measure_rows(name, fn, table, *args, **kwargs):
+    # fn(table, ...) trong một span có số dòng vào/ra
+    with span(name, rows_in=len(table)) as sp:
+        result = fn(table, *args, **kwargs)
+        sp["rows_out"] = len(result)
+    return result
+
+
+def track_cache(name, cache):
+    # Bọc hàm được cache bởi Streamlit (cache = st.cache_resource(...) / st.cache_data):
+    # đếm số lần gọi và số lần miss (thân hàm thực sự chạy) trong lần chạy hiện tại.
+    def decorator(fn):
+        @functools.wraps(fn)
+        def body(*args, **kwargs):
+            run = current()
+            if run is not None:
+                run.count(name, "misses")
+            return fn(*args, **kwargs)
+
+        cached_fn = cache(body)
+
+        @functools.wraps(fn)
+        def call(*args, **kwargs):
+            run = current()
+            if run is None:
+                return cached_fn(*args, **kwargs)
+            run.count(name, "calls")
+            with span(f"cache:{name}"):
+                return cached_fn(*args, **kwargs)
+
+        call.clear = cached_fn.clear
+        return call
+    return decorator
+
+
+def timed(name, fn):
+    # Callable được gọi ngoài lần chạy lại hiện tại (vd. data= của st.download_button):
+    # chỉ bọc khi đang bật, mỗi lần gọi ghi thẳng một dòng log riêng.
+    if current() is None:
+        return fn
+
+    @functools.wraps(fn)
+    def call(*args, **kwargs):
+        started = time.perf_counter()
+        result = fn(*args, **kwargs)
+        write_log({
+            "event": "call",
+            "name": name,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "seconds": round(time.perf_counter() - started, 4),
+            "bytes": len(result) if isinstance(result, (bytes, str)) else None,
+        })
+        return result
+    return call
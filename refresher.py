@@ -0,0 +1,167 @@
+# --- Làm mới dữ liệu chạy nền ---
+# Theo dõi các thư mục dữ liệu (result/, result1/, data/, Volume/result/). Khi file đổi và
+# đã ghi xong (kích thước/mtime không đổi trong SETTLE_SECONDS, không còn file khoá ~$ của
+# Excel đang mở), parse lại nguồn + tính lại bảng cảnh báo (risk_warnings.run_batch) rồi
+# trỏ snapshots/LATEST sang bản mới. Dashboard dùng chữ ký file của snapshot đã publish
+# (risk_warnings.published_signature) nên request không bao giờ phải parse workbook.
+#
+# Chạy:
+#   trong dashboard: tự khởi động cùng ui_new.py (tắt bằng QTRR_REFRESHER=0)
+#   process riêng:   python refresher.py [--once]
+import argparse
+import logging
+import os
+import threading
+import time
+
+import risk_warnings
+
+WATCH_DIRS = ["result", "result1", "data", os.path.join("Volume", "result")]
+# Chỉ các file dữ liệu nguồn (không theo dõi file tạm .tmp hay partitions/ do chính engine ghi)
+WATCH_SUFFIXES = (".xlsx", ".xls", ".csv")
+LOCK_PREFIX = "~$"
+
+POLL_SECONDS = float(os.environ.get("QTRR_REFRESH_POLL", 2))
+SETTLE_SECONDS = float(os.environ.get("QTRR_REFRESH_SETTLE", 5))
+# File khoá ~$ cũ hơn mức này được coi là bị bỏ lại (Excel bị tắt đột ngột)
+LOCK_TIMEOUT_SECONDS = 30 * 60
+
+logger = logging.getLogger(__name__)
+
+
+def scan(watch_dirs=WATCH_DIRS):
+    # ({file dữ liệu: (mtime_ns, size)}, {file khoá ~$: (mtime_ns, size)}) của các thư mục theo dõi
+    files, locks = {}, {}
+    for d in watch_dirs:
+        try:
+            entries = list(os.scandir(d))
+        except OSError:
+            continue
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            try:
+                st_ = entry.stat()
+            except OSError:
+                continue  # file bị xoá/đổi tên giữa chừng
+            signature = (st_.st_mtime_ns, st_.st_size)
+            if entry.name.startswith(LOCK_PREFIX):
+                locks[entry.path] = signature
+            elif entry.name.lower().endswith(WATCH_SUFFIXES):
+                files[entry.path] = signature
+    return files, locks
+
+
+class Refresher(threading.Thread):
+    def __init__(self, watch_dirs=WATCH_DIRS, snapshot_dir=risk_warnings.SNAPSHOT_DIR,
+                 poll_seconds=POLL_SECONDS, settle_seconds=SETTLE_SECONDS, workers=1):
+        super().__init__(name="qtrr-refresher", daemon=True)
+        self.watch_dirs = watch_dirs
+        self.snapshot_dir = snapshot_dir
+        self.poll_seconds = poll_seconds
+        self.settle_seconds = settle_seconds
+        self.workers = workers
+        self._stop_event = threading.Event()
+
+        self.files, locks = scan(watch_dirs)
+        # File khoá đã có từ trước khi bắt đầu theo dõi (vd. ~$qtrr_output1.xlsx bị bỏ lại) không chặn làm mới
+        self.stale_locks = set(locks.items())
+        self.changed_at = time.monotonic()
+        # Lần đầu: build nếu snapshot chưa có hoặc không khớp file hiện tại
+        self.pending = not self.is_published()
+        self.last_refresh = None
+        self.last_error = None
+
+    def is_published(self):
+        latest = risk_warnings.latest_snapshot(self.snapshot_dir)
+        if latest is None:
+            return False
+        if not risk_warnings.snapshot_current(latest[1]):
+            return False  # Snapshot build bằng version logic cũ (vd. đổi schema qtrr) -> build lại
+        published = latest[1].get("sources", {})
+        current = risk_warnings.data_version()
+        return all(
+            published.get(p) == (list(sig) if sig else None)
+            for p, sig in zip(risk_warnings.SOURCE_PATHS, current)
+        )
+
+    def active_locks(self, locks):
+        # File khoá mới xuất hiện/thay đổi và chưa quá hạn = Excel còn đang mở/ghi file
+        now_ns = time.time_ns()
+        return [
+            path for path, sig in locks.items()
+            if (path, sig) not in self.stale_locks and now_ns - sig[0] < LOCK_TIMEOUT_SECONDS * 1e9
+        ]
+
+    def poll(self):
+        # Một vòng kiểm tra; trả về True nếu đã làm mới
+        files, locks = scan(self.watch_dirs)
+        if files != self.files:
+            # Còn đang ghi: chờ thêm SETTLE_SECONDS kể từ lần thay đổi cuối
+            self.files = files
+            self.changed_at = time.monotonic()
+            self.pending = True
+            return False
+        if not self.pending or time.monotonic() - self.changed_at < self.settle_seconds:
+            return False
+        if self.active_locks(locks):
+            return False
+        if self.is_published():
+            # File đổi không phải nguồn của dashboard (hoặc đã được build bởi process khác)
+            self.pending = False
+            return False
+        self.refresh()
+        return True
+
+    def refresh(self):
+        started = time.perf_counter()
+        try:
+            run_id, manifest, errors = risk_warnings.run_batch(snapshot_dir=self.snapshot_dir, workers=self.workers)
+            self.last_error = errors or None
+            logger.info("Đã làm mới dữ liệu %s (%.1fs)", run_id, time.perf_counter() - started)
+        except Exception as e:
+            # Giữ snapshot cũ, thử lại ở lần thay đổi file tiếp theo
+            self.last_error = repr(e)
+            logger.exception("Lỗi khi làm mới dữ liệu")
+        self.pending = False
+        self.last_refresh = time.time()
+
+    def run(self):
+        while not self._stop_event.wait(self.poll_seconds):
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("Lỗi khi theo dõi thư mục dữ liệu")
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def start(refresh_now=False, **kwargs):
+    # refresh_now: build ngay (đồng bộ) nếu snapshot chưa khớp dữ liệu, vd. lúc khởi động
+    # server sau khi file nguồn đã đổi, để không phục vụ bản publish cũ trong lúc chờ settle
+    refresher = Refresher(**kwargs)
+    if refresh_now and refresher.pending:
+        refresher.refresh()
+    refresher.start()
+    return refresher
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Theo dõi thư mục dữ liệu và làm mới cache/snapshot khi file nguồn thay đổi.")
+    parser.add_argument("--once", action="store_true", help="Chỉ làm mới một lần (nếu dữ liệu đã đổi) rồi thoát")
+    parser.add_argument("--workers", type=int, default=None, help="Số process khi tính các nhóm cảnh báo")
+    parser.add_argument("--settle", type=float, default=SETTLE_SECONDS, help="Số giây file phải không đổi trước khi làm mới")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    refresher = Refresher(settle_seconds=args.settle, workers=args.workers)
+    if args.once:
+        if refresher.pending:
+            refresher.refresh()
+        return
+    refresher.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,766 @@
+# --- Engine tính toán cho tab "Cảnh báo rủi ro" ---
+# Chỉ dùng pandas/numpy (không phụ thuộc streamlit) để có thể tái sử dụng ngoài UI.
+import fnmatch
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+# --- Schema gọn cho dữ liệu qtrr ---
+# Tăng version khi đổi schema để cache trên đĩa được parse lại
+QTRR_SCHEMA_VERSION = 3
+QTRR_CATEGORY_COLS = ["Ticker", "Nganh", "LoaiBaoCao", "KyBaoCao"]
+QTRR_INT_COLS = ["YearReport", "LengthReport"]
+# Cột tỷ lệ có thể lưu float32, nhưng chỉ khi mọi giá trị của cột giữ được sai số <= FLOAT32_TOLERANCE
+# (float32 chỉ có ~7 chữ số: tỷ lệ cỡ 1e3-1e7 lệch tới hàng phần trăm, kéo theo cả trung bình ngành).
+# Biên lợi nhuận gộp/ròng (cột so sánh ngành mặc định) và các cột số tiền (VND, cỡ 1e12) luôn giữ float64.
+QTRR_FLOAT32_COLS = [
+    "Hệ số lợi nhuận gộp",
+    "Tỷ lệ (%) doanh thu thuần kỳ phân tích so với kỳ gốc (%)",
+    "Tỷ lệ % LNST kỳ phân tích so với kỳ gốc (%)",
+]
+FLOAT32_TOLERANCE = 1e-6
+
+
+def period_index(year, quarter):
+    # Chỉ số kỳ tăng dần theo thời gian: năm*4 + (quý-1).
+    # Báo cáo năm (quarter = 0) được xếp vào cuối năm; quý và năm luôn được xem riêng.
+    quarter = np.where(np.asarray(quarter) > 0, quarter, 4)
+    return np.asarray(year, dtype=np.int32) * 4 + (quarter - 1)
+
+
+def add_period_columns(df):
+    # Quarter: 1-4 cho báo cáo quý, 0 cho báo cáo năm (LengthReport == 5), vd. "2025_Q2" -> 2
+    # PeriodIdx: dùng cho mọi phép sort/shift/lọc kỳ thay vì chuỗi KyBaoCao
+    quarter = df["KyBaoCao"].astype("string").str.extract(r"_Q(\d)$", expand=False)
+    quarter = pd.to_numeric(quarter).fillna(0).astype("int8")
+    quarter[df["LengthReport"] == 5] = 0
+    df["Quarter"] = quarter
+    df["PeriodIdx"] = period_index(df["YearReport"].to_numpy(), quarter.to_numpy())
+    return df
+
+
+def _fits_float32(values):
+    # True nếu ép float32 không làm giá trị nào lệch quá FLOAT32_TOLERANCE (vượt khoảng float32 -> inf -> không đạt)
+    values = pd.to_numeric(values, errors="coerce").to_numpy(np.float64)
+    finite = np.isfinite(values)
+    if not finite.any():
+        return True
+    error = np.abs(values[finite].astype(np.float32).astype(np.float64) - values[finite])
+    return bool(error.max() <= FLOAT32_TOLERANCE)
+
+
+def compact_qtrr(df):
+    # Category (đã sắp xếp, ordered) cho mã/ngành/kỳ: sort theo category cho kết quả
+    # như sort chuỗi; mã category của KyBaoCao là mã kỳ kiểu số nguyên nhỏ.
+    for c in QTRR_CATEGORY_COLS:
+        if c in df.columns:
+            categories = sorted(df[c].dropna().unique())
+            df[c] = pd.Categorical(df[c], categories=categories, ordered=True)
+    for c in QTRR_INT_COLS:
+        if c in df.columns:
+            df[c] = pd.to_numeric(df[c], downcast="integer")
+    for c in QTRR_FLOAT32_COLS:
+        if c in df.columns and _fits_float32(df[c]):
+            df[c] = df[c].astype("float32")
+    if {"KyBaoCao", "YearReport", "LengthReport"}.issubset(df.columns):
+        df = add_period_columns(df)
+    return df
+
+
+# --- So sánh ngành ---
+# Kỳ báo cáo + Ngành: mỗi nhóm được xếp hạng độc lập
+INDUSTRY_GROUP_COLS = ["PeriodIdx", "Nganh"]
+
+# metric -> (nhãn hiển thị, hệ số quy đổi chênh lệch sang điểm %)
+# Các cột biên lợi nhuận lưu dạng tỷ lệ (0.15 = 15%) nên nhân 100,
+# các cột đã là % thì giữ nguyên.
+INDUSTRY_METRICS = {
+    "Biên lợi nhuận gộp": ("BLN Gộp", 100),
+    "Biên lợi nhuận ròng": ("BLN Ròng", 100),
+    "Hệ số lợi nhuận gộp": ("HS LN Gộp", 100),
+    "Tỷ lệ (%) doanh thu thuần kỳ phân tích so với kỳ gốc (%)": ("Tăng trưởng DT", 1),
+    "Tỷ lệ % LNST kỳ phân tích so với kỳ gốc (%)": ("Tăng trưởng LNST", 1),
+}
+DEFAULT_INDUSTRY_METRICS = ["Biên lợi nhuận gộp", "Biên lợi nhuận ròng"]
+
+
+def industry_columns(metric):
+    # Tên cột kết quả cho một metric: (cột Rank, cột % chênh lệch)
+    label = INDUSTRY_METRICS.get(metric, (metric, 1))[0]
+    return f"Rank {label}/Ngành", f"% {label} vs TB Ngành"
+
+
+def rank_vs_industry(df, metrics, group_cols=INDUSTRY_GROUP_COLS):
+    # Rank (giảm dần) và chênh lệch so với trung bình ngành cho tất cả metric,
+    # tính trong một lần groupby-transform thay vì lặp từng nhóm.
+    metrics = [m for m in metrics if m in df.columns]
+    # Dòng thiếu khoá nhóm (vd. chưa có Ngành) không thuộc nhóm nào -> bỏ
+    df = df.dropna(subset=group_cols)
+    if df.empty or not metrics:
+        return df
+
+    # Tính trong float64 (cột có thể lưu float32) để trung bình ngành không bị sai số tích luỹ
+    values = df[metrics].astype("float64")
+    grouped = values.groupby([df[c] for c in group_cols], sort=False, observed=True)
+    ranks = grouped.rank(ascending=False, method="min")
+    means = grouped.transform("mean")
+
+    new_cols = {}
+    for metric in metrics:
+        rank_col, diff_col = industry_columns(metric)
+        scale = INDUSTRY_METRICS.get(metric, (metric, 1))[1]
+        new_cols[rank_col] = ranks[metric]
+        # Chênh lệch tuyệt đối (điểm %) so với trung bình ngành
+        new_cols[diff_col] = (values[metric] - means[metric]) * scale
+
+    result = pd.concat([df, pd.DataFrame(new_cols, index=df.index)], axis=1)
+    # Giữ thứ tự hiển thị theo Kỳ + Ngành
+    return result.sort_values(by=group_cols, kind="stable")
+
+
+def clean_industry_result(df, metrics):
+    # Thay inf bằng NaN và bỏ các dòng không có giá trị nào cho các metric
+    df = df.replace([np.inf, -np.inf], np.nan)
+    cols_to_check = [c for c in metrics if c in df.columns]
+    if cols_to_check:
+        df = df.dropna(subset=cols_to_check, how="all")
+    return df
+
+
+# --- Chuỗi kỳ liên tiếp (run-length) ---
+def streak_lengths(mask, groups):
+    # mask, groups: mảng cùng độ dài; các dòng của mỗi nhóm (Ticker) nằm liền nhau
+    # và được sắp xếp theo thời gian từ cũ đến mới.
+    # Trả về (current, longest):
+    #   current[i] = số kỳ liên tiếp thoả điều kiện tính đến dòng i (0 nếu dòng i không thoả)
+    #   longest[i] = chuỗi dài nhất của nhóm tính đến dòng i
+    mask = np.asarray(mask, dtype=bool)
+    groups = np.asarray(groups)
+    n = len(mask)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    idx = np.arange(n)
+    group_start = np.ones(n, dtype=bool)
+    group_start[1:] = groups[1:] != groups[:-1]
+
+    # Chuỗi bị ngắt tại dòng không thoả điều kiện hoặc đầu mỗi nhóm
+    reset = ~mask | group_start
+    last_reset = np.maximum.accumulate(np.where(reset, idx, 0))
+    current = np.where(mask, idx - last_reset + mask[last_reset], 0)
+
+    # Cummax theo nhóm: cộng offset tăng dần theo nhóm rồi cummax một lần
+    offset = np.cumsum(group_start) * (n + 1)
+    longest = np.maximum.accumulate(current + offset) - offset
+    return current, longest
+
+
+def streak_table(df, predicates, by="Ticker", time_col="PeriodIdx"):
+    # Tính chuỗi cho nhiều điều kiện bất kỳ trên df (mỗi điều kiện một lần quét).
+    # predicates: {tên: hàm(df) -> mask bool} hoặc {tên: mask}
+    # Kết quả: DataFrame cùng index với df, mỗi điều kiện có 2 cột
+    # "<tên>" (chuỗi hiện tại) và "<tên> (dài nhất)".
+    # factorize(sort=True): thứ tự như sort giá trị gốc, chạy được cho cả category
+    by_codes = pd.factorize(df[by], sort=True)[0]
+    time_codes = pd.factorize(df[time_col], sort=True)[0]
+    order = np.lexsort((time_codes, by_codes))
+    groups = by_codes[order]
+    result = {}
+    for name, predicate in predicates.items():
+        mask = predicate(df) if callable(predicate) else predicate
+        mask = np.asarray(mask, dtype=bool)[order]
+        current, longest = streak_lengths(mask, groups)
+        cur_col = np.empty(len(df), dtype=np.int64)
+        long_col = np.empty(len(df), dtype=np.int64)
+        cur_col[order] = current
+        long_col[order] = longest
+        result[name] = cur_col
+        result[f"{name} (dài nhất)"] = long_col
+    return pd.DataFrame(result, index=df.index)
+
+
+# --- Bảng cờ cảnh báo (Tăng trưởng ảo + BCTC âm) ---
+# Tăng version khi đổi logic tính cờ để cache trên đĩa được build lại
+FLAG_STORE_VERSION = 4
+
+VIEWS = ["Quý", "Năm"]
+CFO_COL = "Lưu chuyển tiền thuần từ HĐKD"
+REVENUE_COL = "Doanh thu thuần"
+FAKE_GROWTH_COL = "Tăng trưởng ảo"
+# Các cột không phải chỉ số (không tính chuỗi âm)
+NON_METRIC_COLS = ["Ticker", "Nganh", "YearReport", "LengthReport", "LoaiBaoCao", "KyBaoCao", "Quarter", "PeriodIdx"]
+DEFAULT_NEGATIVE_METRICS = ["Lưu chuyển tiền thuần từ HĐKD"]
+
+
+def view_mask(df, view_mode):
+    # LengthReport == 5 là báo cáo năm, còn lại là báo cáo quý
+    if view_mode == "Năm":
+        return df["LengthReport"] == 5
+    return df["LengthReport"] != 5
+
+
+def period_options(df):
+    # {view: {năm: [các quý, giảm dần]}}, năm giảm dần; view "Năm" có danh sách quý rỗng
+    options = {}
+    for view in VIEWS:
+        periods = df.loc[view_mask(df, view), ["YearReport", "Quarter"]].drop_duplicates()
+        periods = periods.sort_values(by=["YearReport", "Quarter"], ascending=False)
+        options[view] = {
+            int(year): [int(q) for q in group["Quarter"] if q > 0]
+            for year, group in periods.groupby("YearReport", sort=False)
+        }
+    return options
+
+
+def streak_metrics(df):
+    # Tất cả cột số của qtrr đều có thể cảnh báo chuỗi âm
+    return [
+        c for c in df.columns
+        if c not in NON_METRIC_COLS and pd.api.types.is_numeric_dtype(df[c])
+    ]
+
+
+def negative_streak_col(metric):
+    return f"Số kỳ âm: {metric}"
+
+
+def longest_negative_streak_col(metric):
+    return f"Số kỳ âm: {metric} (dài nhất)"
+
+
+def build_warning_flags(df_qtrr):
+    # Tính sẵn toàn bộ cờ cho cả hai chế độ xem Quý/Năm.
+    # Kết quả có index (view, Ticker, PeriodIdx), trong mỗi view các dòng được sắp xếp
+    # theo Ticker tăng dần, kỳ báo cáo giảm dần (kỳ mới nhất đứng đầu).
+    frames = []
+    for view in VIEWS:
+        df_view = df_qtrr[view_mask(df_qtrr, view)]
+        df_view = df_view.sort_values(by=["Ticker", "PeriodIdx"], ascending=[True, False])
+
+        # Một lần quét run-length cho mỗi điều kiện
+        predicates = {negative_streak_col(m): df_view[m] < 0 for m in streak_metrics(df_view)}
+        has_fake_growth = CFO_COL in df_view.columns and REVENUE_COL in df_view.columns
+        if has_fake_growth:
+            # CFO < 0 AND Revenue > 0 for 2 consecutive periods (Quarter OR Year)
+            predicates[FAKE_GROWTH_COL] = (df_view[CFO_COL] < 0) & (df_view[REVENUE_COL] > 0)
+        streaks = streak_table(df_view, predicates)
+
+        fake_growth = pd.Series("", index=df_view.index)
+        if has_fake_growth:
+            fake_growth[streaks[FAKE_GROWTH_COL] >= 2] = "🚩"
+            streaks = streaks.drop(columns=[FAKE_GROWTH_COL, f"{FAKE_GROWTH_COL} (dài nhất)"])
+
+        frames.append(pd.concat([df_view.assign(view=view), streaks], axis=1).assign(**{FAKE_GROWTH_COL: fake_growth}))
+
+    store = pd.concat(frames, ignore_index=True)
+    return store.set_index(["view", "Ticker", "PeriodIdx"])
+
+
+# --- Bảng gốc So sánh ngành ---
+# Tăng version khi đổi logic/cột của bảng để cache trên đĩa được build lại
+INDUSTRY_TABLE_VERSION = 1
+QTRR_PERIOD_COLS = ["Ticker", "YearReport", "LengthReport", "KyBaoCao", "Quarter", "PeriodIdx"]
+
+
+def industry_table_columns(df_qtrr):
+    return [c for c in QTRR_PERIOD_COLS + ["Nganh"] + list(INDUSTRY_METRICS) if c in df_qtrr.columns]
+
+
+def build_industry_table(df_qtrr):
+    # Rank + chênh lệch với TB ngành của mọi chỉ số, mọi kỳ, mọi ngành, cho cả hai view.
+    # Rank được tính trong từng nhóm (kỳ, ngành) nên lọc sau khi tính cho kết quả như lọc trước.
+    if "Nganh" not in df_qtrr.columns:
+        return pd.DataFrame()
+    df_qtrr = df_qtrr[industry_table_columns(df_qtrr)]
+    frames = []
+    for view in VIEWS:
+        df_view = df_qtrr[view_mask(df_qtrr, view)]
+        frames.append(rank_vs_industry(df_view, list(INDUSTRY_METRICS)).assign(view=view))
+    return pd.concat(frames, ignore_index=True)
+
+
+# --- Cập nhật tăng dần khi có kỳ mới / số liệu điều chỉnh ---
+# Chỉ tính lại phần bị ảnh hưởng rồi ghép với bảng cũ; kết quả giống hệt tính lại toàn bộ.
+def align_categories(df, like):
+    # Đổi các cột category của df sang đúng category của cột cùng tên trong like
+    # (category của qtrr = các giá trị đã sắp xếp, đổi khi có mã/ngành/kỳ mới)
+    changed = {
+        c: df[c].astype(like[c].dtype)
+        for c in df.columns
+        if c in like.columns and isinstance(like[c].dtype, pd.CategoricalDtype) and df[c].dtype != like[c].dtype
+    }
+    return df.assign(**changed) if changed else df
+
+
+def _view_codes(views):
+    # Vị trí của view trong VIEWS (so sánh trực tiếp, nhanh hơn dựng Categorical từ chuỗi)
+    views = np.asarray(views)
+    codes = np.zeros(len(views), dtype=np.int8)
+    for i, view in enumerate(VIEWS[1:], start=1):
+        codes[views == view] = i
+    return codes
+
+
+def update_warning_flags(flags, df_qtrr, tickers):
+    # Tính lại cờ của các mã trong tickers (toàn bộ lịch sử của mã: chuỗi phụ thuộc các kỳ trước),
+    # giữ nguyên cờ của các mã khác
+    old = flags.reset_index()
+    fresh = build_warning_flags(df_qtrr[df_qtrr["Ticker"].isin(tickers)]).reset_index()
+    if list(fresh.columns) != list(old.columns):
+        return build_warning_flags(df_qtrr)  # Schema qtrr đổi -> tính lại toàn bộ
+    old = align_categories(old[~old["Ticker"].isin(tickers)], df_qtrr)
+    store = pd.concat([old, fresh], ignore_index=True)
+    # Thứ tự như build_warning_flags: view, Ticker tăng dần, kỳ giảm dần
+    order = np.lexsort((-store["PeriodIdx"].to_numpy(), store["Ticker"].cat.codes, _view_codes(store["view"])))
+    return store.take(order).reset_index(drop=True).set_index(["view", "Ticker", "PeriodIdx"])
+
+
+def industry_group_keys(df):
+    # Khoá nhóm xếp hạng (view, kỳ, ngành) của từng dòng dạng hash uint64 (theo giá trị,
+    # không phụ thuộc category) -> so sánh được giữa hai phiên bản dữ liệu bằng np.isin
+    views = df["view"] if "view" in df.columns else np.where(df["LengthReport"] == 5, "Năm", "Quý")
+    keys = pd.DataFrame({"view": views, "PeriodIdx": df["PeriodIdx"].to_numpy(np.int64), "Nganh": df["Nganh"]})
+    return pd.util.hash_pandas_object(keys, index=False).to_numpy()
+
+
+def update_industry_table(table, df_qtrr, groups, row_position):
+    # Xếp hạng lại các nhóm (view, kỳ, ngành) có khoá trong groups, giữ nguyên các nhóm khác.
+    # row_position(df) -> vị trí trong df_qtrr của từng dòng (thứ tự dòng trong nhóm như tính lại toàn bộ)
+    if table.empty or "Nganh" not in df_qtrr.columns:
+        return build_industry_table(df_qtrr)
+    fresh = build_industry_table(df_qtrr[np.isin(industry_group_keys(df_qtrr), groups)])
+    if list(fresh.columns) != list(table.columns):
+        return build_industry_table(df_qtrr)
+    old = align_categories(table[~np.isin(industry_group_keys(table), groups)], df_qtrr)
+    result = pd.concat([old, fresh], ignore_index=True)
+    # Thứ tự như build_industry_table: view, kỳ, ngành, rồi thứ tự dòng trong qtrr
+    order = np.lexsort((
+        row_position(result), result["Nganh"].cat.codes, result["PeriodIdx"].to_numpy(), _view_codes(result["view"])
+    ))
+    return result.take(order).reset_index(drop=True)
+
+
+# --- Room margin ---
+ROOM_CAPITAL_RATIO = 0.1    # Room 1: 10% vốn
+ROOM_SHARES_RATIO = 0.05    # Room 2: 5% KL lưu hành * giá
+ROOM_COLUMNS = ["Ticker", "Kỳ BCTC", "KL Lưu hành", "Ngày GD", "Giá", "Room (VCSH)", "Room (số lượng cp lưu hành)", "Max Room Cho Vay"]
+
+
+def build_room_snapshot(df_cp, df_fin, df_price):
+    # Ảnh chụp theo mã: Vốn cổ phần của kỳ mới nhất + giá đóng cửa mới nhất,
+    # và Room theo số lượng cp lưu hành (không phụ thuộc vốn nhập vào).
+    if df_cp.empty:
+        return pd.DataFrame()
+    df_snap = df_cp[["Ticker"]].copy()
+
+    # Prepare Financial Data (Latest Vốn cổ phần + Period info)
+    if not df_fin.empty and "Vốn cổ phần" in df_fin.columns:
+        # Sort to get latest
+        # Kỳ mới nhất; cùng kỳ cuối năm thì ưu tiên báo cáo năm (LengthReport = 5)
+        df_fin_sorted = df_fin.sort_values(by=["Ticker", "PeriodIdx", "LengthReport"], ascending=[True, False, False])
+        df_fin_latest = df_fin_sorted.drop_duplicates(subset=["Ticker"])[["Ticker", "Vốn cổ phần", "KyBaoCao"]]
+        # Ticker có thể là category -> merge theo chuỗi
+        df_fin_latest = df_fin_latest.astype({"Ticker": str})
+        df_snap = df_snap.merge(df_fin_latest, on="Ticker", how="left")
+        df_snap["Kỳ BCTC"] = df_snap["KyBaoCao"].astype(str)
+        # Calculate Shares Outstanding
+        df_snap["KL Lưu hành"] = df_snap["Vốn cổ phần"] / 10000
+
+    # Prepare Price Data (Latest Close + Date)
+    if not df_price.empty and "symbol" in df_price.columns and "close" in df_price.columns:
+        if "time" in df_price.columns:
+            df_price = df_price.sort_values(by=["symbol", "time"])
+        df_price_latest = df_price.groupby("symbol")[["close", "time"]].last().reset_index()
+        df_price_latest = df_price_latest.rename(columns={"symbol": "Ticker", "close": "Giá", "time": "Ngày GD"})
+        df_snap = df_snap.merge(df_price_latest, on="Ticker", how="left")
+
+    # Formula: KL Lưu hành * 5% * (Giá * 1000) / 1 Billion
+    if "KL Lưu hành" in df_snap.columns and "Giá" in df_snap.columns:
+        df_snap["KL Lưu hành"] = df_snap["KL Lưu hành"].fillna(0)
+        df_snap["Giá"] = df_snap["Giá"].fillna(0)
+        val_vnd = df_snap["KL Lưu hành"] * ROOM_SHARES_RATIO * (df_snap["Giá"] * 1000)
+        df_snap["Room (số lượng cp lưu hành)"] = val_vnd / 1_000_000_000
+    else:
+        df_snap["Room (số lượng cp lưu hành)"] = 0.0
+
+    return df_snap[[c for c in ROOM_COLUMNS if c in df_snap.columns]]
+
+
+def room_margin(snapshot, capital_billion):
+    # Max Room Cho Vay = min(Room theo vốn, Room theo số lượng cp lưu hành)
+    if snapshot.empty:
+        return snapshot
+    room_capital = capital_billion * ROOM_CAPITAL_RATIO
+    room_shares = snapshot["Room (số lượng cp lưu hành)"].to_numpy(dtype=float)
+    df = snapshot.assign(**{
+        "Room (VCSH)": room_capital,
+        "Max Room Cho Vay": np.minimum(room_capital, room_shares),
+    })
+    return df[[c for c in ROOM_COLUMNS if c in df.columns]]
+
+
+def room_grid_column(capital_billion):
+    return f"Vốn {capital_billion:g} tỷ"
+
+
+def room_margin_grid(snapshot, capitals):
+    # Max Room Cho Vay cho cả lưới mức vốn trong một phép broadcast (mã x mức vốn)
+    if snapshot.empty:
+        return snapshot
+    capitals = np.asarray(capitals, dtype=float)
+    room_shares = snapshot["Room (số lượng cp lưu hành)"].to_numpy(dtype=float)
+    grid = np.minimum(capitals[np.newaxis, :] * ROOM_CAPITAL_RATIO, room_shares[:, np.newaxis])
+    df_grid = pd.DataFrame(grid, columns=[room_grid_column(c) for c in capitals], index=snapshot.index)
+    return pd.concat([snapshot[["Ticker"]], df_grid], axis=1)
+
+
+# --- Ma trận rủi ro: mọi tín hiệu của một mã trên một dòng ---
+RISK_SCORE_COL = "Điểm rủi ro"
+RISK_RANK_COL = "Hạng rủi ro"
+MARGIN_LIST_COL = "Danh sách GDKQ"
+ROOM_COL = "Room (số lượng cp lưu hành)"
+# chỉ số -> tên cột số kỳ âm liên tiếp (kỳ mới nhất) trong ma trận
+RISK_STREAK_METRICS = {CFO_COL: "CFO âm liên tiếp", "LNST": "LNST âm liên tiếp"}
+VOLUME_FLAG_COLS = ["Đột biến Vol 100", "Đột biến Vol 200"]
+# Điểm rủi ro = tổng điểm các tín hiệu:
+#   Tăng trưởng ảo 3; mỗi chuỗi âm từ 2 kỳ: số kỳ - 1 (tối đa 3); mỗi biên LN dưới TB ngành 1;
+#   thuộc danh sách không được GDKQ 2; đột biến Vol 100 / Vol 200: 1 / 2. Room margin chỉ để tham khảo.
+RISK_WEIGHTS = {"fake_growth": 3, "max_streak": 3, "below_industry": 1, "margin_list": 2, "vol100": 1, "vol200": 2}
+
+
+def _lookup(keys, table_keys, values, fill):
+    # values tại vị trí của từng khoá trong table_keys (khoá trùng lấy dòng đầu), không có -> fill
+    table_keys = pd.Index(table_keys)
+    first = ~table_keys.duplicated()
+    position = table_keys[first].get_indexer(keys)
+    values = np.asarray(values)[first]
+    result = np.full(len(position), fill, dtype=values.dtype)
+    result[position >= 0] = values[position[position >= 0]]
+    return result
+
+
+def _clean_codes(values):
+    # Mã CP dạng chuỗi chuẩn hoá; cột category chỉ chuẩn hoá danh mục rồi lấy theo mã số
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        values = pd.Categorical(values)
+        return np.append(_clean_codes(values.categories), "")[values.codes]
+    return pd.Series(values, dtype=object).astype(str).str.strip().str.upper().to_numpy()
+
+
+def build_risk_matrix(flags, industry, margin_lists, volume, room):
+    # Một dòng cho mỗi (view, mã): kỳ mới nhất của bảng cờ + xếp hạng ngành cùng kỳ + danh sách GDKQ,
+    # đột biến khối lượng phiên mới nhất, Room; kèm Điểm rủi ro và Hạng rủi ro trên toàn thị trường.
+    # flags: bảng cờ (index view, Ticker, PeriodIdx; kỳ mới nhất đứng đầu mỗi mã) -> lấy kỳ mới nhất
+    # bằng một lần quét so sánh với dòng liền trước, không sort/groupby lại.
+    # margin_lists: {nhãn: bảng danh sách}; các bảng khác (kể cả bảng cờ) có thể rỗng.
+    if flags.empty:
+        # Chưa có qtrr: vẫn có một dòng cho mỗi mã của các nguồn còn lại
+        matrix = pd.DataFrame({
+            "view": pd.Series(dtype=object), "Mã CP": pd.Series(dtype=object), "Kỳ": pd.Series(dtype=object),
+            "PeriodIdx": pd.Series(dtype=np.int64), FAKE_GROWTH_COL: pd.Series(dtype=object),
+            **{col: pd.Series(dtype=np.int64) for col in RISK_STREAK_METRICS.values()},
+        })
+    else:
+        views = np.asarray(flags.index.get_level_values("view"))
+        tickers = flags.index.get_level_values("Ticker")
+        ticker_codes = tickers.codes if isinstance(tickers, pd.CategoricalIndex) else pd.factorize(tickers)[0]
+        first = np.ones(len(flags), dtype=bool)
+        first[1:] = (ticker_codes[1:] != ticker_codes[:-1]) | (views[1:] != views[:-1])
+        latest = flags[first]
+
+        matrix = pd.DataFrame({
+            "view": views[first],
+            "Mã CP": _clean_codes(tickers[first]),
+            "Kỳ": latest["KyBaoCao"].astype(str).to_numpy(),
+            "PeriodIdx": latest.index.get_level_values("PeriodIdx").to_numpy(np.int64),
+            FAKE_GROWTH_COL: latest[FAKE_GROWTH_COL].to_numpy() if FAKE_GROWTH_COL in latest.columns else "",
+        })
+        for metric, col in RISK_STREAK_METRICS.items():
+            if negative_streak_col(metric) in latest.columns:
+                matrix[col] = latest[negative_streak_col(metric)].to_numpy(np.int64)
+
+    # Mã chỉ có trong danh sách GDKQ / khối lượng / Room (chưa có BCTC) vẫn có một dòng ở mỗi view
+    others = []
+    for table in [*margin_lists.values(), volume, room]:
+        col = ticker_column(table)
+        if col is not None:
+            others.append(table[col])
+    if others:
+        extra = pd.unique(_clean_codes(pd.concat(others, ignore_index=True)))
+        frames = [matrix] if not matrix.empty else []
+        for view in VIEWS:
+            missing = extra[~pd.Index(extra).isin(matrix.loc[matrix["view"] == view, "Mã CP"])]
+            frames.append(pd.DataFrame({"view": view, "Mã CP": missing}).reindex(columns=matrix.columns))
+        matrix = pd.concat(frames, ignore_index=True)
+        streak_cols = [c for c in RISK_STREAK_METRICS.values() if c in matrix.columns]
+        matrix = matrix.fillna({"Kỳ": "", FAKE_GROWTH_COL: ""}).astype({"Kỳ": str, FAKE_GROWTH_COL: str})
+        matrix[streak_cols] = matrix[streak_cols].fillna(0).astype(np.int64)
+    matrix["PeriodIdx"] = matrix["PeriodIdx"].fillna(-1).astype(np.int64)
+
+    # Xếp hạng ngành của đúng kỳ mới nhất: ghép theo hash (view, mã, kỳ), mã đổi sang số nguyên trước
+    universe = pd.Index(pd.unique(matrix["Mã CP"]))
+
+    def period_keys(view, ticker, period):
+        keys = pd.DataFrame({
+            "view": _view_codes(view), "Mã CP": universe.get_indexer(ticker), "PeriodIdx": np.asarray(period, dtype=np.int64)
+        })
+        return pd.util.hash_pandas_object(keys, index=False).to_numpy()
+
+    below = np.zeros(len(matrix), dtype=np.int64)
+    if not industry.empty:
+        matrix_keys = period_keys(matrix["view"], matrix["Mã CP"], matrix["PeriodIdx"])
+        industry_keys = period_keys(industry["view"], _clean_codes(industry["Ticker"]), industry["PeriodIdx"])
+        for metric in DEFAULT_INDUSTRY_METRICS:
+            rank_col, diff_col = industry_columns(metric)
+            if diff_col not in industry.columns:
+                continue
+            matrix[rank_col] = _lookup(matrix_keys, industry_keys, industry[rank_col].to_numpy(np.float64), np.nan)
+            matrix[diff_col] = _lookup(matrix_keys, industry_keys, industry[diff_col].to_numpy(np.float64), np.nan)
+            below += matrix[diff_col].to_numpy() < 0
+
+    codes = matrix["Mã CP"].to_numpy()
+    listed = np.zeros(len(matrix), dtype=bool)
+    list_names = np.full(len(matrix), "", dtype=object)
+    for label, table in margin_lists.items():
+        col = ticker_column(table)
+        if col is None:
+            continue
+        member = matrix["Mã CP"].isin(_clean_codes(table[col])).to_numpy()
+        list_names[member & listed] += ", "
+        list_names[member] += label
+        listed |= member
+    matrix[MARGIN_LIST_COL] = list_names
+
+    volume_col = ticker_column(volume)
+    for col in VOLUME_FLAG_COLS:
+        has_col = volume_col is not None and col in volume.columns
+        matrix[col] = _lookup(codes, _clean_codes(volume[volume_col]), volume[col].fillna(False).to_numpy(bool), False) if has_col else False
+
+    room_col = ticker_column(room)
+    if room_col is not None and ROOM_COL in room.columns:
+        matrix[ROOM_COL] = _lookup(codes, _clean_codes(room[room_col]), room[ROOM_COL].to_numpy(np.float64), np.nan)
+
+    weights = RISK_WEIGHTS
+    score = weights["fake_growth"] * (matrix[FAKE_GROWTH_COL].to_numpy() == "🚩")
+    for col in RISK_STREAK_METRICS.values():
+        if col in matrix.columns:
+            score = score + np.clip(matrix[col].to_numpy(np.int64) - 1, 0, weights["max_streak"])
+    score = score + weights["below_industry"] * below + weights["margin_list"] * listed
+    score = score + np.where(
+        matrix["Đột biến Vol 200"].to_numpy(), weights["vol200"], weights["vol100"] * matrix["Đột biến Vol 100"].to_numpy()
+    )
+    matrix[RISK_SCORE_COL] = score.astype(np.int64)
+
+    # Sắp xếp sẵn: view, điểm giảm dần, mã -> hạng = vị trí đầu tiên của điểm trong view (rank "min")
+    view_codes = _view_codes(matrix["view"])
+    order = np.lexsort((matrix["Mã CP"].to_numpy(str), -score, view_codes))
+    matrix = matrix.take(order).reset_index(drop=True)
+    score, view_codes = score[order], view_codes[order]
+    new_group = np.ones(len(matrix), dtype=bool)
+    new_group[1:] = (score[1:] != score[:-1]) | (view_codes[1:] != view_codes[:-1])
+    view_start = np.searchsorted(view_codes, view_codes)
+    group_start = np.maximum.accumulate(np.where(new_group, np.arange(len(matrix)), 0))
+    matrix.insert(2, RISK_RANK_COL, group_start - view_start + 1)
+    matrix.insert(2, RISK_SCORE_COL, matrix.pop(RISK_SCORE_COL))
+    return matrix.drop(columns=["PeriodIdx"])
+
+
+# --- Bảng chiều mã CP (Sàn / Ngành / Mô hình) ---
+# Index = mã CP (sắp xếp), mã số nguyên của một mã = vị trí dòng trong bảng.
+TICKER_DIM_COLUMNS = ["Sàn", "Ngành", "Mô hình"]
+
+
+def _ticker_index(values):
+    return pd.Index(values, dtype=object).astype(str).str.strip().str.upper()
+
+
+def build_ticker_dim(df_cp, df_summary, df_qtrr):
+    # Gộp cp.csv (Sàn, ngành), summary.xlsx (Mô hình) và Nganh của qtrr (cho các mã
+    # không có trong cp.csv) thành một bảng, build một lần cho mỗi phiên bản dữ liệu.
+    parts = []
+    if not df_cp.empty and "Ticker" in df_cp.columns:
+        cp = df_cp.rename(columns={"ComGroupCode": "Sàn", "nganh": "Ngành"})
+        cp.index = _ticker_index(cp.pop("Ticker"))
+        parts.append(cp[[c for c in ["Sàn", "Ngành"] if c in cp.columns]])
+    if not df_summary.empty and "Mã" in df_summary.columns and "Mô hình" in df_summary.columns:
+        summary = df_summary[["Mô hình"]].set_axis(_ticker_index(df_summary["Mã"]))
+        parts.append(summary)
+    if not df_qtrr.empty and "Nganh" in df_qtrr.columns:
+        qtrr = df_qtrr[["Ticker", "Nganh"]].dropna().drop_duplicates(subset=["Ticker"])
+        parts.append(qtrr[["Nganh"]].set_axis(_ticker_index(qtrr["Ticker"])))
+
+    if not parts:
+        return pd.DataFrame(columns=TICKER_DIM_COLUMNS, index=pd.Index([], dtype=object, name="Ticker"))
+    # Mỗi nguồn một dòng/mã rồi ghép theo index (outer join)
+    dim = pd.concat([part[~part.index.duplicated(keep="last")].astype(object) for part in parts], axis=1)
+    if "Nganh" in dim.columns:
+        dim["Ngành"] = dim.get("Ngành", pd.Series(index=dim.index, dtype=object)).combine_first(dim.pop("Nganh"))
+    dim = dim.reindex(columns=TICKER_DIM_COLUMNS).sort_index()
+    dim.index.name = "Ticker"
+    return dim
+
+
+def ticker_codes(dim, tickers):
+    # Mã số nguyên (vị trí trong dim) cho từng mã, -1 nếu mã không có trong dim
+    return dim.index.get_indexer(_ticker_index(tickers))
+
+
+def ticker_lookup(dim, codes, columns):
+    # Lấy thuộc tính theo mã số nguyên (take theo vị trí, không merge); -1 -> NaN
+    values = dim[columns].take(codes).astype(object).reset_index(drop=True)
+    values.loc[codes < 0] = np.nan
+    return values
+
+
+def ticker_filter_mask(dim, codes, exchanges=None, sectors=None, sector_col="Ngành"):
+    # Lọc Sàn/Ngành trên bảng chiều (vài nghìn dòng) rồi tra theo mã số nguyên
+    allowed = np.ones(len(dim), dtype=bool)
+    if exchanges:
+        allowed &= dim["Sàn"].isin(exchanges).to_numpy()
+    if sectors:
+        allowed &= dim[sector_col].isin(sectors).to_numpy()
+    return (codes >= 0) & allowed[codes]
+
+
+# --- Chỉ mục mã -> dòng cho ô tìm kiếm ---
+# tickers: mọi mã (đã sắp xếp) của các bảng được chỉ mục; mã số nguyên = vị trí trong tickers.
+# postings[bảng] = (order, offsets): các dòng của mã c là order[offsets[c]:offsets[c + 1]].
+# Truy vấn tiền tố = searchsorted trên tickers, lấy dòng = cắt theo offsets
+# -> thời gian theo số mã/dòng khớp, không theo số dòng của bảng.
+# Tên công ty: các từ (đã bỏ dấu) của mọi tên được sắp xếp, mỗi từ tìm là một khoảng searchsorted
+# (tiền tố của từ trong tên); cụm nhiều từ chỉ kiểm tra đúng thứ tự trên các tên ứng viên
+# -> thời gian theo số tên có từ khớp, không quét toàn bộ danh sách tên.
+TICKER_COLUMNS = ["Mã CP", "MÃ CK", "Mã CK", "Mã", "Ticker", "symbol"]
+# Tìm trong tên công ty khi cụm tìm kiếm (đã bỏ dấu) dài tối thiểu chừng này ký tự
+MIN_NAME_QUERY = 3
+
+
+def ticker_column(df):
+    return next((c for c in TICKER_COLUMNS if c in df.columns), None)
+
+
+def _clean_tickers(values):
+    return pd.Series(values, dtype="string").str.strip().str.upper()
+
+
+def fold_text(text):
+    # "Tiên Sơn Thanh Hóa" -> "tien son thanh hoa" (bỏ dấu, chữ thường) để tìm theo tên
+    text = str(text).replace("đ", "d").replace("Đ", "D")
+    text = unicodedata.normalize("NFD", text)
+    return "".join(ch for ch in text if not unicodedata.combining(ch)).casefold()
+
+
+def _ticker_codes(tickers, values):
+    # Mã -> mã số nguyên (vị trí trong tickers đã sắp xếp), -1 nếu trống/không có
+    values = values.fillna("").to_numpy(dtype=object)
+    if not len(tickers):
+        return np.full(len(values), -1)
+    codes = np.minimum(np.searchsorted(tickers, values), len(tickers) - 1)
+    return np.where(tickers[codes] == values, codes, -1)
+
+
+def _postings(tickers, codes):
+    # Danh sách dòng theo mã: thứ tự dòng (gom theo mã) + offsets -> các dòng của mã c là một lát cắt
+    order = np.argsort(codes, kind="stable")
+    offsets = np.searchsorted(codes[order], np.arange(len(tickers) + 1))
+    return order, offsets
+
+
+def build_ticker_index(tables, names=None, universe=None):
+    # tables: {tên bảng: Series mã theo thứ tự dòng} (có danh sách dòng theo mã);
+    # universe: Series mã chỉ để tìm kiếm (không tra dòng); names: Series tên công ty, index = mã
+    tables = {name: _clean_tickers(values) for name, values in tables.items()}
+    names = pd.Series(dtype=object) if names is None else names
+    name_tickers = _clean_tickers(names.index)
+    universe = _clean_tickers(pd.Series(dtype=object) if universe is None else universe)
+
+    all_tickers = pd.concat([*tables.values(), universe, name_tickers], ignore_index=True).dropna()
+    tickers = np.unique(all_tickers[all_tickers != ""].to_numpy(dtype=object))
+
+    postings = {name: _postings(tickers, _ticker_codes(tickers, values)) for name, values in tables.items()}
+    return {"tickers": tickers, "postings": postings, "names": build_name_index(names)}
+
+
+def _words(folded):
+    return re.findall(r"\w+", folded)
+
+
+def build_name_index(names):
+    # names: Series tên công ty, index = mã -> từ của các tên (sắp xếp) + id tên của từng từ
+    phrases = [" ".join(_words(fold_text(n))) for n in names.to_numpy()]
+    words = [(word, i) for i, phrase in enumerate(phrases) for word in phrase.split()]
+    tokens = np.array([w for w, _ in words], dtype=str)
+    ids = np.array([i for _, i in words], dtype=np.intp)
+    order = np.argsort(tokens, kind="stable")
+    return {
+        "tickers": _clean_tickers(names.index), "phrases": phrases, "tokens": tokens[order], "ids": ids[order],
+    }
+
+
+def _match_names(names, text):
+    # id các tên chứa cụm text (bỏ dấu): mỗi từ của cụm là tiền tố một từ trong tên, đúng thứ tự
+    words = _words(fold_text(text))
+    tokens, ids = names["tokens"], names["ids"]
+    candidates = None
+    for word in words:
+        lo = np.searchsorted(tokens, word, side="left")
+        hi = np.searchsorted(tokens, word + "\uffff", side="left")
+        found = np.unique(ids[lo:hi])
+        candidates = found if candidates is None else np.intersect1d(candidates, found, assume_unique=True)
+    if candidates is None:
+        return np.empty(0, dtype=np.intp)
+    if len(words) > 1:
+        phrase = " ".join(words)
+        candidates = candidates[[phrase in names["phrases"][i] for i in candidates]].astype(np.intp)
+    return candidates
+
+
+def build_postings(index, values):
+    # Danh sách dòng theo mã cho một bảng bất kỳ (vd. kết quả lọc đang hiển thị), mã số theo index
+    return _postings(index["tickers"], _ticker_codes(index["tickers"], _clean_tickers(values)))
+
+
+def _match_pattern(tickers, word):
+    # Mã bắt đầu bằng word; word có * ? [] -> khớp mẫu (chỉ duyệt các mã có cùng tiền tố cố định)
+    literal = re.split(r"[*?\[]", word, maxsplit=1)[0]
+    lo = np.searchsorted(tickers, literal, side="left")
+    hi = np.searchsorted(tickers, literal + "\uffff", side="left")
+    if literal == word:
+        return np.arange(lo, hi)
+    matched = [fnmatch.fnmatchcase(t, word) for t in tickers[lo:hi]]
+    return np.arange(lo, hi)[np.asarray(matched, dtype=bool)]
+
+
+def match_tickers(index, query):
+    # "ACB, HD, VN*, tiên sơn" -> mã số nguyên (tăng dần) của các mã khớp.
+    # Mỗi từ là tiền tố mã hoặc mẫu * ?; mỗi cụm (không có * ?) giữa hai dấu phẩy còn được tìm
+    # trong tên công ty, theo đầu từ: "xi mang" khớp "Xi măng Bỉm Sơn", "i mang" thì không.
+    tickers = index["tickers"]
+    found = [np.empty(0, dtype=np.intp)]
+    for part in query.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        found += [_match_pattern(tickers, word) for word in part.upper().split()]
+        if len(fold_text(part)) >= MIN_NAME_QUERY and not set(part) & set("*?"):
+            names = index["names"]
+            found.append(_ticker_codes(tickers, names["tickers"].iloc[_match_names(names, part)]))
+    codes = np.unique(np.concatenate(found))
+    return codes[codes >= 0]
+
+
+def index_tickers(index, codes):
+    return index["tickers"][codes]
+
+
+def posting_rows(postings, codes):
+    # Vị trí dòng (tăng dần, giữ thứ tự gốc của bảng) của các mã; chỉ chạm tới các dòng khớp
+    order, offsets = postings
+    parts = [order[offsets[c]:offsets[c + 1]] for c in codes]
+    return np.sort(np.concatenate(parts)) if parts else np.empty(0, dtype=np.intp)
+
+
+def ticker_rows(index, table, codes):
+    return posting_rows(index["postings"][table], codes)
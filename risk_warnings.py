@@ -0,0 +1,674 @@
+# --- Các nhóm cảnh báo rủi ro (dùng chung cho dashboard và batch) ---
+# Không phụ thuộc streamlit: ui_new.py bọc các hàm load_* bằng st.cache_resource,
+# còn batch job tính toàn bộ nhóm cho tất cả mã và ghi snapshot theo phiên bản.
+#
+# Mỗi nhóm có một bảng "gốc" (tất cả mã, tất cả kỳ) được tính một lần; dashboard
+# chỉ lọc bảng gốc theo lựa chọn của người dùng (kỳ, ngành, chỉ số...).
+#
+# Chạy:
+#   python risk_warnings.py                      # tính tất cả nhóm, ghi snapshots/<run_id>/
+#   python risk_warnings.py --groups bctc_am     # chỉ một số nhóm
+#   python risk_warnings.py --workers 1          # không dùng process pool
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+import change_feed
+import data_cache
+import fundamentals_store
+import risk_engine
+import volume_engine
+
+SUMMARY_PATH = os.path.join("result", "summary.xlsx")
+QTRR_PATH = os.path.join("result", "qtrr_output1.xlsx")
+CP_PATH = os.path.join("data", "cp.csv")
+PRICE_PATH = os.path.join("data", "stock_prices.csv")
+VOLUME_PATH = volume_engine.SIGNAL_PATH
+HOSE_MARGIN_PATH = os.path.join("result1", "tinh_trang_chung_khoan_hose.csv")
+HNX_NO_MARGIN_PATH = os.path.join("result1", "khong_duoc_ky_quy_hnx.csv")
+HNX_STATUS_PATH = os.path.join("result1", "tinh_trang_chung_khoan_hnx.csv")
+MARGIN_LIST_PATHS = [HOSE_MARGIN_PATH, HNX_NO_MARGIN_PATH, HNX_STATUS_PATH]
+SOURCE_PATHS = [SUMMARY_PATH, QTRR_PATH, CP_PATH, PRICE_PATH, VOLUME_PATH, *MARGIN_LIST_PATHS]
+
+SNAPSHOT_DIR = Path(os.environ.get("QTRR_SNAPSHOT_DIR", "snapshots"))
+LATEST_NAME = "LATEST"
+SNAPSHOT_MANIFEST = "manifest.json"
+# Số lần chạy batch được giữ lại trong SNAPSHOT_DIR
+KEEP_SNAPSHOTS = 5
+# Version logic của dữ liệu trong snapshot: snapshot (và cache dẫn xuất) build bằng version khác
+# thì không dùng lại dù file nguồn không đổi. Tăng "groups" khi đổi cách tính bảng gốc của nhóm.
+SNAPSHOT_VERSIONS = {**fundamentals_store.ARTIFACTS, "groups": 2}
+
+# Các cột qtrr mà từng nhóm cảnh báo cần (chỉ đọc các cột này từ cache)
+QTRR_PERIOD_COLS = risk_engine.QTRR_PERIOD_COLS
+QTRR_ROOM_COLS = ["Ticker", "LengthReport", "KyBaoCao", "PeriodIdx", "Vốn cổ phần"]
+
+FINANCIAL_COLS = [
+    "Ticker", "KyBaoCao", risk_engine.FAKE_GROWTH_COL, risk_engine.CFO_COL,
+    risk_engine.REVENUE_COL, "Cổ đông của công ty mẹ", "LNST",
+]
+VOLUME_RENAME = {
+    "symbol": "Mã CP",
+    "time": "Ngày",
+    "volume": "Khối lượng",
+    "vol_ma20": "TB 20 phiên",
+    "vol_ma50": "TB 50 phiên",
+    "vol_ma100": "TB 100 phiên",
+    "vol_ma200": "TB 200 phiên",
+    "vol_vs_ma20_pct": "% Tăng, giảm so với TB20",
+    "vol_vs_ma50_pct": "% Tăng, giảm so với TB50",
+    "vol_vs_ma100_pct": "% Tăng, giảm so với TB100",
+    "vol_vs_ma200_pct": "% Tăng, giảm so với TB200",
+    "flag_ma20": "Flag MA20",
+    "flag_ma50": "Flag MA50",
+    "flag_ma100": "Flag MA100",
+    "flag_ma200": "Flag MA200",
+    "flag_break_vol_100": "Đột biến Vol 100",
+    "flag_break_vol_200": "Đột biến Vol 200"
+}
+VOLUME_COLS = ["symbol", "time", "volume", "vol_vs_ma20_pct", "vol_vs_ma50_pct", "vol_vs_ma100_pct", "vol_vs_ma200_pct", "flag_break_vol_100", "flag_break_vol_200"]
+
+logger = logging.getLogger(__name__)
+
+
+def data_version(signature=data_cache.source_signature):
+    # Phiên bản dữ liệu = chữ ký (mtime, size) của tất cả file nguồn.
+    # signature: hàm path -> chữ ký (mặc định đọc từ đĩa, xem published_signature)
+    return tuple(signature(p) for p in SOURCE_PATHS)
+
+
+# --- Đọc dữ liệu nguồn ---
+def load_qtrr_source(path):
+    # Parse Excel, chuyển sang schema gọn (category + int nhỏ + float32 cho tỷ lệ khi đủ chính xác) và ingest
+    # vào kho append-only (chỉ phần thay đổi so với phiên bản trước được tính lại cờ/rank)
+    return fundamentals_store.load("qtrr", path)
+
+
+def load_qtrr(columns=None, signature=None):
+    return data_cache.load_columnar(
+        QTRR_PATH, columns=list(columns) if columns else None, signature=signature,
+        reader=load_qtrr_source, version=risk_engine.QTRR_SCHEMA_VERSION
+    )
+
+
+def load_cp(signature=None):
+    df = data_cache.load_columnar(CP_PATH, signature=signature)
+    if "Ticker" in df.columns:
+        df["Ticker"] = df["Ticker"].astype(str).str.strip().str.upper()
+    return df
+
+
+def load_summary(signature=None):
+    return data_cache.load_columnar(SUMMARY_PATH, signature=signature)
+
+
+def _derived_version(version):
+    # Bảng dẫn xuất từ qtrr phụ thuộc cả schema qtrr (kiểu cột): đổi một trong hai thì build lại
+    return f"{version}.q{risk_engine.QTRR_SCHEMA_VERSION}"
+
+
+def load_warning_flags(signature=None):
+    # Bảng cờ tính sẵn, chỉ build lại khi qtrr_output1.xlsx thay đổi
+    if signature is None:
+        signature = data_cache.source_signature(QTRR_PATH)
+    return data_cache.load_derived(
+        "warning_flags", QTRR_PATH, lambda: fundamentals_store.load("flags", QTRR_PATH),
+        version=_derived_version(risk_engine.FLAG_STORE_VERSION), signature=signature
+    )
+
+
+def load_industry_table(signature=None):
+    # Bảng gốc So sánh ngành, được kho qtrr cập nhật tăng dần theo nhóm (kỳ, ngành)
+    if signature is None:
+        signature = data_cache.source_signature(QTRR_PATH)
+    return data_cache.load_derived(
+        "industry_table", QTRR_PATH, lambda: fundamentals_store.load("industry", QTRR_PATH),
+        version=_derived_version(risk_engine.INDUSTRY_TABLE_VERSION), signature=signature
+    )
+
+
+def load_prices(signature=None):
+    return data_cache.load_columnar(PRICE_PATH, columns=["symbol", "close", "time"], signature=signature)
+
+
+def _optional(loader):
+    # File nguồn không bắt buộc (cp.csv, giá ngày...): thiếu thì dùng bảng rỗng
+    try:
+        return loader()
+    except Exception:
+        return pd.DataFrame()
+
+
+def _load_volume_manifest():
+    return volume_engine.ensure_partitions(VOLUME_PATH, volume_engine.PARTITION_DIR, PRICE_PATH)
+
+
+def _load_margin_lists():
+    return pd.concat([build_hose_margin_table(), build_hnx_no_margin_table(), build_hnx_status_table()])
+
+
+# --- Warm-up: parse song song mọi nguồn vào cache trên đĩa ---
+# nguồn -> hàm parse (chạy trong process riêng, kết quả nằm trong data_cache)
+WARM_TASKS = {
+    "summary.xlsx": load_summary,
+    "qtrr_output1.xlsx": load_warning_flags,   # parse qtrr + build bảng cờ
+    "cp.csv": load_cp,
+    "stock_prices.csv": load_prices,
+    "volume_signal_daily.csv": _load_volume_manifest,
+    "GDKQ (result1/*.csv)": _load_margin_lists,
+}
+
+
+def _pool(workers):
+    # spawn: an toàn khi được gọi từ thread của server (Streamlit) hoặc thread refresher
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def _warm_one(name):
+    started = time.perf_counter()
+    WARM_TASKS[name]()
+    return time.perf_counter() - started
+
+
+def warm_sources(names=None, workers=None):
+    # Parse các nguồn đồng thời: thời gian ~ file chậm nhất thay vì tổng tất cả.
+    # Trả về {nguồn: số giây} (None nếu nguồn lỗi/không có file), thời gian từng nguồn được ghi log.
+    names = list(names or WARM_TASKS)
+    if workers is None:
+        workers = min(len(names), os.cpu_count() or 1)
+    started = time.perf_counter()
+    timings = {}
+
+    def record(name, get_seconds):
+        try:
+            timings[name] = get_seconds()
+            logger.info("Warm-up %s: %.2fs", name, timings[name])
+        except FileNotFoundError:
+            timings[name] = None
+            logger.info("Warm-up %s: không có file", name)
+        except Exception as e:
+            timings[name] = None
+            logger.warning("Warm-up %s: lỗi %r", name, e)
+
+    if workers <= 1:
+        for name in names:
+            record(name, lambda: _warm_one(name))
+    else:
+        with _pool(workers) as pool:
+            futures = {pool.submit(_warm_one, name): name for name in names}
+            for future in as_completed(futures):
+                record(futures[future], future.result)
+    logger.info("Warm-up %d nguồn: %.2fs", len(names), time.perf_counter() - started)
+    return timings
+
+
+def load_ticker_dim():
+    return risk_engine.build_ticker_dim(
+        _optional(load_cp), _optional(load_summary), _optional(lambda: load_qtrr(["Ticker", "Nganh"]))
+    )
+
+
+# Nhóm có cột tên công ty (tìm theo tên); TICKER_INDEX_GROUPS: thêm các mã chỉ có ở đây
+NAME_GROUPS = ["gdkq_hose", "gdkq_hnx_khong_ky_quy", "gdkq_hnx_tinh_trang"]
+TICKER_INDEX_GROUPS = NAME_GROUPS + ["khoi_luong"]
+
+
+def _index_tables(names, signature):
+    return {name: _optional(lambda: load_group_table(name, version=group_version(name, signature))) for name in names}
+
+
+def _company_names(tables):
+    # Series tên công ty (index = mã) từ các bảng có cột "Tên công ty"; None nếu không có
+    names = []
+    for table in tables.values():
+        col = risk_engine.ticker_column(table)
+        if col and "Tên công ty" in table.columns:
+            names.append(table.set_index(col)["Tên công ty"])
+    if not names:
+        return None
+    names = pd.concat(names).dropna()
+    return names[~names.index.duplicated()]
+
+
+def load_summary_index(signature=data_cache.source_signature):
+    # Chỉ mục cho tab xếp hạng: danh sách dòng của summary + tên công ty (danh sách GDKQ).
+    # Không load qtrr, cp hay bảng khối lượng như chỉ mục của tab cảnh báo.
+    summary = _optional(lambda: load_summary(signature(SUMMARY_PATH))).get("Mã")
+    names = _company_names(_index_tables(NAME_GROUPS, signature))
+    return risk_engine.build_ticker_index({"summary": summary} if summary is not None else {}, names)
+
+
+def load_ticker_index(signature=data_cache.source_signature):
+    # Chỉ mục cho tab cảnh báo: mã của summary, qtrr, cp và các bảng GDKQ/khối lượng, chỉ để tìm kiếm
+    # (bảng của tab được tra dòng trên kết quả lọc, xem risk_engine.build_postings); tên công ty
+    # lấy từ danh sách HOSE/HNX.
+    tables = _index_tables(TICKER_INDEX_GROUPS, signature)
+    universe = [
+        _optional(lambda: load_summary(signature(SUMMARY_PATH))).get("Mã"),
+        _optional(lambda: load_qtrr(["Ticker"], signature=signature(QTRR_PATH))).get("Ticker"),
+        _optional(lambda: load_cp(signature(CP_PATH))).get("Ticker"),
+    ]
+    for table in tables.values():
+        col = risk_engine.ticker_column(table)
+        if col:
+            universe.append(table[col])
+    universe = [values.astype(object) for values in universe if values is not None]
+    universe = pd.concat(universe, ignore_index=True) if universe else None
+    return risk_engine.build_ticker_index({}, _company_names(tables), universe)
+
+
+# --- Bảng gốc của từng nhóm (tất cả mã, tất cả kỳ) ---
+def build_financial_table():
+    # Tăng trưởng ảo: mọi kỳ của cả hai chế độ xem, kèm view/YearReport/PeriodIdx để lọc
+    df_flags = load_warning_flags()
+    cols = ["view", "PeriodIdx", "YearReport"] + FINANCIAL_COLS
+    df = df_flags.reset_index()
+    return df[[c for c in cols if c in df.columns]]
+
+
+def build_cash_flow_table():
+    # BCTC âm: kỳ mới nhất của mỗi mã (mỗi view) với chuỗi âm của tất cả chỉ số
+    df_flags = load_warning_flags()
+    # Rows are sorted latest first inside each (view, Ticker)
+    keys = df_flags.index.droplevel("PeriodIdx")
+    df = df_flags[~keys.duplicated()].reset_index()
+    streak_cols = [c for c in df.columns if c.startswith(risk_engine.negative_streak_col(""))]
+    return df[["view", "Ticker", "KyBaoCao"] + streak_cols]
+
+
+def build_industry_table():
+    # So sánh ngành: rank + chênh lệch với TB ngành của mọi chỉ số, mọi kỳ, mọi ngành
+    return load_industry_table()
+
+
+def read_margin_list(path, rename_map, required=False):
+    # required=False: file không tồn tại -> bảng rỗng (danh sách HNX không bắt buộc)
+    if not required and not os.path.exists(path):
+        return pd.DataFrame()
+    df = pd.read_csv(path)
+    return df.rename(columns=rename_map) if not df.empty else pd.DataFrame()
+
+
+def build_hose_margin_table():
+    # Rename symbol to Mã CP for consistency
+    return read_margin_list(HOSE_MARGIN_PATH, {"symbol": "Mã CP"}, required=True)
+
+
+def build_hnx_no_margin_table():
+    # Rename columns to match expected schema ("Mã CP", "Lý do")
+    return read_margin_list(HNX_NO_MARGIN_PATH, {"Mã CK": "Mã CP"})
+
+
+def build_hnx_status_table():
+    return read_margin_list(HNX_STATUS_PATH, {
+        "Mã CK": "Mã CP",
+        "Tình trạng chứng khoán": "Lý do",
+        "Tên tổ chức phát hành": "Tên công ty"
+    })
+
+
+def build_volume_table():
+    # Khối lượng: phiên giao dịch mới nhất của từng mã (mã không giao dịch ở phiên cuối vẫn được giữ)
+    manifest = volume_engine.ensure_partitions(VOLUME_PATH, volume_engine.PARTITION_DIR, PRICE_PATH)
+    if not manifest or not manifest["dates"]:
+        raise FileNotFoundError(VOLUME_PATH)
+    return volume_table(volume_engine.read_latest(volume_engine.PARTITION_DIR))
+
+
+def build_room_table():
+    # Room margin: snapshot Vốn cổ phần + giá mới nhất (không phụ thuộc vốn nhập vào)
+    return risk_engine.build_room_snapshot(
+        _optional(load_cp), _optional(lambda: load_qtrr(QTRR_ROOM_COLS)), _optional(load_prices)
+    )
+
+
+def build_risk_matrix_table():
+    # Ma trận rủi ro: mọi nhóm cảnh báo của mỗi mã trên một dòng, từ cùng các bảng đã cache
+    # (bảng cờ, bảng ngành, danh sách GDKQ, phiên khối lượng mới nhất, snapshot Room)
+    margin_lists = {
+        "HOSE": _optional(build_hose_margin_table),
+        "HNX không ký quỹ": _optional(build_hnx_no_margin_table),
+        "HNX tình trạng": _optional(build_hnx_status_table),
+    }
+    return risk_engine.build_risk_matrix(
+        _optional(load_warning_flags), _optional(load_industry_table), margin_lists, _optional(build_volume_table), build_room_table()
+    )
+
+
+# tên nhóm -> (hàm build bảng gốc, các file nguồn quyết định phiên bản của bảng)
+GROUPS = {
+    "tang_truong_ao": (build_financial_table, [QTRR_PATH]),
+    "bctc_am": (build_cash_flow_table, [QTRR_PATH]),
+    "so_sanh_nganh": (build_industry_table, [QTRR_PATH]),
+    "gdkq_hose": (build_hose_margin_table, [HOSE_MARGIN_PATH]),
+    "gdkq_hnx_khong_ky_quy": (build_hnx_no_margin_table, [HNX_NO_MARGIN_PATH]),
+    "gdkq_hnx_tinh_trang": (build_hnx_status_table, [HNX_STATUS_PATH]),
+    "khoi_luong": (build_volume_table, [VOLUME_PATH, PRICE_PATH]),
+    "room_margin": (build_room_table, [CP_PATH, QTRR_PATH, PRICE_PATH]),
+    "ma_tran_rui_ro": (build_risk_matrix_table, [
+        QTRR_PATH, HOSE_MARGIN_PATH, HNX_NO_MARGIN_PATH, HNX_STATUS_PATH, VOLUME_PATH, PRICE_PATH, CP_PATH
+    ]),
+}
+
+
+def group_version(name, signature=data_cache.source_signature):
+    # Chữ ký các file nguồn của nhóm (list để so sánh được với manifest JSON)
+    return [list(s) if s else None for s in (signature(p) for p in GROUPS[name][1])]
+
+
+# --- Lọc theo lựa chọn trên dashboard ---
+def financial_warnings(table, view_mode, selected_year=None, selected_periods=None):
+    if table.empty:
+        return pd.DataFrame()
+
+    # 1. Filter by Period Type + User Selection
+    mask = table["view"] == view_mode
+    if selected_year:
+        mask &= table["YearReport"] == selected_year
+
+    if view_mode == "Quý" and selected_periods:
+        mask &= table["PeriodIdx"].isin(selected_periods)
+
+    # 2. Select and Rename Columns
+    cols_existing = [c for c in FINANCIAL_COLS if c in table.columns]
+    return table.loc[mask, cols_existing].reset_index(drop=True).rename(columns={
+        "Cổ đông của công ty mẹ": "Lợi nhuận của công ty mẹ",
+        "Ticker": "Mã CP"
+    })
+
+
+def streak_metric_names(table):
+    # Các chỉ số có sẵn chuỗi âm trong bảng BCTC âm
+    prefix = risk_engine.negative_streak_col("")
+    return [
+        c[len(prefix):] for c in table.columns
+        if c.startswith(prefix) and c != risk_engine.longest_negative_streak_col(c[len(prefix):])
+    ]
+
+
+def cash_flow_warnings(table, view_mode, metrics=None, min_streak=0):
+    if metrics is None:
+        metrics = risk_engine.DEFAULT_NEGATIVE_METRICS
+    if table.empty:
+        return pd.DataFrame()
+
+    # 1. Filter by Period Type (table has the latest report of each Ticker)
+    df_filtered = table[table["view"] == view_mode]
+    if df_filtered.empty:
+        return pd.DataFrame()
+
+    # 2. Precomputed streak lengths of each metric:
+    # current number of consecutive negative periods + longest streak in history
+    rename_map = {"Ticker": "Mã CP"}
+    streak_cols = []
+    for metric in metrics:
+        cur_col = risk_engine.negative_streak_col(metric)
+        if cur_col not in df_filtered.columns:
+            continue
+        rename_map[cur_col] = f"{metric} (kỳ âm liên tiếp)"
+        rename_map[risk_engine.longest_negative_streak_col(metric)] = f"{metric} (chuỗi âm dài nhất)"
+        streak_cols.append(cur_col)
+
+    # 3. Keep tickers whose current streak reaches the threshold on any metric
+    if min_streak > 0 and streak_cols:
+        df_filtered = df_filtered[(df_filtered[streak_cols] >= min_streak).any(axis=1)]
+
+    existing_cols = [c for c in rename_map if c in df_filtered.columns]
+    existing_cols.insert(1, "KyBaoCao")
+    return df_filtered[existing_cols].reset_index(drop=True).rename(columns=rename_map)
+
+
+def industry_comparison(table, view_mode, selected_year, selected_periods, selected_industries, metrics=None):
+    if not metrics:
+        metrics = risk_engine.DEFAULT_INDUSTRY_METRICS
+    if table.empty:
+        return pd.DataFrame()
+
+    # 1. Base Filter
+    mask = table["view"] == view_mode
+
+    # 2. Filter by Year
+    if selected_year:
+        mask &= table["YearReport"] == selected_year
+
+    # 3. Filter by Quarter (if applicable)
+    if view_mode == "Quý" and selected_periods:
+        mask &= table["PeriodIdx"].isin(selected_periods)
+
+    # 4. Filter by Industry
+    if selected_industries:
+        mask &= table["Nganh"].isin(selected_industries)
+
+    # --- Cleaning: Replace inf/-inf with NaN, drop rows with no valid metric data ---
+    df_final = risk_engine.clean_industry_result(table[mask], metrics)
+    if df_final.empty:
+        return pd.DataFrame()
+
+    # Select columns
+    cols_to_show = ["Ticker", "Nganh", "YearReport", "KyBaoCao"]
+    for metric in metrics:
+        cols_to_show += [*risk_engine.industry_columns(metric), metric]
+    cols_existing = [c for c in cols_to_show if c in df_final.columns]
+    return df_final[cols_existing].reset_index(drop=True).rename(columns={"Ticker": "Mã CP"})
+
+
+def volume_table(signals):
+    # Tín hiệu khối lượng -> bảng hiển thị (đổi tên cột, phiên mới nhất trước)
+    if signals.empty:
+        return pd.DataFrame()
+    existing_cols = [c for c in VOLUME_COLS if c in signals.columns]
+    df_final = signals[existing_cols].rename(columns=VOLUME_RENAME)
+    if "Ngày" in df_final.columns:
+        df_final = df_final.sort_values(by="Ngày", ascending=False)
+    return df_final
+
+
+def room_margin(snapshot, capital_billion):
+    return risk_engine.room_margin(snapshot, capital_billion).rename(columns={"Ticker": "Mã CP"})
+
+
+def room_margin_grid(snapshot, capitals):
+    return risk_engine.room_margin_grid(snapshot, capitals).rename(columns={"Ticker": "Mã CP"})
+
+
+def risk_matrix(table, view_mode, min_score=0, sort_col=risk_engine.RISK_SCORE_COL, ascending=False):
+    # Bảng đã sắp xếp sẵn theo Điểm rủi ro giảm dần trong từng view -> chỉ lọc;
+    # sắp theo cột khác bằng argsort ổn định (giá trị trống luôn ở cuối)
+    if table.empty:
+        return pd.DataFrame()
+    df = table[(table["view"] == view_mode) & (table[risk_engine.RISK_SCORE_COL] >= min_score)]
+    if sort_col != risk_engine.RISK_SCORE_COL or ascending:
+        df = df.sort_values(sort_col, ascending=ascending, kind="stable", na_position="last")
+    return df.drop(columns=["view"]).reset_index(drop=True)
+
+
+# --- Snapshot theo phiên bản ---
+# snapshots/<run_id>/<nhóm>.arrow (hoặc .parquet/.pkl) + manifest.json, snapshots/LATEST chứa run_id mới nhất.
+_latest_memo = {}
+
+
+def latest_snapshot(snapshot_dir=SNAPSHOT_DIR):
+    # (thư mục, manifest) của lần chạy batch mới nhất; None nếu chưa có.
+    # Manifest chỉ được đọc lại khi file LATEST đổi (được gọi ở mỗi lần rerun).
+    latest_path = Path(snapshot_dir) / LATEST_NAME
+    key = (str(latest_path), data_cache.source_signature(latest_path))
+    if key in _latest_memo:
+        return _latest_memo[key]
+    try:
+        run_dir = Path(snapshot_dir) / latest_path.read_text(encoding="utf-8").strip()
+        with open(run_dir / SNAPSHOT_MANIFEST, encoding="utf-8") as f:
+            result = run_dir, json.load(f)
+    except (OSError, ValueError):
+        return None
+    _latest_memo.clear()
+    _latest_memo[key] = result
+    return result
+
+
+def snapshot_current(manifest):
+    # Snapshot được build bằng đúng version logic hiện tại (snapshot cũ không có "versions")
+    return manifest.get("versions") == SNAPSHOT_VERSIONS
+
+
+def published_signature(path, snapshot_dir=SNAPSHOT_DIR):
+    # Chữ ký của file nguồn tại lần build snapshot mới nhất (đã có cache sẵn);
+    # file chưa được build thì dùng chữ ký hiện tại trên đĩa.
+    latest = latest_snapshot(snapshot_dir)
+    sources = latest[1].get("sources", {}) if latest else {}
+    if path in sources:
+        return tuple(sources[path]) if sources[path] else None
+    return data_cache.source_signature(path)
+
+
+def read_snapshot(name, snapshot_dir=SNAPSHOT_DIR, version=None):
+    # Bảng gốc của nhóm từ snapshot mới nhất, chỉ khi snapshot được tính từ đúng phiên bản
+    # file nguồn (mặc định: file hiện tại trên đĩa)
+    latest = latest_snapshot(snapshot_dir)
+    if latest is None:
+        return None
+    run_dir, manifest = latest
+    if not snapshot_current(manifest):
+        return None
+    entry = manifest["groups"].get(name)
+    if version is None:
+        version = group_version(name)
+    if entry is None or entry["sources"] != [list(v) if v else None for v in version]:
+        return None
+    try:
+        return data_cache.read_frame(run_dir / entry["file"])
+    except Exception:
+        return None
+
+
+def load_group_table(name, snapshot_dir=SNAPSHOT_DIR, version=None):
+    # Dashboard: đọc snapshot nếu còn khớp dữ liệu, nếu không thì tính trực tiếp
+    table = read_snapshot(name, snapshot_dir, version)
+    if table is None:
+        table = GROUPS[name][0]()
+    return table
+
+
+def _compute_group(name, run_dir):
+    # Chạy trong process con: tính một nhóm và ghi file, trả về thông tin cho manifest
+    started = time.perf_counter()
+    sources = group_version(name)
+    table = GROUPS[name][0]()
+    path = data_cache.write_frame(table, run_dir / f"{name}.parquet", run_dir / f"{name}.pkl")
+    return name, {
+        "file": path.name,
+        "rows": len(table),
+        "sources": sources,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def _write_latest(snapshot_dir, run_id):
+    path = Path(snapshot_dir) / LATEST_NAME
+    tmp = path.with_name(f"{LATEST_NAME}.{os.getpid()}.tmp")
+    tmp.write_text(run_id, encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _prune_snapshots(snapshot_dir, keep):
+    runs = sorted(p for p in Path(snapshot_dir).iterdir() if p.is_dir())
+    for run_dir in runs[:-keep] if keep > 0 else []:
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+
+def run_batch(groups=None, snapshot_dir=SNAPSHOT_DIR, workers=None, keep=KEEP_SNAPSHOTS):
+    # Tính các nhóm song song (mỗi nhóm một process), ghi snapshots/<run_id>/ rồi trỏ LATEST tới.
+    # Trả về (run_id, manifest, {nhóm: lỗi}).
+    groups = list(groups or GROUPS)
+    # Chữ ký lấy trước khi tính: file đổi trong lúc chạy sẽ được build lại ở lần sau
+    sources = {p: data_cache.source_signature(p) for p in SOURCE_PATHS}
+    run_id = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    run_dir = Path(snapshot_dir) / run_id
+    run_dir.mkdir(parents=True, exist_ok=True)
+
+    results, errors = {}, {}
+    if workers is None:
+        workers = min(len(groups), os.cpu_count() or 1)
+    # Parse tất cả nguồn (song song) một lần trước khi tính các nhóm: các nhóm đọc lại
+    # từ cache trên đĩa thay vì cùng parse file Excel. summary.xlsx không thuộc nhóm nào
+    # nhưng cũng được parse sẵn cho tab xếp hạng.
+    warm_sources(workers=workers)
+    if workers <= 1:
+        for name in groups:
+            try:
+                results.update([_compute_group(name, run_dir)])
+            except Exception as e:
+                errors[name] = repr(e)
+    else:
+        with _pool(workers) as pool:
+            futures = {pool.submit(_compute_group, name, run_dir): name for name in groups}
+            for future in as_completed(futures):
+                try:
+                    results.update([future.result()])
+                except Exception as e:
+                    errors[futures[future]] = repr(e)
+
+    # Nhóm không chạy lần này (hoặc bị lỗi) giữ bản của snapshot trước nếu vẫn khớp dữ liệu và version
+    previous = latest_snapshot(snapshot_dir)
+    if previous is not None and snapshot_current(previous[1]):
+        prev_dir, prev_manifest = previous
+        for name, entry in prev_manifest["groups"].items():
+            if name in results or name not in GROUPS or entry["sources"] != group_version(name):
+                continue
+            shutil.copy2(prev_dir / entry["file"], run_dir / entry["file"])
+            results[name] = entry
+
+    manifest = {
+        "run_id": run_id,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "sources": {p: list(sig) if sig else None for p, sig in sources.items()},
+        "versions": SNAPSHOT_VERSIONS,
+        "groups": {name: results[name] for name in GROUPS if name in results},
+        "errors": errors,
+    }
+    # Thay đổi cảnh báo so với snapshot trước -> lịch sử snapshots/changes.*, tóm tắt trong manifest
+    changes = change_feed.diff_snapshot(run_dir, manifest, previous)
+    manifest["changes"] = {
+        group: {kind: int(n) for kind, n in part["Thay đổi"].value_counts().items()} for group, part in changes.groupby("Nhóm", observed=True)
+    }
+    change_feed.append_history(snapshot_dir, changes)
+    with open(run_dir / SNAPSHOT_MANIFEST, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    _write_latest(snapshot_dir, run_id)
+    _prune_snapshots(snapshot_dir, keep)
+    # Cache của chữ ký cũ chỉ được xoá sau khi LATEST đã trỏ sang bản mới
+    # (giữ cả chữ ký hiện tại nếu file vừa đổi trong lúc chạy: lần chạy sau dùng lại được)
+    data_cache.prune_stale(sources, {p: data_cache.source_signature(p) for p in SOURCE_PATHS})
+    return run_id, manifest, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tính tất cả nhóm cảnh báo rủi ro và ghi snapshot cho dashboard.")
+    parser.add_argument("--groups", nargs="+", choices=list(GROUPS), help="Chỉ tính các nhóm này (mặc định: tất cả)")
+    parser.add_argument("--out", default=str(SNAPSHOT_DIR), help="Thư mục snapshot")
+    parser.add_argument("--workers", type=int, default=None, help="Số process (1 = chạy tuần tự)")
+    parser.add_argument("--keep", type=int, default=KEEP_SNAPSHOTS, help="Số lần chạy được giữ lại")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    run_id, manifest, errors = run_batch(args.groups, args.out, args.workers, args.keep)
+    for name, entry in manifest["groups"].items():
+        print(f"{name}: {entry['rows']} dòng ({entry.get('seconds', 0)}s)")
+    for name, error in errors.items():
+        print(f"Lỗi nhóm {name}: {error}")
+    for group, counts in manifest["changes"].items():
+        print(f"Thay đổi {group}: " + ", ".join(f"{kind} {n}" for kind, n in counts.items()))
+    print(f"Đã ghi snapshot {run_id} vào {args.out}")
+    raise SystemExit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
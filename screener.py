@@ -0,0 +1,209 @@
+# --- Bộ lọc theo biểu thức trên dữ liệu qtrr ---
+# Ví dụ: CFO < 0 and growth(DT) > 30% and BLNG < ind_median(BLNG)
+# Biểu thức được parse bằng ast (chỉ cho phép so sánh, số học, and/or/not và các hàm bên dưới),
+# kết quả parse được cache theo chuỗi biểu thức. Các hàm lag/growth/ngành được tính theo vector
+# trên toàn bộ lịch sử của view (Quý/Năm), sau đó cả biểu thức được đánh giá bằng DataFrame.eval
+# (numexpr nếu có cài) rồi mới lọc theo kỳ được chọn.
+#
+# Tên cột: viết tắt trong ALIASES, tên cột không dấu cách (LNST, Nganh...) hoặc tên đầy đủ
+# trong dấu `...`, vd. `Hệ số lợi nhuận gộp` > 0.2. "30%" được hiểu là 0.3.
+import ast
+import functools
+import re
+
+import numpy as np
+import pandas as pd
+
+import risk_engine
+
+ALIASES = {
+    "CFO": "Lưu chuyển tiền thuần từ HĐKD",
+    "DT": "Doanh thu thuần",
+    "LN": "LNST",
+    "LNCTM": "Cổ đông của công ty mẹ",
+    "BLNG": "Biên lợi nhuận gộp",
+    "BLNR": "Biên lợi nhuận ròng",
+    "VCSH": "Vốn chủ sở hữu",
+    "VCP": "Vốn cổ phần",
+}
+
+FUNCTIONS = {
+    "lag": "giá trị n kỳ trước: lag(x, n=1)",
+    "growth": "tăng trưởng so với n kỳ trước: growth(x, n=1) = (x - lag) / |lag|",
+    "yoy": "tăng trưởng so với cùng kỳ năm trước",
+    "ind_median": "trung vị ngành cùng kỳ",
+    "ind_mean": "trung bình ngành cùng kỳ",
+    "ind_rank": "thứ hạng phần trăm trong ngành cùng kỳ (0-1)",
+    "abs": "giá trị tuyệt đối",
+}
+
+_ALLOWED_NODES = (
+    ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub, ast.UAdd,
+    ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.Compare, ast.Lt, ast.LtE,
+    ast.Gt, ast.GtE, ast.Eq, ast.NotEq, ast.Name, ast.Load, ast.Constant, ast.Call,
+)
+_QUOTED = re.compile(r"`([^`]+)`")
+_PERCENT = re.compile(r"(\d+(?:\.\d+)?)\s*%")
+# Khoá (mã, kỳ) ghép vào một số nguyên để tra giá trị kỳ trước bằng Index.get_indexer
+_PERIOD_BITS = 16
+
+
+class ScreenError(ValueError):
+    pass
+
+
+class _Compiler(ast.NodeTransformer):
+    # Đổi tên cột -> c0, c1...; mỗi lời gọi hàm -> một cột trung gian t0, t1... (tính trước khi eval)
+    def __init__(self, columns):
+        self.columns = columns
+        self.quoted = {}
+        self.names = {}   # tên an toàn -> tên cột
+        self.steps = []   # (tên cột trung gian, hàm, biểu thức đối số, n, nhãn)
+
+    def generic_visit(self, node):
+        if not isinstance(node, _ALLOWED_NODES):
+            raise ScreenError(f"Không hỗ trợ cú pháp: {type(node).__name__}")
+        return super().generic_visit(node)
+
+    def visit_Constant(self, node):
+        if not isinstance(node.value, (int, float, str)) or isinstance(node.value, bool):
+            raise ScreenError(f"Không hỗ trợ giá trị: {node.value!r}")
+        return node
+
+    def visit_Name(self, node):
+        column = self.quoted.get(node.id) or ALIASES.get(node.id.upper()) or node.id
+        if column not in self.columns:
+            raise ScreenError(f"Không có cột: {column}")
+        safe = next((k for k, v in self.names.items() if v == column), f"c{len(self.names)}")
+        self.names[safe] = column
+        return ast.copy_location(ast.Name(id=safe, ctx=ast.Load()), node)
+
+    def visit_Call(self, node):
+        func = node.func.id if isinstance(node.func, ast.Name) else None
+        if func not in FUNCTIONS:
+            raise ScreenError(f"Không có hàm: {ast.unparse(node.func)} (các hàm: {', '.join(FUNCTIONS)})")
+        if node.keywords or not 1 <= len(node.args) <= 2:
+            raise ScreenError(f"{func}() nhận một biểu thức và tuỳ chọn số kỳ n")
+        n = 1
+        if len(node.args) == 2:
+            arg = node.args[1]
+            if not (isinstance(arg, ast.Constant) and isinstance(arg.value, int) and arg.value > 0):
+                raise ScreenError(f"{func}(): số kỳ n phải là số nguyên dương")
+            n = arg.value
+        label = self._label(node)
+        inner = self.visit(node.args[0])
+        target = f"t{len(self.steps)}"
+        self.steps.append((target, func, ast.unparse(inner), n, label))
+        return ast.copy_location(ast.Name(id=target, ctx=ast.Load()), node)
+
+    def _label(self, node):
+        # Tên cột hiển thị cho kết quả của hàm, vd. "growth(DT)", "lag(Doanh thu thuần, 4)"
+        label = ast.unparse(node)
+        for key in sorted(self.quoted, key=len, reverse=True):
+            label = label.replace(key, self.quoted[key])
+        return label
+
+
+@functools.lru_cache(maxsize=256)
+def compile_expression(expression, columns):
+    # Chuỗi biểu thức -> (biểu thức cho DataFrame.eval, {tên an toàn: cột}, các bước tính hàm).
+    # columns: tuple tên cột có trong dữ liệu. Kết quả được cache theo (biểu thức, columns).
+    if not expression.strip():
+        raise ScreenError("Biểu thức trống")
+    compiler = _Compiler(set(columns))
+
+    def quote(match):
+        key = f"__q{len(compiler.quoted)}"
+        compiler.quoted[key] = match.group(1).strip()
+        return key
+
+    source = _PERCENT.sub(r"(\1 / 100)", _QUOTED.sub(quote, expression.strip()))
+    try:
+        tree = ast.parse(source, mode="eval")
+    except SyntaxError as e:
+        raise ScreenError(f"Biểu thức không hợp lệ: {e.msg}") from None
+    tree = compiler.visit(tree)
+    return ast.unparse(tree), tuple(compiler.names.items()), tuple(compiler.steps)
+
+
+def prepare(df_qtrr, view_mode):
+    # Dữ liệu một view, sắp theo (mã, kỳ), mỗi (mã, kỳ) một dòng, kèm khoá tra kỳ trước.
+    # Tính một lần cho mỗi phiên bản dữ liệu + view (UI cache lại), dùng cho mọi biểu thức.
+    df = df_qtrr[risk_engine.view_mask(df_qtrr, view_mode)]
+    df = df.sort_values(["Ticker", "PeriodIdx"], kind="stable")
+    df = df.drop_duplicates(["Ticker", "PeriodIdx"]).reset_index(drop=True)
+    codes = pd.Series(df["Ticker"]).astype("category").cat.codes.to_numpy(np.int64)
+    keys = (codes << _PERIOD_BITS) | df["PeriodIdx"].to_numpy(np.int64)
+    return {
+        "data": df,
+        "keys": keys,
+        "key_index": pd.Index(keys),
+        # Một kỳ của view: quý = 1, năm = 4 (PeriodIdx = năm*4 + quý - 1)
+        "period_step": 4 if view_mode == "Năm" else 1,
+        "year_lag": 1 if view_mode == "Năm" else 4,
+    }
+
+
+def _lag(values, n, ctx):
+    positions = ctx["key_index"].get_indexer(ctx["keys"] - n * ctx["period_step"])
+    lagged = values.to_numpy(np.float64, na_value=np.nan)[positions]
+    return pd.Series(np.where(positions >= 0, lagged, np.nan), index=values.index)
+
+
+def _growth(values, n, ctx):
+    base = _lag(values, n, ctx)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (values - base) / base.abs().replace(0, np.nan)
+
+
+def _industry(how):
+    def apply(values, n, ctx):
+        keys = [ctx["data"]["PeriodIdx"], ctx["data"]["Nganh"]]
+        grouped = values.groupby(keys, observed=True, sort=False)
+        return grouped.rank(pct=True) if how == "rank" else grouped.transform(how)
+    return apply
+
+
+_IMPL = {
+    "lag": _lag,
+    "growth": _growth,
+    "yoy": lambda values, n, ctx: _growth(values, n * ctx["year_lag"], ctx),
+    "ind_median": _industry("median"),
+    "ind_mean": _industry("mean"),
+    "ind_rank": _industry("rank"),
+    "abs": lambda values, n, ctx: values.abs(),
+}
+
+RESULT_COLS = ["Ticker", "Nganh", "YearReport", "KyBaoCao"]
+
+
+def run_screen(ctx, expression, selected_year=None, selected_periods=None):
+    # Các dòng thoả biểu thức trong kỳ được chọn (mặc định: kỳ mới nhất của từng mã)
+    df = ctx["data"]
+    query, names, steps = compile_expression(expression, tuple(df.columns))
+    frame = pd.DataFrame({safe: df[column] for safe, column in names}, index=df.index)
+    try:
+        for target, func, arg, n, _ in steps:
+            values = frame.eval(arg) if arg not in frame.columns else frame[arg]
+            frame[target] = _IMPL[func](pd.Series(values, index=df.index).astype("float64"), n, ctx)
+        mask = frame.eval(query)
+    except Exception as e:
+        raise ScreenError(f"Không tính được biểu thức: {e}") from None
+    if not isinstance(mask, pd.Series) or not pd.api.types.is_bool_dtype(mask):
+        raise ScreenError("Biểu thức phải là một điều kiện (so sánh), vd. CFO < 0")
+
+    if selected_periods:
+        mask &= df["PeriodIdx"].isin(selected_periods)
+    elif selected_year is not None:
+        mask &= df["YearReport"] == selected_year
+    else:
+        mask &= df["PeriodIdx"] == df.groupby("Ticker", observed=True)["PeriodIdx"].transform("max")
+
+    result = df.loc[mask, [c for c in RESULT_COLS if c in df.columns]]
+    shown = [column for _, column in names if column not in RESULT_COLS]
+    result = pd.concat(
+        [result, df.loc[mask, shown], frame.loc[mask, [s[0] for s in steps]].rename(columns={s[0]: s[4] for s in steps})],
+        axis=1,
+    )
+    result = result.loc[:, ~result.columns.duplicated()]
+    return result.reset_index(drop=True).rename(columns={"Ticker": "Mã CP"})
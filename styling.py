@@ -0,0 +1,185 @@
+# --- Định dạng/tô màu bảng cảnh báo (pandas Styler) ---
+# Màu được tính theo cả cột bằng numpy (Styler.apply trên từng cột), không gọi hàm Python
+# cho từng ô. Giao diện chỉ style trang đang hiển thị (xem paginate).
+import math
+
+import numpy as np
+import pandas as pd
+
+import risk_engine
+
+PAGE_SIZES = [50, 100, 200, 500, 1000]
+
+
+def page_count(n_rows, page_size):
+    return max(1, math.ceil(n_rows / page_size))
+
+
+def paginate(df, page_size, page):
+    # Trang thứ page (bắt đầu từ 1) của df
+    page = min(max(page, 1), page_count(len(df), page_size))
+    return df.iloc[(page - 1) * page_size:page * page_size]
+
+
+def _numeric(col):
+    # Giá trị số của cột để so sánh; ô không phải số -> NaN (không tô màu)
+    if pd.api.types.is_numeric_dtype(col):
+        return col.astype("float64")
+    if col.dtype == object:
+        return col.map(lambda v: v if isinstance(v, (int, float)) else np.nan).astype("float64")
+    return pd.Series(np.nan, index=col.index)
+
+
+def negative_css(col):
+    return np.where(_numeric(col) < 0, 'color: red', '')
+
+
+def diff_css(col):
+    values = _numeric(col)
+    return np.select([values > 0, values < 0], ['color: green', 'color: red'], default='')
+
+
+def streak_css(col):
+    # Số kỳ âm liên tiếp hiện tại
+    values = _numeric(col)
+    return np.select([values >= 3, values > 0], ['color: red; font-weight: bold;', 'color: red'], default='')
+
+
+def true_css(col):
+    return np.where(col.isin([True, "True"]), 'background-color: #d4edda; color: #155724', '')
+
+
+def volume_change_css(col):
+    values = _numeric(col)
+    return np.select(
+        [values > 100, values > 50, values > 20, values < 0],
+        [
+            'color: #800080; font-weight: bold;',  # Purple for > 100%
+            'color: #0000FF; font-weight: bold;',  # Dark Green for > 50%
+            'color: #008000;',                     # Lime Green for > 20%
+            'color: #dc3545;',                     # Red for negative
+        ],
+        default='',
+    )
+
+
+def score_css(col):
+    # Điểm rủi ro tổng hợp
+    values = _numeric(col)
+    return np.select(
+        [values >= 6, values >= 3, values > 0],
+        ['background-color: #f8d7da; color: #721c24; font-weight: bold;', 'color: red; font-weight: bold;', 'color: #d39e00'],
+        default='',
+    )
+
+
+def change_css(col):
+    # Cảnh báo mới/tăng mức: đỏ; giảm mức/hết cảnh báo: xanh
+    return np.select(
+        [col.isin(["Mới", "Tăng mức"]), col.isin(["Giảm mức", "Hết cảnh báo"])],
+        ['color: red; font-weight: bold;', 'color: green'],
+        default='',
+    )
+
+
+def trim_number(x):
+    # 1,234.50 -> 1,234.5 ; 12.00 -> 12
+    return "{:,.2f}".format(x).rstrip('0').rstrip('.') if pd.notnull(x) else ""
+
+
+def style_warning_table(df, warning_group, industry_metrics=None):
+    # Styler cho bảng hiển thị của từng nhóm cảnh báo
+    styler = df.style
+
+    if warning_group == "So sánh ngành":
+        # Format specific columns
+        format_dict = {}
+        subset_diff = []
+        for metric in industry_metrics or risk_engine.DEFAULT_INDUSTRY_METRICS:
+            rank_col, diff_col = risk_engine.industry_columns(metric)
+            scale = risk_engine.INDUSTRY_METRICS.get(metric, (metric, 1))[1]
+            format_dict[metric] = "{:.2%}" if scale == 100 else "{:.2f}"
+            format_dict[diff_col] = "{:+.2f} %"
+            format_dict[rank_col] = "{:.0f}"
+            subset_diff.append(diff_col)
+        # Apply format to columns that exist
+        cols_to_format = {k: v for k, v in format_dict.items() if k in df.columns}
+        styler = styler.format(cols_to_format)
+
+        # Highlight diffs
+        subset_diff = [c for c in subset_diff if c in df.columns]
+        if subset_diff:
+            styler = styler.apply(diff_css, subset=subset_diff)
+
+    elif warning_group == "BCTC âm":
+        # Highlight current negative streaks (number of consecutive negative periods)
+        streak_cols = [c for c in df.columns if c.endswith("(kỳ âm liên tiếp)")]
+        if streak_cols:
+            styler = styler.apply(streak_css, subset=streak_cols)
+
+    elif "Lợi nhuận của công ty mẹ" in df.columns:
+        styler = styler.apply(negative_css, subset=["Lưu chuyển tiền thuần từ HĐKD", "Lợi nhuận của công ty mẹ", "LNST"])
+        styler = styler.format(thousands=",", precision=0)
+
+    elif "Khối lượng" in df.columns:
+        # Formatting for Volume tab
+        format_dict_vol = {
+            "Khối lượng": "{:,.0f}",
+            "TB 20 phiên": "{:,.0f}",
+            "% Tăng, giảm so với TB20": "{:.2f}%",
+            "% Tăng, giảm so với TB50": "{:.2f}%",
+            "% Tăng, giảm so với TB100": "{:.2f}%",
+            "% Tăng, giảm so với TB200": "{:.2f}%"
+        }
+        styler = styler.format({k:v for k,v in format_dict_vol.items() if k in df.columns})
+
+        # Highlight breakout
+        if "Đột biến Vol 100" in df.columns:
+            styler = styler.apply(true_css, subset=["Đột biến Vol 100"])
+
+        # Highlight % changes
+        vol_pct_cols = [c for c in df.columns if "% Tăng" in c]
+        if vol_pct_cols:
+            styler = styler.apply(volume_change_css, subset=vol_pct_cols)
+
+    elif warning_group == "Bộ lọc biểu thức":
+        number_cols = [c for c in df.columns if pd.api.types.is_float_dtype(df[c])]
+        styler = styler.format({c: "{:,.2f}" for c in number_cols})
+        if number_cols:
+            styler = styler.apply(negative_css, subset=number_cols)
+
+    elif warning_group == "Thay đổi mới":
+        styler = styler.format({"Mức trước": "{:.0f}"}, na_rep="")
+        styler = styler.apply(change_css, subset=["Thay đổi"])
+
+    elif warning_group == "Ma trận rủi ro":
+        format_dict = {risk_engine.ROOM_COL: trim_number}
+        diff_cols = []
+        for metric in risk_engine.DEFAULT_INDUSTRY_METRICS:
+            rank_col, diff_col = risk_engine.industry_columns(metric)
+            format_dict[rank_col] = "{:.0f}"
+            format_dict[diff_col] = "{:+.2f} %"
+            diff_cols.append(diff_col)
+        styler = styler.format({k: v for k, v in format_dict.items() if k in df.columns}, na_rep="")
+        styler = styler.apply(score_css, subset=[risk_engine.RISK_SCORE_COL])
+        streak_cols = [c for c in risk_engine.RISK_STREAK_METRICS.values() if c in df.columns]
+        for subset, css in [(streak_cols, streak_css), ([c for c in diff_cols if c in df.columns], diff_css),
+                            ([c for c in risk_engine.VOLUME_FLAG_COLS if c in df.columns], true_css)]:
+            if subset:
+                styler = styler.apply(css, subset=subset)
+
+    elif warning_group == "Room margin" and "Room (VCSH)" not in df.columns:
+        # Lưới nhiều mức vốn
+        grid_cols = [c for c in df.columns if c.startswith("Vốn ")]
+        styler = styler.format({c: "{:,.2f}" for c in grid_cols})
+
+    elif "Room (VCSH)" in df.columns:
+        styler = styler.format({
+            "Room (VCSH)": trim_number,
+            "Room (số lượng cp lưu hành)": trim_number,
+            "Max Room Cho Vay": trim_number,
+            "KL Lưu hành": "{:,.0f}",
+            "Giá": "{:,.2f}"
+        })
+
+    return styler
@@ -0,0 +1,53 @@
+# --- Dữ liệu giả lập nhỏ cho test (cùng cột với qtrr_output1.xlsx, xem benchmark.make_qtrr) ---
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import data_cache  # noqa: E402
+
+INDUSTRIES = ["Ngân hàng", "Bất động sản", "Thép"]
+
+
+def make_qtrr(n_tickers=12, years=3, end_year=2025, seed=0):
+    # Mỗi mã: 4 quý + 1 báo cáo năm cho mỗi năm, kỳ mới nhất trước
+    rng = np.random.default_rng(seed)
+    tickers = [f"T{i:02d}" for i in range(n_tickers)]
+    periods = [(y, q) for y in range(end_year, end_year - years, -1) for q in (5, 4, 3, 2, 1)]
+    n = n_tickers * len(periods)
+    year = np.tile([p[0] for p in periods], n_tickers)
+    length = np.tile([p[1] for p in periods], n_tickers)
+    revenue = rng.lognormal(26, 1, n)
+    net_income = revenue * rng.normal(0.05, 0.1, n)
+    gross_margin = rng.normal(0.2, 0.1, n)
+    return pd.DataFrame({
+        "Ticker": np.repeat(tickers, len(periods)),
+        "Nganh": np.repeat([INDUSTRIES[i % len(INDUSTRIES)] for i in range(n_tickers)], len(periods)),
+        "YearReport": year,
+        "LengthReport": length,
+        "LoaiBaoCao": np.where(length == 5, "Năm", "Quý"),
+        "KyBaoCao": [f"{y}_Y" if q == 5 else f"{y}_Q{q}" for y, q in zip(year, length)],
+        "Doanh thu thuần": revenue,
+        # CFO âm khá thường xuyên để có chuỗi âm / tăng trưởng ảo
+        "Lưu chuyển tiền thuần từ HĐKD": revenue * rng.normal(0.0, 0.15, n),
+        "LNST": net_income,
+        "Hệ số lợi nhuận gộp": gross_margin,
+        "Tỷ lệ (%) doanh thu thuần kỳ phân tích so với kỳ gốc (%)": rng.normal(110, 40, n),
+        "Tỷ lệ % LNST kỳ phân tích so với kỳ gốc (%)": rng.normal(110, 150, n),
+        "Biên lợi nhuận gộp": gross_margin,
+        "Biên lợi nhuận ròng": net_income / revenue,
+        "Vốn cổ phần": np.round(revenue * 2, -7),
+    })
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    # data_cache ghi vào thư mục tạm thay vì .cache của repo
+    path = tmp_path / "cache"
+    path.mkdir()
+    monkeypatch.setattr(data_cache, "CACHE_DIR", path)
+    return path
@@ -0,0 +1,99 @@
+# Cache trên đĩa và snapshot không được dùng lại khi version logic/schema đổi
+import json
+
+import pandas as pd
+import pytest
+
+import data_cache
+import fundamentals_store
+import refresher
+import risk_engine
+import risk_warnings
+
+SIGNATURE = (1, 100)
+
+
+class Builder:
+    def __init__(self, value=1):
+        self.calls = 0
+        self.value = value
+
+    def __call__(self):
+        self.calls += 1
+        return pd.DataFrame({"x": [self.value]})
+
+
+def test_load_derived_rebuilds_on_version_or_signature_change(cache_dir):
+    build = Builder()
+    data_cache.load_derived("t", "src.xlsx", build, version=1, signature=SIGNATURE)
+    data_cache.load_derived("t", "src.xlsx", build, version=1, signature=SIGNATURE)
+    assert build.calls == 1
+    data_cache.load_derived("t", "src.xlsx", build, version=2, signature=SIGNATURE)
+    assert build.calls == 2
+    data_cache.load_derived("t", "src.xlsx", build, version=2, signature=(2, 100))
+    assert build.calls == 3
+
+
+@pytest.mark.parametrize("loader", [risk_warnings.load_industry_table, risk_warnings.load_warning_flags])
+def test_qtrr_derived_caches_follow_the_qtrr_schema(cache_dir, monkeypatch, loader):
+    # Cache build bằng schema cũ, đọc bằng code mới (schema qtrr tăng) -> phải build lại
+    build = Builder()
+    monkeypatch.setattr(fundamentals_store, "load", lambda name, path: build())
+    loader(signature=SIGNATURE)
+    loader(signature=SIGNATURE)
+    assert build.calls == 1
+    monkeypatch.setattr(risk_engine, "QTRR_SCHEMA_VERSION", risk_engine.QTRR_SCHEMA_VERSION + 1)
+    loader(signature=SIGNATURE)
+    assert build.calls == 2
+
+
+def _write_snapshot(snapshot_dir, versions):
+    run_id = "20250101-000000-000000"
+    run_dir = snapshot_dir / run_id
+    run_dir.mkdir(parents=True)
+    path = data_cache.write_frame(pd.DataFrame({"Mã CP": ["AAA"]}), run_dir / "gdkq_hose.parquet", run_dir / "gdkq_hose.pkl")
+    manifest = {
+        "run_id": run_id,
+        "sources": {p: None for p in risk_warnings.SOURCE_PATHS},
+        "groups": {"gdkq_hose": {"file": path.name, "rows": 1, "sources": [None]}},
+        "errors": {},
+    }
+    if versions is not None:
+        manifest["versions"] = versions
+    (run_dir / risk_warnings.SNAPSHOT_MANIFEST).write_text(json.dumps(manifest), encoding="utf-8")
+    (snapshot_dir / risk_warnings.LATEST_NAME).write_text(run_id, encoding="utf-8")
+
+
+@pytest.mark.parametrize("versions, current", [
+    (risk_warnings.SNAPSHOT_VERSIONS, True),
+    (None, False),  # snapshot build trước khi manifest có version
+    ({**risk_warnings.SNAPSHOT_VERSIONS, "qtrr": risk_engine.QTRR_SCHEMA_VERSION - 1}, False),
+    ({**risk_warnings.SNAPSHOT_VERSIONS, "groups": risk_warnings.SNAPSHOT_VERSIONS["groups"] - 1}, False),
+])
+def test_snapshot_requires_current_versions(tmp_path, monkeypatch, versions, current):
+    # Thư mục làm việc trống: mọi file nguồn "không có" -> khớp chữ ký None trong manifest
+    monkeypatch.chdir(tmp_path)
+    snapshot_dir = tmp_path / "snapshots"
+    _write_snapshot(snapshot_dir, versions)
+
+    table = risk_warnings.read_snapshot("gdkq_hose", snapshot_dir, version=[None])
+    assert (table is not None) == current
+    assert refresher.Refresher(watch_dirs=[], snapshot_dir=snapshot_dir).is_published() == current
+
+
+def test_old_signature_caches_survive_until_pruned(cache_dir):
+    # Build cache của chữ ký mới (vd. warm-up của batch) không xoá cache của chữ ký đang publish
+    published, new = (1, 100), (2, 100)
+    for signature in (published, new):
+        data_cache.load_columnar("src.xlsx", reader=lambda _p: pd.DataFrame({"x": [1]}), signature=signature, version=3)
+        data_cache.load_derived("t", "src.xlsx", Builder(), version="1.q3", signature=signature)
+    data_cache.load_columnar("other.csv", reader=lambda _p: pd.DataFrame({"x": [1]}), signature=published)
+    (cache_dir / "notes.txt").write_text("x")
+    files = {f.name for f in cache_dir.iterdir()}
+    assert len(files) == 6
+
+    # Sau khi publish bản mới: chỉ xoá cache của src.xlsx ở chữ ký cũ
+    assert data_cache.prune_stale({"src.xlsx": new}) == 2
+    remaining = {f.name for f in cache_dir.iterdir()}
+    assert all(f"-{published[0]}-" not in name or name.startswith("other.csv") for name in remaining)
+    assert len(remaining) == 4
@@ -0,0 +1,69 @@
+# Thay đổi cảnh báo giữa hai phiên bản: phân loại Mới / Tăng / Giảm / Đổi nội dung / Hết cảnh báo
+import pandas as pd
+
+import change_feed
+
+
+def _signals(rows):
+    return change_feed._signals(*zip(*rows)) if rows else pd.DataFrame(columns=change_feed.SIGNAL_COLS)
+
+
+def _kinds(changes):
+    return dict(zip(changes["Mã CP"], changes["Thay đổi"]))
+
+
+def test_diff_signals_classification():
+    old = _signals([
+        ("Quý", "AAA", "2025_Q1", 2, "x"),
+        ("Quý", "BBB", "2025_Q1", 3, "x"),
+        ("Quý", "CCC", "2025_Q1", 2, "x"),
+        ("Quý", "DDD", "2025_Q1", 2, "x"),
+        ("Quý", "EEE", "2025_Q1", 2, "x"),
+    ])
+    new = _signals([
+        ("Quý", "AAA", "2025_Q2", 3, "x"),   # tăng mức
+        ("Quý", "BBB", "2025_Q2", 2, "x"),   # giảm mức
+        ("Quý", "CCC", "2025_Q1", 2, "y"),   # cùng mức, đổi nội dung
+        ("Quý", "DDD", "2025_Q1", 2, "x"),   # không đổi
+        ("Quý", "FFF", "2025_Q1", 1, "x"),   # mới
+    ])
+    changes = change_feed.diff_signals(old, new)
+    assert _kinds(changes) == {
+        "AAA": change_feed.ESCALATED,
+        "BBB": change_feed.EASED,
+        "CCC": change_feed.CHANGED,
+        "FFF": change_feed.ADDED,
+        "EEE": change_feed.REMOVED,
+    }
+    levels = changes.set_index("Mã CP")
+    assert levels.loc["AAA", "Mức trước"] == 2 and levels.loc["AAA", "Mức"] == 3
+    assert pd.isna(levels.loc["FFF", "Mức trước"])
+    assert levels.loc["EEE", "Mức trước"] == 2 and levels.loc["EEE", "Mức"] == 0
+
+
+def test_same_ticker_in_other_view_is_a_separate_key():
+    old = _signals([("Quý", "AAA", "2025_Q1", 2, "x")])
+    new = _signals([("Quý", "AAA", "2025_Q1", 2, "x"), ("Năm", "AAA", "2024_Y", 2, "x")])
+    changes = change_feed.diff_signals(old, new)
+    assert changes[["Xem", "Mã CP", "Thay đổi"]].values.tolist() == [["Năm", "AAA", change_feed.ADDED]]
+
+
+def test_empty_versions():
+    new = _signals([("", "AAA", "", 1, "x")])
+    assert _kinds(change_feed.diff_signals(_signals([]), new)) == {"AAA": change_feed.ADDED}
+    assert _kinds(change_feed.diff_signals(new, _signals([]))) == {"AAA": change_feed.REMOVED}
+
+
+def test_margin_list_keeps_every_reason():
+    # Một mã có nhiều dòng (nhiều lý do) trong danh sách GDKQ -> một cảnh báo với mọi lý do
+    table = pd.DataFrame({"Mã CP": ["AAA", "aaa ", "BBB"], "Lý do": ["Kiểm soát", "Cảnh báo", "Cảnh báo"]})
+    signals = change_feed.signals("gdkq_hnx_tinh_trang", table)
+    assert dict(zip(signals["Mã CP"], signals["Chi tiết"])) == {"AAA": "Cảnh báo; Kiểm soát", "BBB": "Cảnh báo"}
+
+    # Đổi một lý do phụ (hoặc thứ tự dòng) được nhận ra / bỏ qua đúng
+    changed = pd.DataFrame({"Mã CP": ["AAA", "AAA", "BBB"], "Lý do": ["Kiểm soát", "Hạn chế", "Cảnh báo"]})
+    assert _kinds(change_feed.diff_signals(signals, change_feed.signals("gdkq_hnx_tinh_trang", changed))) == {
+        "AAA": change_feed.CHANGED,
+    }
+    reordered = table.iloc[::-1]
+    assert change_feed.diff_signals(signals, change_feed.signals("gdkq_hnx_tinh_trang", reordered)).empty
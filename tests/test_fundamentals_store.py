@@ -0,0 +1,68 @@
+# Kho qtrr: cờ và bảng ngành cập nhật tăng dần phải giống hệt tính lại toàn bộ
+import pandas as pd
+import pytest
+
+import fundamentals_store
+import risk_engine
+from conftest import make_qtrr
+
+
+def _ingest(df, store_dir, signature):
+    q = risk_engine.compact_qtrr(df.copy())
+    stats = fundamentals_store.ingest(q, signature, store_dir)
+    manifest = fundamentals_store.read_manifest(store_dir)
+    artifacts = {name: fundamentals_store._read_artifact(store_dir, manifest, name) for name in ("flags", "industry")}
+    return q, stats, artifacts
+
+
+def _assert_full_recompute(q, artifacts):
+    pd.testing.assert_frame_equal(artifacts["flags"], risk_engine.build_warning_flags(q))
+    pd.testing.assert_frame_equal(artifacts["industry"], risk_engine.build_industry_table(q))
+
+
+def _new_quarter(df, tickers):
+    # Quý 2026_Q1 cho một số mã (copy quý mới nhất, đổi số liệu)
+    new = df[(df["KyBaoCao"] == "2025_Q4") & df["Ticker"].isin(tickers)]
+    new = new.assign(YearReport=2026, LengthReport=1, KyBaoCao="2026_Q1")
+    return new.assign(**{"Doanh thu thuần": new["Doanh thu thuần"] * 1.1, "Lưu chuyển tiền thuần từ HĐKD": -5.0})
+
+
+def test_unchanged_file_is_incremental_noop(tmp_path):
+    df = make_qtrr()
+    _ingest(df, tmp_path, (1, 1))
+    q, stats, artifacts = _ingest(df, tmp_path, (2, 1))
+    assert stats["full"] is False and stats["upserts"] == 0 and stats["deletes"] == 0
+    _assert_full_recompute(q, artifacts)
+
+
+@pytest.mark.parametrize("change", ["new_quarter", "restatement", "delete", "industry", "new_ticker"])
+def test_incremental_equals_full_recompute(tmp_path, change):
+    df = make_qtrr()
+    _ingest(df, tmp_path, (1, 1))
+
+    new = df.copy()
+    if change == "new_quarter":
+        new = pd.concat([new, _new_quarter(df, ["T00", "T01", "T04"])], ignore_index=True)
+    elif change == "restatement":
+        new.loc[(new["Ticker"] == "T02") & (new["KyBaoCao"] == "2024_Q3"), "Biên lợi nhuận gộp"] += 0.05
+        new.loc[new["Ticker"] == "T03", "Lưu chuyển tiền thuần từ HĐKD"] *= -1
+    elif change == "delete":
+        new = new[~((new["Ticker"] == "T05") & (new["KyBaoCao"] == "2025_Q4"))]
+    elif change == "industry":
+        new.loc[new["Ticker"] == "T06", "Nganh"] = "Ngân hàng"
+    elif change == "new_ticker":
+        new = pd.concat([new, df[df["Ticker"] == "T07"].assign(Ticker="ZZZ")], ignore_index=True)
+    # Thứ tự dòng trong file không ảnh hưởng kết quả
+    new = new.sample(frac=1, random_state=1).reset_index(drop=True)
+
+    q, stats, artifacts = _ingest(new, tmp_path, (2, 1))
+    assert stats["full"] is False
+    _assert_full_recompute(q, artifacts)
+
+
+def test_schema_version_change_discards_previous_artifacts(tmp_path, monkeypatch):
+    df = make_qtrr()
+    _ingest(df, tmp_path, (1, 1))
+    monkeypatch.setitem(fundamentals_store.ARTIFACTS, "qtrr", risk_engine.QTRR_SCHEMA_VERSION + 1)
+    _, stats, _ = _ingest(df, tmp_path, (1, 1))
+    assert stats["full"] is True
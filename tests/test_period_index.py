@@ -0,0 +1,28 @@
+# Khoá kỳ số nguyên PeriodIdx = năm*4 + (quý-1), báo cáo năm xếp vào cuối năm
+import numpy as np
+import pandas as pd
+
+import risk_engine
+
+
+def test_period_index_orders_quarters_and_years():
+    idx = risk_engine.period_index([2024, 2024, 2024, 2024, 2025, 2025], [1, 2, 3, 4, 1, 0])
+    assert idx.tolist() == [2024 * 4, 2024 * 4 + 1, 2024 * 4 + 2, 2024 * 4 + 3, 2025 * 4, 2025 * 4 + 3]
+    assert (np.diff(idx[:5]) == 1).all()
+
+
+def test_annual_report_shares_the_q4_slot():
+    assert risk_engine.period_index([2024], [0])[0] == risk_engine.period_index([2024], [4])[0]
+
+
+def test_add_period_columns_from_report_codes():
+    df = pd.DataFrame({
+        "KyBaoCao": ["2025_Q2", "2024_Q4", "2024_Y", "2023_Q1"],
+        "YearReport": [2025, 2024, 2024, 2023],
+        "LengthReport": [2, 4, 5, 1],
+    })
+    out = risk_engine.add_period_columns(df)
+    assert out["Quarter"].tolist() == [2, 4, 0, 1]
+    assert out["PeriodIdx"].tolist() == [2025 * 4 + 1, 2024 * 4 + 3, 2024 * 4 + 3, 2023 * 4]
+    # Sort theo PeriodIdx = sort theo thời gian (chuỗi KyBaoCao không sort đúng được với báo cáo năm)
+    assert out.sort_values("PeriodIdx", kind="stable")["KyBaoCao"].tolist() == ["2023_Q1", "2024_Q4", "2024_Y", "2025_Q2"]
@@ -0,0 +1,62 @@
+# Bộ lọc biểu thức: chỉ chấp nhận cú pháp trong danh sách cho phép, còn lại báo ScreenError
+import pytest
+
+import risk_engine
+import screener
+from conftest import make_qtrr
+
+
+@pytest.fixture(scope="module")
+def ctx():
+    return screener.prepare(risk_engine.compact_qtrr(make_qtrr()), "Quý")
+
+
+@pytest.mark.parametrize("expression", [
+    "",
+    "   ",
+    "CFO <",                               # lỗi cú pháp
+    "__import__('os').system('echo x')",    # hàm ngoài danh sách
+    "os.system('echo x')",                  # gọi qua thuộc tính
+    "DT.__class__",                         # truy cập thuộc tính
+    "DT[0] > 0",                            # subscript
+    "(lambda: 1)() > 0",
+    "[x for x in DT] == 1",
+    "DT if CFO else LN",
+    "DT > 0 and True",                      # hằng bool
+    "DT > None",
+    "KhongCoCot > 0",                       # cột không có
+    "growth(DT, n=2) > 0",                  # keyword
+    "growth(DT, 0) > 0",                    # n phải nguyên dương
+    "growth(DT, 1.5) > 0",
+    "growth(DT, 1, 2) > 0",
+    "DT // 2 > 0",                          # toán tử không cho phép
+])
+def test_rejected_expressions(ctx, expression):
+    with pytest.raises(screener.ScreenError):
+        screener.run_screen(ctx, expression)
+
+
+def test_non_condition_is_rejected(ctx):
+    with pytest.raises(screener.ScreenError):
+        screener.run_screen(ctx, "DT + 1")
+
+
+@pytest.mark.parametrize("expression", [
+    "CFO < 0",
+    "CFO < 0 and growth(DT) > 30%",
+    "BLNG < ind_median(BLNG) or not (LN > 0)",
+    "`Hệ số lợi nhuận gộp` > 0.2",
+    "yoy(DT) > 0 and abs(lag(LN, 2)) > 0",
+    "Nganh == 'Ngân hàng'",
+])
+def test_accepted_expressions(ctx, expression):
+    result = screener.run_screen(ctx, expression)
+    assert {"Mã CP", "Nganh", "YearReport", "KyBaoCao"} <= set(result.columns)
+
+
+def test_percent_literal_and_latest_period(ctx):
+    data = ctx["data"]
+    result = screener.run_screen(ctx, "BLNG > 20%")
+    latest = data[data["PeriodIdx"] == data.groupby("Ticker", observed=True)["PeriodIdx"].transform("max")]
+    expected = latest.loc[latest["Biên lợi nhuận gộp"] > 0.2, "Ticker"].astype(str)
+    assert sorted(result["Mã CP"].astype(str)) == sorted(expected)
@@ -2,33 +2,102 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import os
+import logging
 from pathlib import Path
-from datetime import datetime
-from io import BytesIO
+from datetime import date, datetime, timedelta
 import random
 
+import change_feed
+import data_cache
+import exporting
+import filter_memo
+import profiling
+import refresher
+import risk_engine
+import risk_warnings
+import screener
+import styling
+import volume_engine
+
 st.set_page_config(
     page_title="Danh mục xếp hạng",
     page_icon="Mega.jpg",  
     layout="wide"
 )
+# --- Debug: đo thời gian lần chạy lại này (QTRR_PROFILE=1 hoặc thêm ?debug=1 vào URL) ---
+profiling.start_run("ui_new", enabled=profiling.ENABLED or st.query_params.get("debug") == "1")
+
+# --- Khởi động server: parse song song mọi nguồn, rồi chạy refresher nền ---
+# (một lần cho cả server; tắt refresher bằng QTRR_REFRESHER=0)
+@st.cache_resource
+def _start_background():
+    # Thời gian warm-up từng nguồn được ghi log (logger risk_warnings / refresher)
+    logging.basicConfig(format="%(asctime)s %(name)s %(message)s")
+    for name in ("risk_warnings", "refresher"):
+        logging.getLogger(name).setLevel(logging.INFO)
+    risk_warnings.warm_sources()
+    if os.environ.get("QTRR_REFRESHER", "1") == "0":
+        return None
+    return refresher.start(refresh_now=True)
+
+data_refresher = _start_background()
+
+def source_signature(path):
+    # Có refresher: dùng chữ ký của bản đã được build sẵn (snapshot đã publish),
+    # file mới chỉ được dùng sau khi refresher build xong -> request không phải parse workbook
+    if data_refresher is not None:
+        return risk_warnings.published_signature(path)
+    return data_cache.source_signature(path)
+
 # --- Load dữ liệu ---
-file_path = os.path.join("result", "summary.xlsx")
+file_path = risk_warnings.SUMMARY_PATH
+
+@profiling.track_cache("summary", st.cache_resource(max_entries=2))
+def _load_data_cached(signature):
+    return data_cache.load_columnar(file_path, signature=signature)
 
-@st.cache_data
 def load_data():
-    return pd.read_excel(file_path)
+    # Cache theo (mtime, size) của summary.xlsx -> file đổi thì tự load lại
+    return _load_data_cached(source_signature(file_path))
+
+@profiling.track_cache("ticker_index", st.cache_resource(max_entries=2))
+def _load_ticker_index_cached(version):
+    return risk_warnings.load_ticker_index(source_signature)
+
+def load_ticker_index():
+    # Chỉ mục mã của tab cảnh báo, build một lần cho mỗi phiên bản dữ liệu (chỉ khi có tìm kiếm)
+    return _load_ticker_index_cached(risk_warnings.data_version(source_signature))
+
+@profiling.track_cache("summary_index", st.cache_resource(max_entries=2))
+def _load_summary_index_cached(version):
+    return risk_warnings.load_summary_index(source_signature)
 
-df = load_data()
+def load_summary_index():
+    # Chỉ mục mã -> dòng của summary cho tab xếp hạng (không load dữ liệu của tab cảnh báo)
+    return _load_summary_index_cached(risk_warnings.data_version(source_signature))
+
+def search_tickers(query, load_index):
+    # Ô tìm kiếm -> (mã số nguyên, danh sách mã) theo tiền tố/mẫu (VN*, HD) hoặc tên công ty; None nếu ô trống.
+    # load_index: chỉ mục của trang đang xem (load_summary_index / load_ticker_index)
+    if not query.strip():
+        return None, None
+    ticker_index = load_index()
+    codes = risk_engine.match_tickers(ticker_index, query)
+    return codes, list(risk_engine.index_tickers(ticker_index, codes))
 
 
 # --- Cấu hình trang ---
 # st.set_page_config đã được gọi ở trên (nếu chưa thì gọi ở đây, nhưng code cũ đã có)
 
-# --- Tạo Tabs chính ---
-tab1, tab2 = st.tabs(["🔍 Danh mục xếp hạng", "⚠️ Cảnh báo rủi ro"])
+# --- Điều hướng trang ---
+# Không dùng st.tabs (chạy cả hai trang mỗi lần rerun): chỉ trang đang chọn được chạy và load dữ liệu
+PAGES = ["🔍 Danh mục xếp hạng", "⚠️ Cảnh báo rủi ro"]
+page = st.radio("Trang:", PAGES, horizontal=True, key="nav_page", label_visibility="collapsed")
+profiling.annotate(page=page)
+
+if page == PAGES[0]:
+    df = load_data()
 
-with tab1:
     # --- Logo + tiêu đề căn giữa ---
     logo_path = Path("Mega2.png") 
     if logo_path.exists():
@@ -42,8 +111,8 @@ with tab1:
     )
 
     # --- Thanh tìm kiếm nhiều mã ---
-    search_input = st.text_input("Nhập mã cổ phiếu (ví dụ: ACB, HDB, CTG...):")
-    tickers = [x.strip().upper() for x in search_input.replace(" ", ",").split(",") if x.strip()]
+    search_input = st.text_input("Nhập mã cổ phiếu hoặc tên công ty (ví dụ: ACB, HDB, VN*, Tiên Sơn...):")
+    ticker_codes, tickers = search_tickers(search_input, load_summary_index)
 
     # --- Bộ lọc theo Model ---
     model_filter = st.selectbox("Chọn mô hình:", ["Tất cả", "Ngân hàng", "Phi tài chính", "Chứng khoán", "Bảo hiểm"])
@@ -60,20 +129,32 @@ with tab1:
     # --- Slider chọn số lượng hiển thị ---
     top_n = st.slider("Số lượng tối đa muốn hiển thị:", 30, 300, 50)
 
-    # Áp dụng filter
-    filtered = df.copy()
-    if tickers:
-        filtered = filtered[filtered["Mã"].isin(tickers)]
-        
-    if model_filter != "Tất cả":
-        filtered = filtered[filtered["Mô hình"] == model_filter]
-
-    if grade_filter:
-        filtered = filtered[filtered["Điểm"].isin(grade_filter)]
+    # Áp dụng filter (các phép lọc tạo DataFrame mới, không cần copy df đã cache)
+    def filter_ranking():
+        with profiling.span("tab1:filter", rows_in=len(df)) as sp:
+            filtered = df
+            if ticker_codes is not None:
+                # Vị trí dòng của các mã khớp lấy thẳng từ chỉ mục, không quét cả bảng
+                filtered = filtered.iloc[risk_engine.ticker_rows(load_summary_index(), "summary", ticker_codes)]
+
+            if model_filter != "Tất cả":
+                filtered = filtered[filtered["Mô hình"] == model_filter]
+
+            if grade_filter:
+                filtered = filtered[filtered["Điểm"].isin(grade_filter)]
+            sp["rows_out"] = len(filtered)
+        return filtered
+
+    # Kết quả lọc dùng chung giữa các session theo (phiên bản file, bộ lọc); top_n chỉ cắt khi hiển thị
+    filtered = filter_memo.cached(
+        ("rank", source_signature(file_path), None if tickers is None else frozenset(tickers), model_filter, frozenset(grade_filter)),
+        filter_ranking,
+    )
 
     # --- Hiển thị kết quả ---
     st.write(f"Có {len(filtered)} kết quả sau khi lọc")
-    st.dataframe(filtered.head(top_n), use_container_width=True)
+    with profiling.span("tab1:render", rows_in=min(len(filtered), top_n)):
+        st.dataframe(filtered.head(top_n), use_container_width=True)
 
     update_time = None
     if "Thời gian cập nhật" in df.columns:
@@ -85,36 +166,46 @@ with tab1:
 
     st.markdown(f"**Cập nhật lần cuối:** {update_time}")
 
-    from io import BytesIO
-
-    # --- Xuất Excel ---
+    # --- Xuất Excel (file chỉ được tạo khi người dùng bấm tải) ---
     if not filtered.empty:
-        buffer = BytesIO()
-        with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
-            filtered.to_excel(writer, index=False, sheet_name="KQ")
+        export_fmt = st.radio("Định dạng tải về:", exporting.FORMATS, horizontal=True, key="rank_export_fmt")
+        export_key = exporting.state_key("rank", source_signature(file_path), tickers, model_filter, grade_filter)
+        export_name, export_mime = exporting.file_info(export_fmt, "ket_qua_loc")
 
         st.download_button(
-            label="Tải kết quả lọc về Excel",
-            data=buffer.getvalue(),
-            file_name="ket_qua_loc.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            label=f"Tải kết quả lọc về {export_fmt}",
+            data=profiling.timed("export:rank", exporting.deferred(export_key, filtered, export_fmt, sheet_name="KQ")),
+            file_name=export_name,
+            mime=export_mime
         )
 
-with tab2:
+else:
     st.markdown("<h2 style='text-align: center; color: #d9534f;'>⚠️ CẢNH BÁO RỦI RO & NHẬN DIỆN SỚM</h2>", unsafe_allow_html=True)
     
     # --- Selector Nhóm Cảnh Báo ---
     warning_group = st.selectbox(
         "Chọn nhóm cảnh báo:",
-        ["Tăng trưởng ảo", "BCTC âm", "Danh sách chứng khoán không được phép GDKQ", "So sánh ngành", "Khối lượng giao dịch", "Room margin"]
+        ["Tăng trưởng ảo", "BCTC âm", "Danh sách chứng khoán không được phép GDKQ", "So sánh ngành", "Khối lượng giao dịch", "Room margin", "Bộ lọc biểu thức", "Thay đổi mới", "Ma trận rủi ro"]
     )
 #   "Nội bộ doanh nghiệp", "Thanh khoản cổ phiếu"
     # --- Data Generators ---
-    @st.cache_data
-    def load_qtrr_data():
+    # Logic tính toán nằm trong risk_warnings.py (dùng chung với batch CLI);
+    # ở đây chỉ cache kết quả cho các session và hiển thị lỗi.
+    DEFAULT_CAPITAL_BILLION = 1.0
+    QTRR_PERIOD_COLS = risk_warnings.QTRR_PERIOD_COLS
+
+    def data_version():
+        return risk_warnings.data_version(source_signature)
+
+    # cache_resource: mọi session dùng chung một DataFrame (chỉ đọc), không copy mỗi lần truy cập
+    @profiling.track_cache("qtrr", st.cache_resource(max_entries=16))
+    def _load_qtrr_cached(signature, columns):
+        return risk_warnings.load_qtrr(columns, signature=signature)
+
+    def load_qtrr_data(columns=None):
         try:
-            path = os.path.join("result", "qtrr_output1.xlsx")
-            return pd.read_excel(path)
+            signature = source_signature(risk_warnings.QTRR_PATH)
+            return _load_qtrr_cached(signature, tuple(columns) if columns else None)
         except Exception as e:
             # # Fallback to original file if output1 not found
             # try:
@@ -123,146 +214,72 @@ with tab2:
             # except Exception as e:
             #     st.error(f"Không tìm thấy file dữ liệu: {e}")
             return pd.DataFrame()
-    @st.cache_data
-    def load_cp_data():
-        try:
-            path = os.path.join("data", "cp.csv")
-            df = pd.read_csv(path)
-            if "Ticker" in df.columns:
-                df["Ticker"] = df["Ticker"].astype(str).str.strip().str.upper()
-            return df
-        except Exception as e:
-            return pd.DataFrame()
-
-
-    def get_financial_warnings(view_mode, selected_year=None, selected_quarters=None):
-        df_qtrr = load_qtrr_data()
-        if df_qtrr.empty:
-            return pd.DataFrame()
 
-        # 1. Filter by Period Type
-
-        if view_mode == "Năm":
-            df_filtered = df_qtrr[df_qtrr["LengthReport"] == 5].copy()
-        else:
-            df_filtered = df_qtrr[df_qtrr["LengthReport"] != 5].copy()
-
-        if not df_filtered.empty:
-            # Sort by Ticker and Time Descending to Ensure Correct Lag Calculation
-            df_filtered = df_filtered.sort_values(by=["Ticker", "KyBaoCao"], ascending=[True, False])
-            
-            # Logic: "Tăng trưởng ảo"
-            # Condition: CFO < 0 AND Revenue > 0 for 2 consecutive periods (Quarter OR Year)
-            df_filtered["Tăng trưởng ảo"] = "" # Default empty
-            
-            # Ensure needed columns exist
-            cfo_col = "Lưu chuyển tiền thuần từ HĐKD"
-            rev_col = "Doanh thu thuần"
-            
-            if cfo_col in df_filtered.columns and rev_col in df_filtered.columns:
-                # Create boolean masks
-                # Note: We need to handle potential non-numeric data if any, but assuming numeric from Excel
-                condition_mask = (df_filtered[cfo_col] < 0) & (df_filtered[rev_col] > 0)
-                
-                # Group by Ticker and shift to get previous period's condition
-                # Shift(-1) because we sorted Descending (Latest is index i, Previous is index i+1)
-                condition_prev = df_filtered.groupby("Ticker")[cfo_col].shift(-1) < 0
-                condition_prev_rev = df_filtered.groupby("Ticker")[rev_col].shift(-1) > 0
-                
-            # Combined Check: Current Met AND Previous Met
-                final_mask = condition_mask & condition_prev & condition_prev_rev
-                
-                df_filtered.loc[final_mask, "Tăng trưởng ảo"] = "🚩"
-
-            # 2. Filter by User Selection (After calculating indicators)
-            if selected_year:
-                df_filtered = df_filtered[df_filtered["YearReport"] == selected_year]
-            
-            if view_mode == "Quý" and selected_quarters:
-                df_filtered = df_filtered[df_filtered["KyBaoCao"].isin(selected_quarters)]
-
-            # If no specific filter for period, we assume user wants to see *something*. 
-            # Original behavior was "Latest". If we add filters, we show matched.
-            # If default (no year/quarter passed), maybe default to latest? 
-            # But the UI will provide defaults.
-
-
-        # 3. Select and Rename Columns
-        cols_to_show = ["Ticker", "KyBaoCao", "Tăng trưởng ảo", 'Lưu chuyển tiền thuần từ HĐKD', "Doanh thu thuần", "Cổ đông của công ty mẹ", "LNST"]
-        # Ensure columns exist
-        cols_existing = [c for c in cols_to_show if c in df_filtered.columns]
-
-        df_final = df_filtered[cols_existing].rename(columns={
-            "Cổ đông của công ty mẹ": "Lợi nhuận của công ty mẹ",
-            "Ticker": "Mã CP"
-        })
+    @profiling.track_cache("period_options", st.cache_resource(max_entries=2))
+    def _load_period_options_cached(signature):
+        return risk_engine.period_options(load_qtrr_data(QTRR_PERIOD_COLS))
 
+    def load_period_options():
+        # {view: {năm: [quý]}} cho các ô chọn Năm/Quý, tính một lần cho mỗi phiên bản dữ liệu
+        try:
+            return _load_period_options_cached(source_signature(risk_warnings.QTRR_PATH))
+        except Exception as e:
+            return {}
 
-        return df_final
+    @profiling.track_cache("ticker_dim", st.cache_resource(max_entries=2))
+    def _load_ticker_dim_cached(cp_signature, summary_signature, qtrr_signature):
+        return risk_warnings.load_ticker_dim()
 
-    def get_cash_flow_warnings(view_mode, metrics=None):
-        if metrics is None:
-            metrics = ["Lưu chuyển tiền thuần từ HĐKD"]
+    def load_ticker_dim():
+        # Bảng Sàn/Ngành/Mô hình theo mã (cp.csv + summary.xlsx + qtrr), build một lần cho mỗi phiên bản dữ liệu
+        try:
+            return _load_ticker_dim_cached(
+                source_signature(risk_warnings.CP_PATH),
+                source_signature(risk_warnings.SUMMARY_PATH),
+                source_signature(risk_warnings.QTRR_PATH),
+            )
+        except Exception as e:
+            return pd.DataFrame(columns=risk_engine.TICKER_DIM_COLUMNS)
+
+    @profiling.track_cache("group_table", st.cache_resource(max_entries=16))
+    def _load_group_table_cached(name, version):
+        return risk_warnings.load_group_table(name, version=version)
+
+    def load_group_table(name):
+        # Bảng gốc của nhóm: snapshot của batch nếu còn khớp file nguồn, nếu không thì tính trực tiếp
+        version = risk_warnings.group_version(name, source_signature)
+        return _load_group_table_cached(name, tuple(tuple(v) if v else None for v in version))
+
+    def memo_filter(name, key, fn, *args):
+        # fn(bảng gốc của nhóm, *args) qua filter_memo (dùng chung giữa các session),
+        # key = (nhóm, phiên bản dữ liệu của nhóm, lựa chọn trên widget)
+        version = risk_warnings.group_version(name, source_signature)
+        return filter_memo.cached(
+            (name, version, key),
+            lambda: profiling.measure_rows(f"filter:{name}", fn, load_group_table(name), *args),
+        )
 
-        df_qtrr = load_qtrr_data()
-        if df_qtrr.empty:
+    def get_financial_warnings(view_mode, selected_year=None, selected_periods=None):
+        try:
+            return memo_filter("tang_truong_ao", (view_mode, selected_year, frozenset(selected_periods or ())),
+                               risk_warnings.financial_warnings, view_mode, selected_year, selected_periods)
+        except Exception as e:
             return pd.DataFrame()
 
-        # 1. Filter by Period Type
-        if view_mode == "Năm":
-            df_filtered = df_qtrr[df_qtrr["LengthReport"] == 5].copy()
-        else:
-            df_filtered = df_qtrr[df_qtrr["LengthReport"] != 5].copy()
+    def get_streak_metrics():
+        # Các chỉ số có sẵn chuỗi âm trong bảng cờ
+        try:
+            return risk_warnings.streak_metric_names(load_group_table("bctc_am"))
+        except Exception as e:
+            return []
 
-        if df_filtered.empty:
+    def get_cash_flow_warnings(view_mode, metrics=None, min_streak=0):
+        try:
+            return memo_filter("bctc_am", (view_mode, metrics, min_streak),
+                               risk_warnings.cash_flow_warnings, view_mode, metrics, min_streak)
+        except Exception as e:
             return pd.DataFrame()
 
-        # 2. Logic: Warning Flags for each metric
-        # Sort by Ticker and Time Descending for correct shift
-        df_filtered = df_filtered.sort_values(by=["Ticker", "KyBaoCao"], ascending=[True, False])
-        
-        # We will collect result columns here
-        cols_to_show = ["Ticker", "KyBaoCao"]
-        
-        for metric in metrics:
-            if metric not in df_filtered.columns:
-                continue
-                
-            # Create Flags for this metric
-            g = df_filtered.groupby("Ticker")[metric]
-            
-            # Conditions (Negative value)
-            # Handle potential non-numeric gracefully? Assuming numeric from Excel.
-            s0 = df_filtered[metric] < 0                  # Current Period < 0
-            s1 = g.shift(-1) < 0                           # Previous Period < 0
-            s2 = g.shift(-2) < 0                           # 2 Periods ago < 0
-            
-            # FillNa
-            s1 = s1.fillna(False)
-            s2 = s2.fillna(False)
-            
-            flag_col_name = f"{metric}" # Column header will be the metric name, content is flags
-            
-            df_filtered[flag_col_name] = "" # Default empty
-            
-            # Assign flags
-            df_filtered.loc[s0, flag_col_name] = "🚩"
-            df_filtered.loc[s0 & s1, flag_col_name] = "🚩🚩"
-            df_filtered.loc[s0 & s1 & s2, flag_col_name] = "🚩🚩🚩"
-            
-            cols_to_show.append(flag_col_name)
-
-        # 3. Filter to keep only the latest report for each Ticker
-        df_filtered = df_filtered.drop_duplicates(subset=["Ticker"], keep='first')
-
-        # 4. Select Columns
-        # cols_to_show already built
-        existing_cols = [c for c in cols_to_show if c in df_filtered.columns]
-        
-        df_final = df_filtered[existing_cols].rename(columns={"Ticker": "Mã CP"})
-        
-        return df_final
-
     def get_internal_warnings():
         tickers = ["VIC", "VHM", "VRE", "MSN", "TCB", "VPB", "MBB"]
         data = []
@@ -294,14 +311,7 @@ with tab2:
     def get_margin_warnings(exchange="HOSE", hnx_list_type=None):
         if exchange == "HOSE":
             try:
-                path = os.path.join("result1", "tinh_trang_chung_khoan_hose.csv")
-                df = pd.read_csv(path)
-                if not df.empty:
-                    # Rename symbol to Mã CP for consistency
-                    if "symbol" in df.columns:
-                        df = df.rename(columns={"symbol": "Mã CP"})
-                    return df
-                return pd.DataFrame()
+                return load_group_table("gdkq_hose")
             except Exception as e:
                 st.error(f"Lỗi khi đọc file tinh_trang_chung_khoan_hose.csv: {e}")
                 return pd.DataFrame()
@@ -311,32 +321,14 @@ with tab2:
                 dfs = []
                 # File 1: Khong duoc ky quy
                 if hnx_list_type is None or hnx_list_type == "Không được ký quỹ":
-                    path1 = os.path.join("result1", "khong_duoc_ky_quy_hnx.csv")
-                    if os.path.exists(path1):
-                        df1 = pd.read_csv(path1)
-                        if not df1.empty:
-                            # Rename columns to match expected schema ("Mã CP", "Lý do")
-                            rename_map = {"Mã CK": "Mã CP"}
-                            df1 = df1.rename(columns=rename_map)
-                            dfs.append(df1)
-
+                    dfs.append(load_group_table("gdkq_hnx_khong_ky_quy"))
                 # File 2: Tinh trang chung khoan
                 if hnx_list_type is None or hnx_list_type == "Tình trạng chứng khoán":
-                    path2 = os.path.join("result1", "tinh_trang_chung_khoan_hnx.csv")
-                    if os.path.exists(path2):
-                        df2 = pd.read_csv(path2)
-                        if not df2.empty:
-                            rename_map = {
-                                "Mã CK": "Mã CP", 
-                                "Tình trạng chứng khoán": "Lý do",
-                                "Tên tổ chức phát hành": "Tên công ty"
-                            }
-                            df2 = df2.rename(columns=rename_map)
-                            dfs.append(df2)
-                
+                    dfs.append(load_group_table("gdkq_hnx_tinh_trang"))
+
+                dfs = [d for d in dfs if not d.empty]
                 if dfs:
-                    df_final = pd.concat(dfs, ignore_index=True)
-                    return df_final
+                    return pd.concat(dfs, ignore_index=True)
                 return pd.DataFrame()
 
             except Exception as e:
@@ -345,163 +337,167 @@ with tab2:
         
         return pd.DataFrame()
 
+    def get_risk_matrix(view_mode, min_score=0, sort_col=risk_engine.RISK_SCORE_COL, ascending=False):
+        try:
+            return memo_filter("ma_tran_rui_ro", (view_mode, min_score, sort_col, ascending),
+                               risk_warnings.risk_matrix, view_mode, min_score, sort_col, ascending)
+        except Exception as e:
+            st.error(f"Lỗi khi tính ma trận rủi ro: {e}")
+            return pd.DataFrame()
+
+    def get_risk_matrix_columns():
+        # Các cột có thể sắp xếp; thiếu dữ liệu -> chỉ Điểm rủi ro (lỗi được báo ở get_risk_matrix)
+        try:
+            columns = [c for c in load_group_table("ma_tran_rui_ro").columns if c != "view"]
+        except Exception as e:
+            columns = []
+        return columns if risk_engine.RISK_SCORE_COL in columns else [risk_engine.RISK_SCORE_COL]
+
+    def get_room_margin(capital_billion):
+        # Vốn nhập vào chỉ cần một phép min theo vector trên snapshot đã cache
+        return memo_filter("room_margin", capital_billion, risk_warnings.room_margin, capital_billion)
+
+    def get_room_margin_grid(capitals):
+        return memo_filter("room_margin", ("grid", capitals), risk_warnings.room_margin_grid, capitals)
+
+    @profiling.track_cache("volume_manifest", st.cache_data)
+    def _load_volume_manifest_cached(signal_signature, price_signature):
+        return volume_engine.ensure_partitions(risk_warnings.VOLUME_PATH, volume_engine.PARTITION_DIR, risk_warnings.PRICE_PATH)
 
+    def load_volume_manifest():
+        # Danh sách ngày giao dịch có tín hiệu (kho chia theo ngày được tạo/cập nhật khi file tín hiệu đổi)
+        return _load_volume_manifest_cached(
+            source_signature(risk_warnings.VOLUME_PATH), source_signature(risk_warnings.PRICE_PATH)
+        )
+
+    @profiling.track_cache("volume_partitions", st.cache_resource(max_entries=32))
+    def _load_volume_partitions_cached(manifest_source, dates):
+        return volume_engine.read_partitions(dates, volume_engine.PARTITION_DIR)
 
-    def get_volume_warnings(selected_date=None):
+    def get_volume_warnings(selected_dates=None):
         try:
-            # Try to locate the csv file
-            path = os.path.join("Volume", "result", "volume_signal_daily.csv")
-            if not os.path.exists(path):
-                 st.error(f"Không tìm thấy file: {path}")
+            manifest = load_volume_manifest()
+            if not manifest or not manifest["dates"]:
+                 st.error(f"Không tìm thấy file: {risk_warnings.VOLUME_PATH}")
                  return pd.DataFrame()
-            
-            df = pd.read_csv(path)
-            
-            # Filter by date
-            if selected_date and "time" in df.columns:
-                 # Ensure 'time' column is string or datetime for comparison
-                 # The CSV output showed '2025-02-14', etc.
-                 df_filtered = df[df["time"] == str(selected_date)]
-            else:
-                 df_filtered = df
-
-            if df_filtered.empty:
-                return pd.DataFrame()
 
-            # Rename columns
-            rename_map = {
-                "symbol": "Mã CP",
-                "time": "Ngày",
-                "volume": "Khối lượng",
-                "vol_ma20": "TB 20 phiên",
-                "vol_ma50": "TB 50 phiên",
-                "vol_ma100": "TB 100 phiên",
-                "vol_ma200": "TB 200 phiên",
-                "vol_vs_ma20_pct": "% Tăng, giảm so với TB20",
-                "vol_vs_ma50_pct": "% Tăng, giảm so với TB50",
-                "vol_vs_ma100_pct": "% Tăng, giảm so với TB100",
-                "vol_vs_ma200_pct": "% Tăng, giảm so với TB200",
-                "flag_ma20": "Flag MA20",
-                "flag_ma50": "Flag MA50",
-                "flag_ma100": "Flag MA100",
-                "flag_ma200": "Flag MA200",
-                "flag_break_vol_100": "Đột biến Vol 100",
-                "flag_break_vol_200": "Đột biến Vol 200"
-            }
-
-            # Select relevant columns
-            cols_to_show = ["symbol", "time", "volume", "vol_vs_ma20_pct", "vol_vs_ma50_pct", "vol_vs_ma100_pct", "vol_vs_ma200_pct", "flag_break_vol_100", "flag_break_vol_200"]
-            existing_cols = [c for c in cols_to_show if c in df.columns]
-            
-            df_final = df_filtered[existing_cols].rename(columns=rename_map)
-            if "Ngày" in df_final.columns:
-                df_final = df_final.sort_values(by="Ngày", ascending=False)
-            return df_final
+            # Phiên mới nhất của từng mã: bảng gốc của nhóm (snapshot); các ngày khác chỉ đọc các ngày được chọn
+            if not selected_dates:
+                 return load_group_table("khoi_luong")
+            partitions_key = (tuple(manifest["source"] or ()), tuple(selected_dates))
+            return filter_memo.cached(
+                ("khoi_luong", partitions_key),
+                lambda: profiling.measure_rows("filter:khoi_luong", risk_warnings.volume_table, _load_volume_partitions_cached(*partitions_key)),
+            )
 
         except Exception as e:
             st.error(f"Lỗi khi đọc file volume_signal_daily.csv: {e}")
             return pd.DataFrame()
 
-    def get_industry_comparison(view_mode, selected_year, selected_quarters, selected_industries):
-        df_qtrr = load_qtrr_data()
-        if df_qtrr.empty or "Nganh" not in df_qtrr.columns:
+    def get_industry_comparison(view_mode, selected_year, selected_periods, selected_industries, metrics=None):
+        try:
+            table = load_group_table("so_sanh_nganh")
+        except Exception as e:
+            table = pd.DataFrame()
+        if table.empty or "Nganh" not in table.columns:
             st.warning("Dữ liệu quản trị rủi ro chưa có thông tin Ngành. Vui lòng cập nhật dữ liệu.")
             return pd.DataFrame()
 
-        # 1. Base Filter
-        if view_mode == "Năm":
-            mask = (df_qtrr["LengthReport"] == 5)
-        else:
-            mask = (df_qtrr["LengthReport"] != 5)
-            
-        df_filtered = df_qtrr[mask].copy()
+        # Rank and % Difference per Industry, per Period are precomputed for all (PeriodIdx, Nganh) groups
+        return memo_filter(
+            "so_sanh_nganh",
+            (view_mode, selected_year, frozenset(selected_periods or ()), frozenset(selected_industries or ()), metrics),
+            risk_warnings.industry_comparison, view_mode, selected_year, selected_periods, selected_industries, metrics,
+        )
 
-        # 2. Filter by Year
-        if selected_year:
-            df_filtered = df_filtered[df_filtered["YearReport"] == selected_year]
-            
-        # 3. Filter by Quarter (if applicable)
-        if view_mode == "Quý" and selected_quarters:
-             df_filtered = df_filtered[df_filtered["KyBaoCao"].isin(selected_quarters)] 
 
-        # 4. Filter by Industry
-        if selected_industries:
-            df_filtered = df_filtered[df_filtered["Nganh"].isin(selected_industries)]
+    @profiling.track_cache("screener", st.cache_resource(max_entries=4))
+    def _load_screener_cached(signature, view_mode):
+        return screener.prepare(load_qtrr_data(), view_mode)
 
-        if df_filtered.empty:
+    def get_screen(view_mode, expression, selected_year, selected_periods):
+        signature = source_signature(risk_warnings.QTRR_PATH)
+        if load_qtrr_data(QTRR_PERIOD_COLS).empty:
+            st.warning("Không tìm thấy dữ liệu quản trị rủi ro (qtrr_output1.xlsx).")
             return pd.DataFrame()
+        ctx = _load_screener_cached(signature, view_mode)
 
-        # 5. Calculation: Rank and % Difference per Industry, per Period (Year+Quarter)
-        # We process separately for each period present in the filtered data to ensure correct ranking
-        
-        result_dfs = []
-        # Group by Time Period + Industry
-        # Time Period Identifier: 'YearReport' + 'KyBaoCao'
-        groups = df_filtered.groupby(['YearReport', 'KyBaoCao', 'Nganh'])
-        
-        for name, group in groups:
-            g = group.copy()
-            
-            # --- Gross Margin ---
-            if 'Biên lợi nhuận gộp' in g.columns:
-                g['Rank BLN Gộp/Ngành'] = g['Biên lợi nhuận gộp'].rank(ascending=False, method='min')
-                mean_gop = g['Biên lợi nhuận gộp'].mean()
-                # % Diff: (Val - Mean) * 100 for absolute percentage point difference OR relative? 
-                # " % chênh lệch ... so với trung bình" usually implies relative: (Val - Avg)/Avg
-                # However for margins (percentages), usually simple diff is used.
-                # Let's use simple diff for now: Val - Mean. If Val is 0.20 (20%) and Mean is 0.15 (15%), diff is 0.05 (5%).
-                # User asked "% chênh lệch". I will output the raw difference which effectively is %.
-                g['% BLN Gộp vs TB Ngành'] = (g['Biên lợi nhuận gộp'] - mean_gop) * 100 # Convert to percentage points
-                
-            # --- Net Margin ---
-            if 'Biên lợi nhuận ròng' in g.columns:
-                g['Rank BLN Ròng/Ngành'] = g['Biên lợi nhuận ròng'].rank(ascending=False, method='min')
-                mean_rong = g['Biên lợi nhuận ròng'].mean()
-                g['% BLN Ròng vs TB Ngành'] = (g['Biên lợi nhuận ròng'] - mean_rong) * 100
+        def run():
+            with profiling.span("filter:screener", rows_in=len(ctx["data"])) as sp:
+                result = screener.run_screen(ctx, expression, selected_year, selected_periods)
+                sp["rows_out"] = len(result)
+            return result
 
-            result_dfs.append(g)
-            
-        if result_dfs:
-            df_final = pd.concat(result_dfs)
-            
-            # --- Cleaning: Remove rows with no valid margin data ---
-            # Replace inf/-inf with NaN
-            df_final.replace([np.inf, -np.inf], np.nan, inplace=True)
-            
-            # Drop rows where BOTH Gross and Net margins are NaN
-            cols_to_check = [c for c in ['Biên lợi nhuận gộp', 'Biên lợi nhuận ròng'] if c in df_final.columns]
-            if cols_to_check:
-                df_final = df_final.dropna(subset=cols_to_check, how='all')
-                
-        else:
-            df_final = pd.DataFrame()
+        try:
+            key = ("screener", signature, view_mode, expression.strip(), selected_year, frozenset(selected_periods or ()))
+            return filter_memo.cached(key, run)
+        except screener.ScreenError as e:
+            st.error(f"Biểu thức lỗi: {e}")
+            return pd.DataFrame()
 
-        # Select columns
-        cols_to_show = ["Ticker", "Nganh", "YearReport", "KyBaoCao", 
-                        "Rank BLN Gộp/Ngành", "% BLN Gộp vs TB Ngành", "Biên lợi nhuận gộp",
-                        "Rank BLN Ròng/Ngành", "% BLN Ròng vs TB Ngành", "Biên lợi nhuận ròng"]
-        cols_existing = [c for c in cols_to_show if c in df_final.columns]
-        
-        return df_final[cols_existing].rename(columns={"Ticker": "Mã CP"})
+    # Lịch sử thay đổi cảnh báo do batch ghi (snapshots/changes.*), đọc lại khi file đổi
+    @profiling.track_cache("change_history", st.cache_resource(max_entries=2))
+    def _load_change_history_cached(path, signature):
+        return data_cache.read_frame(path)
 
+    def change_history_signature():
+        path = change_feed.history_path(risk_warnings.SNAPSHOT_DIR)
+        return None if path is None else (str(path), data_cache.source_signature(path))
+
+    def get_changes(range_mode, groups, kinds):
+        signature = change_history_signature()
+        if signature is None:
+            st.info("Chưa có lịch sử thay đổi: cần ít nhất hai lần chạy batch (python risk_warnings.py).")
+            return pd.DataFrame()
+        history = _load_change_history_cached(*signature)
+        runs, since = None, None
+        if range_mode == "Lần cập nhật mới nhất":
+            runs = [history["Phiên bản"].max()] if len(history) else []
+        elif range_mode != "Tất cả":
+            # Theo ngày (không theo giờ) để key cache không đổi sau mỗi lần rerun
+            since = (date.today() - timedelta(days=int(range_mode.split()[0]))).isoformat()
+        key = ("changes", signature, tuple(runs or ()), since, frozenset(groups), frozenset(kinds))
+        return filter_memo.cached(
+            key, lambda: profiling.measure_rows("filter:changes", change_feed.filter_changes, history, runs, since, groups, kinds)
+        )
+
+    def build_all_warning_sheets():
+        # Mỗi nhóm cảnh báo một sheet, với bộ lọc mặc định của nhóm (kỳ báo cáo mới nhất)
+        sheets = {}
+        quarters_by_year = load_period_options().get("Quý", {})
+        if quarters_by_year:
+            # Năm và quý được sắp xếp giảm dần -> phần tử đầu là kỳ mới nhất
+            latest_year, latest_quarters = next(iter(quarters_by_year.items()))
+            latest_period = int(risk_engine.period_index(latest_year, latest_quarters[0]))
+            sheets["Tăng trưởng ảo"] = get_financial_warnings("Quý", latest_year, [latest_period])
+            sheets["BCTC âm"] = get_cash_flow_warnings("Quý", metrics=risk_engine.DEFAULT_NEGATIVE_METRICS)
+            sheets["So sánh ngành"] = get_industry_comparison("Quý", latest_year, [latest_period], [])
+        sheets["GDKQ HOSE"] = get_margin_warnings("HOSE")
+        sheets["GDKQ HNX"] = get_margin_warnings("HNX")
+        sheets["Khối lượng giao dịch"] = get_volume_warnings()
+        sheets["Room margin"] = get_room_margin(DEFAULT_CAPITAL_BILLION)
+        sheets["Ma trận rủi ro"] = get_risk_matrix("Quý")
+        return {name: df for name, df in sheets.items() if not df.empty}
 
     # --- Filters ---
-    search_input_risk = st.text_input("Nhập mã cổ phiếu (ví dụ: VIC, VHM...):", key="risk_ticker_filter")
-    risk_tickers = [x.strip().upper() for x in search_input_risk.replace(" ", ",").split(",") if x.strip()]
+    search_input_risk = st.text_input("Nhập mã cổ phiếu hoặc tên công ty (ví dụ: VIC, VH*, xi măng...):", key="risk_ticker_filter")
+    risk_codes, risk_tickers = search_tickers(search_input_risk, load_ticker_index)
 
     # Global filters for common tabs
     # (Only show if NOT "So sánh ngành" because that tab has its own specific logic?)
     # or Keep them? The user said "t có thể chọn được fillter của từng quý từng năm và từng ngành"
-    df_cp = load_cp_data()
-    if warning_group != "So sánh ngành" and warning_group != "Danh sách chứng khoán không được phép GDKQ":
-        # Get options from cp.csv
-        exchanges = []
-        sectors = []
-        if not df_cp.empty:
-            if "ComGroupCode" in df_cp.columns:
-                exchanges = sorted(df_cp["ComGroupCode"].dropna().unique())
-            if "nganh" in df_cp.columns:
-                sectors = sorted(df_cp["nganh"].dropna().unique())
+    profiling.annotate(group=warning_group)
+    # Chỉ các nhóm có bộ lọc Sàn/Ngành mới load bảng chiều mã
+    uses_ticker_dim = warning_group != "So sánh ngành" and warning_group != "Danh sách chứng khoán không được phép GDKQ"
+    selected_exchanges, selected_sectors = [], []
+    if uses_ticker_dim:
+        ticker_dim = load_ticker_dim()
+        # Ngành theo cp.csv/qtrr; nếu không có thì lọc theo Mô hình của summary.xlsx
+        sector_col = "Ngành" if ticker_dim["Ngành"].notna().any() else "Mô hình"
+
+        # Get options from the ticker dimension
+        exchanges = sorted(ticker_dim["Sàn"].dropna().unique())
+        sectors = sorted(ticker_dim[sector_col].dropna().unique())
         
         # Fallback
         if not exchanges: 
@@ -517,6 +513,8 @@ with tab2:
             selected_sectors = st.multiselect("Lọc theo ngành:", sectors, default=[])
 
     # --- Display Logic ---
+    # Trạng thái bộ lọc hiện tại (dùng làm key cache cho file xuất)
+    filter_state = {"group": warning_group, "tickers": risk_tickers}
     df_display = pd.DataFrame()
     df_display_renamed = pd.DataFrame()
 
@@ -524,65 +522,52 @@ with tab2:
         st.info("Các cảnh báo liên quan đến Báo cáo tài chính, chất lượng lợi nhuận và dòng tiền.")
         
         # Filters for Financials
-        raw_df = load_qtrr_data()
+        period_options = load_period_options()
         
         c1, c2, c3 = st.columns(3)
         with c1:
             view_mode = st.radio("Xem dữ liệu theo:", ["Quý", "Năm"], horizontal=True)
             
         # Filter available years based on View Mode
-        if view_mode == "Năm":
-            years_in_data = raw_df[raw_df["LengthReport"] == 5]["YearReport"].unique()
-        else:
-            years_in_data = raw_df[raw_df["LengthReport"] != 5]["YearReport"].unique()
-            
-        available_years = sorted(years_in_data, reverse=True) if len(years_in_data) > 0 else []
+        available_years = list(period_options.get(view_mode, {}))
         
         with c2:
             selected_year = st.selectbox("Chọn Năm:", available_years, key="fin_year")
 
-        selected_quarters = []
+        selected_periods = []
         with c3:
             if view_mode == "Quý":
-                 # Helper to get quarters for selected year
-                 if "KyBaoCao" in raw_df.columns and "YearReport" in raw_df.columns:
-                     q_df = raw_df[(raw_df["YearReport"] == selected_year) & (raw_df["LengthReport"] != 5)]
-                     # Extract quarter numbers for UI (e.g., "2025_Q1" -> 1)
-                     avail_q_nums = set()
-                     for q_str in q_df["KyBaoCao"].dropna().unique():
-                         if "_Q" in str(q_str):
-                             try:
-                                 q_num = int(str(q_str).split("_Q")[1])
-                                 avail_q_nums.add(q_num)
-                             except:
-                                 pass
-                     available_quarters = sorted(list(avail_q_nums), reverse=True)
-                     
-                     selected_q_nums = st.multiselect("Chọn Quý:", available_quarters, default=available_quarters[:1], key="fin_quarters")
-                     # Convert back to string format for filtering
-                     selected_quarters = [f"{selected_year}_Q{q}" for q in selected_q_nums]
-
-        df_display = get_financial_warnings(view_mode, selected_year, selected_quarters)
-        df_display_renamed = df_display.copy()
+                 available_quarters = period_options.get(view_mode, {}).get(selected_year, [])
+                 selected_q_nums = st.multiselect("Chọn Quý:", available_quarters, default=available_quarters[:1], key="fin_quarters")
+                 # Quý đã chọn -> PeriodIdx để lọc
+                 selected_periods = [int(risk_engine.period_index(selected_year, q)) for q in selected_q_nums]
+
+        df_display = get_financial_warnings(view_mode, selected_year, selected_periods)
+        filter_state.update(view=view_mode, year=selected_year, periods=selected_periods)
+        df_display_renamed = df_display
 
     elif warning_group == "BCTC âm":
         st.info("Cảnh báo âm liên tiếp cho các chỉ số tài chính (dữ liệu cập nhật mới nhất).")
         
-        col_y, col_metrics = st.columns([1, 2])
+        col_y, col_metrics, col_n = st.columns([1, 2, 1])
         with col_y:
             view_mode = st.radio("Xem dữ liệu theo:", ["Quý", "Năm"], horizontal=True, key="cf_view_mode")
             
         with col_metrics:
-            available_metrics = ["Lưu chuyển tiền thuần từ HĐKD", "Cổ đông của công ty mẹ"]
+            available_metrics = get_streak_metrics()
             selected_metrics = st.multiselect(
                 "Chọn chỉ số cảnh báo:", 
                 available_metrics, 
-                default=["Lưu chuyển tiền thuần từ HĐKD"]
+                default=[m for m in risk_engine.DEFAULT_NEGATIVE_METRICS if m in available_metrics]
             )
+
+        with col_n:
+            min_streak = st.number_input("Số kỳ âm liên tiếp tối thiểu:", min_value=0, value=0, step=1, key="cf_min_streak")
         
         if selected_metrics:
-            df_display = get_cash_flow_warnings(view_mode, metrics=selected_metrics)
-            df_display_renamed = df_display.copy()
+            df_display = get_cash_flow_warnings(view_mode, metrics=selected_metrics, min_streak=min_streak)
+            filter_state.update(view=view_mode, metrics=selected_metrics, min_streak=min_streak)
+            df_display_renamed = df_display
         else:
             st.warning("Vui lòng chọn ít nhất một chỉ số.")
             df_display_renamed = pd.DataFrame()
@@ -590,12 +575,12 @@ with tab2:
     elif warning_group == "Nội bộ doanh nghiệp":
         st.info("Các cảnh báo về giao dịch cổ đông lớn, ban lãnh đạo và cơ cấu sở hữu.")
         df_display = get_internal_warnings()
-        df_display_renamed = df_display.copy()
+        df_display_renamed = df_display
         
     elif warning_group == "Thanh khoản cổ phiếu":
         st.info("Các cảnh báo về dòng tiền, khối lượng giao dịch bất thường.")
         df_display = get_liquidity_warnings()
-        df_display_renamed = df_display.copy()
+        df_display_renamed = df_display
 
     elif warning_group == "Danh sách chứng khoán không được phép GDKQ":
         c_ex, c_type = st.columns([1, 2])
@@ -608,13 +593,15 @@ with tab2:
                 hnx_list_type = st.radio("Loại danh sách:", ["Không được ký quỹ", "Tình trạng chứng khoán"], horizontal=True)
 
         df_display = get_margin_warnings(exchange, hnx_list_type)
-        df_display_renamed = df_display.copy()
+        filter_state.update(exchange=exchange, hnx_list_type=hnx_list_type)
+        df_display_renamed = df_display
 
     elif warning_group == "So sánh ngành":
         st.info("So sánh hiệu quả hoạt động (Biên LN) của doanh nghiệp so với trung bình ngành.")
         
         # Load raw data to get unique values for filters
-        raw_df = load_qtrr_data()
+        raw_df = load_qtrr_data(["Nganh"])
+        period_options = load_period_options()
         
         col_y, col_q, col_i = st.columns(3)
         
@@ -622,289 +609,273 @@ with tab2:
             view_mode = st.radio("Dữ liệu:", ["Quý", "Năm"], horizontal=True)
             
         # Get helper lists based on View Mode
-        if "YearReport" in raw_df.columns:
-            if view_mode == "Năm":
-                years_in_data = raw_df[raw_df["LengthReport"] == 5]["YearReport"].unique()
-            else:
-                years_in_data = raw_df[raw_df["LengthReport"] != 5]["YearReport"].unique()
-            available_years = sorted(years_in_data, reverse=True)
-        else:
-            available_years = []
+        available_years = list(period_options.get(view_mode, {}))
             
         available_industries = sorted(raw_df["Nganh"].dropna().unique()) if "Nganh" in raw_df.columns else []
         
         with col_q:
              selected_year = st.selectbox("Chọn Năm:", available_years, key="ind_year")
              
-             selected_quarters = []
+             selected_periods = []
              if view_mode == "Quý":
-                 if "KyBaoCao" in raw_df.columns:
-                     q_df = raw_df[(raw_df["YearReport"] == selected_year) & (raw_df["LengthReport"] != 5)]
-                     
-                     avail_q_nums = set()
-                     for q_str in q_df["KyBaoCao"].dropna().unique():
-                         if "_Q" in str(q_str):
-                             try:
-                                 q_num = int(str(q_str).split("_Q")[1])
-                                 avail_q_nums.add(q_num)
-                             except:
-                                 pass
-                     available_quarters = sorted(list(avail_q_nums), reverse=True)
-                     
-                     selected_q_nums = st.multiselect("Chọn Quý:", available_quarters, default=available_quarters[:1], key="ind_quarters")
-                     selected_quarters = [f"{selected_year}_Q{q}" for q in selected_q_nums]
+                 available_quarters = period_options.get(view_mode, {}).get(selected_year, [])
+                 selected_q_nums = st.multiselect("Chọn Quý:", available_quarters, default=available_quarters[:1], key="ind_quarters")
+                 selected_periods = [int(risk_engine.period_index(selected_year, q)) for q in selected_q_nums]
 
         with col_i:
              selected_industries_comp = st.multiselect("Chọn Ngành:", available_industries, default=[])
 
-        df_display = get_industry_comparison(view_mode, selected_year, selected_quarters, selected_industries_comp)
-        df_display_renamed = df_display.copy()
+        selected_industry_metrics = st.multiselect(
+            "Chỉ số so sánh:",
+            list(risk_engine.INDUSTRY_METRICS),
+            default=risk_engine.DEFAULT_INDUSTRY_METRICS,
+            key="ind_metrics"
+        )
+
+        df_display = get_industry_comparison(view_mode, selected_year, selected_periods, selected_industries_comp, selected_industry_metrics)
+        filter_state.update(view=view_mode, year=selected_year, periods=selected_periods,
+                            industries=selected_industries_comp, metrics=selected_industry_metrics)
+        df_display_renamed = df_display
 
     elif warning_group == "Khối lượng giao dịch":
         st.info("Cảnh báo các mã có khối lượng giao dịch đột biến hoặc tín hiệu kỹ thuật về Volume.")
-        
-        df_display = get_volume_warnings()
-        df_display_renamed = df_display.copy()
+
+        manifest = load_volume_manifest()
+        trading_dates = manifest["dates"] if manifest else []
+        selected_dates = None  # Phiên mới nhất của từng mã
+
+        c_mode, c_date = st.columns([1, 2])
+        with c_mode:
+            date_mode = st.radio("Xem theo:", ["Phiên mới nhất", "Ngày", "Khoảng ngày"], horizontal=True, key="vol_date_mode")
+
+        if trading_dates and date_mode != "Phiên mới nhất":
+            first_date = date.fromisoformat(trading_dates[0])
+            last_date = date.fromisoformat(trading_dates[-1])
+            with c_date:
+                if date_mode == "Ngày":
+                    picked = st.date_input("Chọn ngày:", value=last_date, min_value=first_date, max_value=last_date, key="vol_date")
+                    selected_dates = [picked.isoformat()]
+                else:
+                    picked = st.date_input(
+                        "Chọn khoảng ngày:",
+                        value=(max(first_date, last_date - timedelta(days=30)), last_date),
+                        min_value=first_date, max_value=last_date, key="vol_date_range"
+                    )
+                    # Khi mới chọn ngày bắt đầu, date_input trả về 1 phần tử
+                    start_date, end_date = (picked[0], picked[-1]) if picked else (last_date, last_date)
+                    selected_dates = volume_engine.dates_in_range(manifest, start_date.isoformat(), end_date.isoformat())
+
+        if selected_dates:
+            st.caption(f"Dữ liệu phiên: {selected_dates[0]}" + (f" → {selected_dates[-1]}" if len(selected_dates) > 1 else ""))
+        elif trading_dates:
+            st.caption(f"Phiên mới nhất của từng mã (đến {trading_dates[-1]})")
+        df_display = get_volume_warnings(selected_dates)
+        filter_state.update(dates=selected_dates)
+        df_display_renamed = df_display
+
+    elif warning_group == "Bộ lọc biểu thức":
+        st.info("Lọc theo biểu thức trên mọi chỉ số của dữ liệu quản trị rủi ro (tính trên toàn bộ lịch sử, hiển thị kỳ được chọn).")
+        period_options = load_period_options()
+
+        c1, c2, c3 = st.columns(3)
+        with c1:
+            view_mode = st.radio("Xem dữ liệu theo:", ["Quý", "Năm"], horizontal=True, key="scr_view_mode")
+        available_years = list(period_options.get(view_mode, {}))
+        with c2:
+            selected_year = st.selectbox("Chọn Năm:", available_years, key="scr_year")
+        selected_periods = []
+        with c3:
+            if view_mode == "Quý":
+                available_quarters = period_options.get(view_mode, {}).get(selected_year, [])
+                selected_q_nums = st.multiselect("Chọn Quý:", available_quarters, default=available_quarters[:1], key="scr_quarters")
+                selected_periods = [int(risk_engine.period_index(selected_year, q)) for q in selected_q_nums]
+
+        expression = st.text_input(
+            "Biểu thức lọc:", value="CFO < 0 and growth(DT) > 30% and BLNG < ind_median(BLNG)", key="scr_expression"
+        )
+        with st.expander("Cú pháp biểu thức"):
+            st.markdown(
+                "So sánh `< <= > >= == !=`, phép tính `+ - * / **`, kết hợp `and` `or` `not`, `30%` = 0.3. "
+                "Tên cột đầy đủ đặt trong dấu backtick, vd. `` `Hệ số lợi nhuận gộp` > 0.2 ``.\n\n"
+                + "\n".join(f"- `{k}`: {v}" for k, v in screener.ALIASES.items())
+                + "\n\n"
+                + "\n".join(f"- `{k}()`: {v}" for k, v in screener.FUNCTIONS.items())
+            )
+
+        df_display = get_screen(view_mode, expression, selected_year, selected_periods)
+        filter_state.update(view=view_mode, year=selected_year, periods=selected_periods, expression=expression)
+        df_display_renamed = df_display
+
+    elif warning_group == "Thay đổi mới":
+        st.info("Các cảnh báo mới xuất hiện, tăng mức hoặc hết cảnh báo giữa các lần cập nhật dữ liệu.")
+        c1, c2, c3 = st.columns(3)
+        with c1:
+            change_range = st.radio("Khoảng thời gian:", ["Lần cập nhật mới nhất", "7 ngày", "30 ngày", "Tất cả"], key="chg_range")
+        with c2:
+            change_groups = st.multiselect("Nhóm cảnh báo:", list(change_feed.GROUP_LABELS.values()), default=[], key="chg_groups")
+        with c3:
+            change_kinds = st.multiselect(
+                "Loại thay đổi:", change_feed.KINDS, default=[change_feed.ADDED, change_feed.ESCALATED], key="chg_kinds"
+            )
+
+        df_display = get_changes(change_range, change_groups, change_kinds)
+        if not df_display.empty:
+            st.caption(f"Cập nhật: {df_display['Thời điểm'].iloc[0]}")
+        filter_state.update(range=change_range, change_groups=change_groups, kinds=change_kinds, history=change_history_signature())
+        df_display_renamed = df_display
+
+    elif warning_group == "Ma trận rủi ro":
+        st.info(
+            "Mọi nhóm cảnh báo của mỗi mã trên một dòng (kỳ BCTC mới nhất, phiên khối lượng mới nhất). "
+            "Điểm rủi ro: Tăng trưởng ảo 3; chuỗi âm từ 2 kỳ: số kỳ - 1 (tối đa 3); mỗi biên LN dưới TB ngành 1; "
+            "không được GDKQ 2; đột biến Vol 100/200: 1/2."
+        )
+        c1, c2, c3, c4 = st.columns(4)
+        with c1:
+            view_mode = st.radio("Xem dữ liệu theo:", ["Quý", "Năm"], horizontal=True, key="mx_view_mode")
+        with c2:
+            min_score = st.number_input("Điểm rủi ro tối thiểu:", min_value=0, value=1, step=1, key="mx_min_score")
+        matrix_columns = get_risk_matrix_columns()
+        with c3:
+            sort_col = st.selectbox("Sắp xếp theo:", matrix_columns, index=matrix_columns.index(risk_engine.RISK_SCORE_COL), key="mx_sort")
+        with c4:
+            ascending = st.checkbox("Tăng dần", value=False, key="mx_ascending")
+
+        df_display = get_risk_matrix(view_mode, int(min_score), sort_col, ascending)
+        filter_state.update(view=view_mode, min_score=int(min_score), sort=sort_col, ascending=ascending)
+        df_display_renamed = df_display
 
     elif warning_group == "Room margin":
 
         
-        capital_billion = st.number_input("Nhập Vốn (Tỷ):", min_value=0.0, value=1.0, step=0.1, format="%.1f")
-        
-        df_cp_list = load_cp_data()
-        
-        # --- Load additional data for Max Room 2 ---
-        df_fin = load_qtrr_data()
-        try:
-             price_path = os.path.join("data", "stock_prices.csv")
-             df_price = pd.read_csv(price_path)
-        except Exception:
-             df_price = pd.DataFrame()
-             
-        if not df_cp_list.empty:
-             df_display = df_cp_list[["Ticker"]].copy()
-             
-             # 1. Calc Max Room 1
-             df_display["Room (VCSH)"] = capital_billion * 0.1
-             
-             # 2. Calc Max Room 2
-             # Prepare Financial Data (Latest Vốn cổ phần + Period info)
-             if not df_fin.empty and "Vốn cổ phần" in df_fin.columns:
-                 # Sort to get latest
-                 df_fin_sorted = df_fin.sort_values(by=["Ticker", "YearReport", "KyBaoCao"], ascending=[True, False, False])
-                 df_fin_latest = df_fin_sorted.drop_duplicates(subset=["Ticker"])[["Ticker", "Vốn cổ phần", "YearReport", "KyBaoCao"]]
-                 
-                 df_display = df_display.merge(df_fin_latest, on="Ticker", how="left")
-                 
-                 # Create combined Period string
-                 df_display["Kỳ BCTC"] = df_display["KyBaoCao"].astype(str) 
-                 # Calculate Shares Outstanding
-                 df_display["KL Lưu hành"] = df_display["Vốn cổ phần"] / 10000
-             
-             # Prepare Price Data (Latest Close + Date)
-             if not df_price.empty and "symbol" in df_price.columns and "close" in df_price.columns:
-                 if "time" in df_price.columns:
-                     df_price = df_price.sort_values(by=["symbol", "time"])
-                 
-                 # Get last close AND last time
-                 df_price_latest = df_price.groupby("symbol")[["close", "time"]].last().reset_index()
-                 df_price_latest = df_price_latest.rename(columns={"symbol": "Ticker", "close": "Giá", "time": "Ngày GD"})
-                 
-                 df_display = df_display.merge(df_price_latest, on="Ticker", how="left")
-                 
-             # Calculate Formula: KL Lưu hành * 5% * (Giá * 1000) / 1 Billion
-             if "KL Lưu hành" in df_display.columns and "Giá" in df_display.columns:
-                 # Fill NaNs
-                 df_display["KL Lưu hành"] = df_display["KL Lưu hành"].fillna(0) # Temp for calculation
-                 df_display["Giá"] = df_display["Giá"].fillna(0)
-                 
-                 val_vnd = df_display["KL Lưu hành"] * 0.05 * (df_display["Giá"] * 1000)
-                 df_display["Room (số lượng cp lưu hành)"] = val_vnd / 1_000_000_000
-                 
-             else:
-                 df_display["Room (số lượng cp lưu hành)"] = 0
-
-             # 3. Calc Max Room Cho Vay (Min of 1 & 2)
-             df_display["Max Room Cho Vay"] = df_display[["Room (VCSH)", "Room (số lượng cp lưu hành)"]].min(axis=1)
-
-             # Clean up temp cols of raw data
-             cols_to_drop = ["Vốn cổ phần", "YearReport", "KyBaoCao"]
-             df_display = df_display.drop(columns=[c for c in cols_to_drop if c in df_display.columns])
-
-             # Reorder columns for nice display
-             ordered_cols = ["Ticker", "Kỳ BCTC", "KL Lưu hành", "Ngày GD", "Giá", "Room (VCSH)", "Room (số lượng cp lưu hành)", "Max Room Cho Vay"]
-             # Filter only those that exist
-             final_cols = [c for c in ordered_cols if c in df_display.columns]
-             df_display = df_display[final_cols]
-
-             df_display_renamed = df_display.rename(columns={"Ticker": "Mã CP"})
+        grid_mode = st.checkbox("Phân tích nhiều mức vốn", key="room_grid_mode")
+        if grid_mode:
+            c_from, c_to, c_step = st.columns(3)
+            with c_from:
+                capital_from = st.number_input("Vốn từ (Tỷ):", min_value=0.0, value=DEFAULT_CAPITAL_BILLION, step=0.1, format="%.1f")
+            with c_to:
+                capital_to = st.number_input("Đến (Tỷ):", min_value=0.0, value=10.0, step=0.1, format="%.1f")
+            with c_step:
+                capital_step = st.number_input("Bước (Tỷ):", min_value=0.1, value=1.0, step=0.1, format="%.1f")
+            capitals = np.round(np.arange(capital_from, capital_to + capital_step / 2, capital_step), 4)
+            df_display_renamed = get_room_margin_grid(capitals)
+            filter_state.update(capitals=tuple(capitals))
         else:
+            capital_billion = st.number_input("Nhập Vốn (Tỷ):", min_value=0.0, value=DEFAULT_CAPITAL_BILLION, step=0.1, format="%.1f")
+            df_display_renamed = get_room_margin(capital_billion)
+            filter_state.update(capital=capital_billion)
+        if df_display_renamed.empty:
              st.warning("Không tìm thấy dữ liệu cổ phiếu (cp.csv).")
-             df_display_renamed = pd.DataFrame()
 
     
     # --- Apply Filters (Common) ---
-    if not df_display_renamed.empty:
-        # 1. Filter by Ticker first
-        if risk_tickers:
-            if "Mã CP" in df_display_renamed.columns:
-                df_display_renamed = df_display_renamed[df_display_renamed["Mã CP"].isin(risk_tickers)]
-        
-        # Logic to merge with main df to get Sàn/Mô hình if missing (SKIP for Ind Comparison as it has its own logic)
-        if warning_group != "So sánh ngành" and warning_group != "Danh sách chứng khoán không được phép GDKQ":
-            if not df_cp.empty:
-                 if "Mã CP" in df_display_renamed.columns:
-                     df_display_renamed = df_display_renamed.merge(
-                         df_cp,
-                         left_on="Mã CP",
-                         right_on="Ticker",
-                         how="left"
-                     )
-                     
-                     if selected_exchanges and "ComGroupCode" in df_display_renamed.columns:
-                         df_display_renamed = df_display_renamed[df_display_renamed["ComGroupCode"].isin(selected_exchanges)]
-                         
-                     if selected_sectors and "nganh" in df_display_renamed.columns:
-                         df_display_renamed = df_display_renamed[df_display_renamed["nganh"].isin(selected_sectors)]
-                         
-                     # Rename for display
-                     rename_dict = {}
-                     if "ComGroupCode" in df_display_renamed.columns:
-                         rename_dict["ComGroupCode"] = "Sàn"
-                     if "nganh" in df_display_renamed.columns:
-                         rename_dict["nganh"] = "Ngành"
-                     
-                     if rename_dict:
-                         df_display_renamed = df_display_renamed.rename(columns=rename_dict)
-            
-            else:  
-                # Fallback logic
-                if (selected_exchanges or selected_sectors) and "Sàn" not in df_display_renamed.columns:
-                    if "Mã CP" in df_display_renamed.columns and "Mã" in df.columns:
-                        df_merged = df_display_renamed.merge(
-                            df[["Mã", "Sàn", "Mô hình"]].drop_duplicates(),
-                            left_on="Mã CP",
-                            right_on="Mã",
-                            how="left"
-                        )
-                        if "Sàn" in df_merged.columns:
-                            df_display_renamed = df_merged
-
-                if selected_exchanges and "Sàn" in df_display_renamed.columns:
-                    df_display_renamed = df_display_renamed[df_display_renamed["Sàn"].isin(selected_exchanges)]
-                if selected_sectors and "Mô hình" in df_display_renamed.columns:
-                    df_display_renamed = df_display_renamed[df_display_renamed["Mô hình"].isin(selected_sectors)]
-            
-
+    def result_postings(df):
+        # Danh sách dòng theo mã của kết quả đang hiển thị: build một lần cho mỗi (dữ liệu, bộ lọc),
+        # mỗi lần gõ tìm kiếm chỉ lấy các lát cắt của mã khớp thay vì isin trên cả bảng
+        key = ("risk_postings", data_version(), {k: v for k, v in filter_state.items() if k != "tickers"})
+        col = risk_engine.ticker_column(df)
+        return filter_memo.cached(key, lambda: risk_engine.build_postings(load_ticker_index(), df[col]))
+
+    def apply_common_filters(df):
+        with profiling.span("tab2:common_filter", rows_in=len(df)) as sp:
+            # 1. Filter by Ticker first
+            if risk_codes is not None and risk_engine.ticker_column(df) is not None:
+                df = df.iloc[risk_engine.posting_rows(result_postings(df), risk_codes)]
+
+            # Gắn Sàn/Ngành theo mã số nguyên của bảng chiều, không merge (SKIP for Ind Comparison as it has its own logic)
+            if uses_ticker_dim:
+                if not ticker_dim.empty and "Mã CP" in df.columns:
+                    codes = risk_engine.ticker_codes(ticker_dim, df["Mã CP"])
+
+                    if selected_exchanges or selected_sectors:
+                        keep = risk_engine.ticker_filter_mask(ticker_dim, codes, selected_exchanges, selected_sectors, sector_col)
+                        df, codes = df[keep], codes[keep]
+
+                    ticker_attrs = risk_engine.ticker_lookup(ticker_dim, codes, ["Sàn", "Ngành"])
+                    df = pd.concat(
+                        [df.reset_index(drop=True), ticker_attrs], axis=1
+                    )
+            sp["rows_out"] = len(df)
+        return df
 
-    # --- Custom Styling for Table ---
-    def highlight_negative(val):
-        if isinstance(val, (int, float)) and val < 0:
-            return 'color: red'
-        return ''
+    if not df_display_renamed.empty:
+        # Cùng dữ liệu + cùng bộ lọc -> dùng lại kết quả (kể cả của session khác)
+        common_key = (
+            "risk", data_version(), {k: v for k, v in filter_state.items() if k != "tickers"},
+            None if risk_tickers is None else frozenset(risk_tickers), frozenset(selected_exchanges), frozenset(selected_sectors),
+        )
+        df_display_renamed = filter_memo.cached(common_key, lambda: apply_common_filters(df_display_renamed))
 
-    def highlight_diff(val):
-        if isinstance(val, (int, float)):
-            if val > 0: return 'color: green'
-            if val < 0: return 'color: red'
-        return ''
 
     if not df_display_renamed.empty:
-        # Copy dữ liệu đầy đủ để xuất Excel
-        df_export = df_display_renamed.copy()
+        # Dữ liệu đầy đủ để xuất Excel (không bị thay đổi ở bước dưới nên không cần copy)
+        df_export = df_display_renamed
         
         # Ẩn 3 cột không mong muốn trên giao diện
         cols_to_drop = ["Ticker", "Sàn", "Ngành"]
         df_display_renamed = df_display_renamed.drop(columns=[c for c in cols_to_drop if c in df_display_renamed.columns])
 
-        styled_df = df_display_renamed.style
-        
-        if warning_group == "So sánh ngành":
-             # Format specific columns
-             format_dict = {
-                 "Biên lợi nhuận gộp": "{:.2%}",
-                 "Biên lợi nhuận ròng": "{:.2%}",
-                 "% BLN Gộp vs TB Ngành": "{:+.2f} %",
-                 "% BLN Ròng vs TB Ngành": "{:+.2f} %",
-                 "Rank BLN Gộp/Ngành": "{:.0f}",
-                 "Rank BLN Ròng/Ngành": "{:.0f}"
-             }
-             # Apply format to columns that exist
-             cols_to_format = {k: v for k, v in format_dict.items() if k in df_display_renamed.columns}
-             styled_df = styled_df.format(cols_to_format)
-             
-             # Highlight diffs
-             subset_diff = [c for c in ["% BLN Gộp vs TB Ngành", "% BLN Ròng vs TB Ngành"] if c in df_display_renamed.columns]
-             if subset_diff:
-                 styled_df = styled_df.map(highlight_diff, subset=subset_diff)
-
-        elif "Lợi nhuận của công ty mẹ" in df_display_renamed.columns:
-            styled_df = styled_df.map(highlight_negative, subset=["Lưu chuyển tiền thuần từ HĐKD", "Lợi nhuận của công ty mẹ", "LNST"])
-            styled_df = styled_df.format(thousands=",", precision=0)
-
-        elif "Khối lượng" in df_display_renamed.columns:
-             # Formatting for Volume tab
-             format_dict_vol = {
-                 "Khối lượng": "{:,.0f}",
-                 "TB 20 phiên": "{:,.0f}",
-                 "% Tăng, giảm so với TB20": "{:.2f}%",
-                 "% Tăng, giảm so với TB50": "{:.2f}%",
-                 "% Tăng, giảm so với TB100": "{:.2f}%",
-                 "% Tăng, giảm so với TB200": "{:.2f}%"
-             }
-             styled_df = styled_df.format({k:v for k,v in format_dict_vol.items() if k in df_display_renamed.columns})
-             
-             # Highlight breakout
-             if "Đột biến Vol 100" in df_display_renamed.columns:
-                 def highlight_true(val):
-                     return 'background-color: #d4edda; color: #155724' if val == True or val == "True" else ''
-                 styled_df = styled_df.map(highlight_true, subset=["Đột biến Vol 100"])
-
-             # Highlight % changes
-             def highlight_volume_change(val):
-                 if isinstance(val, (int, float)):
-                     if val > 100:
-                         return 'color: #800080; font-weight: bold;' # Purple for > 100%
-                     elif val > 50:
-                         return 'color: #0000FF; font-weight: bold;' # Dark Green for > 50%
-                     elif val > 20:
-                         return 'color: #008000;' # Lime Green for > 20%
-                     elif val < 0:
-                         return 'color: #dc3545;' # Red for negative
-                 return ''
-             
-             vol_pct_cols = [c for c in df_display_renamed.columns if "% Tăng" in c]
-             if vol_pct_cols:
-                 styled_df = styled_df.map(highlight_volume_change, subset=vol_pct_cols)
-
-        elif "Room (VCSH)" in df_display_renamed.columns:
-             styled_df = styled_df.format({
-                 "Room (VCSH)": lambda x: "{:,.2f}".format(x).rstrip('0').rstrip('.') if pd.notnull(x) else "",
-                 "Room (số lượng cp lưu hành)": lambda x: "{:,.2f}".format(x).rstrip('0').rstrip('.') if pd.notnull(x) else "",
-                 "Max Room Cho Vay": lambda x: "{:,.2f}".format(x).rstrip('0').rstrip('.') if pd.notnull(x) else "",
-                 "KL Lưu hành": "{:,.0f}",
-                 "Giá": "{:,.2f}"
-             })
-
-        st.dataframe(
-            styled_df, 
-            use_container_width=True, 
-            hide_index=True
-        )
+        # Phân trang phía server: chỉ trang đang xem được style và gửi sang trình duyệt
+        c_page_size, c_page, c_page_info = st.columns([1, 1, 2])
+        with c_page_size:
+            page_size = st.selectbox("Số dòng mỗi trang:", styling.PAGE_SIZES, index=1, key="risk_page_size")
+        n_pages = styling.page_count(len(df_display_renamed), page_size)
+        with c_page:
+            # Không đặt key: số trang đổi (kết quả lọc mới) thì quay về trang 1
+            page_no = st.number_input(f"Trang (/{n_pages}):", min_value=1, max_value=n_pages, value=1, step=1)
+        df_page = styling.paginate(df_display_renamed, page_size, page_no)
+        with c_page_info:
+            first_row = (page_no - 1) * page_size
+            st.caption(f"Dòng {first_row + 1}–{first_row + len(df_page)} / {len(df_display_renamed)} kết quả")
+
+        industry_metrics = selected_industry_metrics if warning_group == "So sánh ngành" else None
+        with profiling.span("tab2:style", rows_in=len(df_page)):
+            styled_df = styling.style_warning_table(df_page, warning_group, industry_metrics)
+
+        # Styler được áp dụng khi st.dataframe serialize bảng
+        with profiling.span("tab2:render", rows_in=len(df_page)):
+            st.dataframe(
+                styled_df, 
+                use_container_width=True, 
+                hide_index=True
+            )
 
-        # --- Xuất Excel ---
-        buffer = BytesIO()
-        with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
-            if 'df_export' in locals():
-                df_export.to_excel(writer, index=False, sheet_name="Data")
-            else:
-                df_display_renamed.to_excel(writer, index=False, sheet_name="Data")
+        # --- Xuất Excel (file chỉ được tạo khi người dùng bấm tải) ---
+        filter_state.update(exchanges=selected_exchanges, sectors=selected_sectors)
+        export_key = exporting.state_key("risk", data_version(), filter_state)
+
+        c_export, c_export_all = st.columns(2)
+        with c_export:
+            export_fmt = st.radio("Định dạng tải về:", exporting.FORMATS, horizontal=True, key="risk_export_fmt")
+            export_name, export_mime = exporting.file_info(export_fmt, f"QTRR_{warning_group}")
+            st.download_button(
+                label=f"Tải dữ liệu về {export_fmt}",
+                data=profiling.timed(f"export:{warning_group}", exporting.deferred(export_key, df_export, export_fmt)),
+                file_name=export_name,
+                mime=export_mime
+            )
+        with c_export_all:
+            st.download_button(
+                label="Tải tất cả nhóm cảnh báo (Excel nhiều sheet)",
+                data=profiling.timed("export:all", exporting.deferred_sheets(exporting.state_key("risk_all", data_version()), build_all_warning_sheets)),
+                file_name="QTRR_tat_ca_nhom_canh_bao.xlsx",
+                mime=exporting.EXCEL_MIME
+            )
 
-        st.download_button(
-            label="Tải dữ liệu về Excel",
-            data=buffer.getvalue(),
-            file_name=f"QTRR_{warning_group}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+# --- Debug: thời gian xử lý lần chạy này (chỉ hiện khi bật profiling) ---
+profile_run = profiling.finish_run()
+if profile_run is not None:
+    with st.expander(f"🛠 Debug: lần chạy {profile_run.seconds:.3f}s", expanded=False):
+        spans = pd.DataFrame(profile_run.spans)
+        if not spans.empty:
+            spans["name"] = ["  " * d + n for d, n in zip(spans["depth"], spans["name"])]
+            st.dataframe(spans.drop(columns=["depth"]), use_container_width=True, hide_index=True)
+        caches = profile_run.to_dict()["caches"]
+        if caches:
+            st.dataframe(pd.DataFrame(caches).T, use_container_width=True)
+        memo = filter_memo.stats()
+        st.caption(
+            f"Memo bộ lọc: {memo['entries']} kết quả, {memo['bytes'] / 2**20:.1f}/{filter_memo.MAX_MB:.0f} MB, "
+            f"{memo['hits']} hit / {memo['misses']} miss / {memo['evictions']} evict"
         )
-
-
+        st.caption(f"Log: {profiling.PROFILE_LOG}")
@@ -0,0 +1,276 @@
+# --- Engine tín hiệu khối lượng giao dịch (Volume/result/volume_signal_daily.csv) ---
+# Input: giá ngày theo mã (time, symbol, ..., volume), vd. data/stock_prices.csv
+# Output: vol_ma20/50/100/200, vol_vs_maN_pct, flag_maN, flag_break_vol_100/200
+#
+# Chạy:
+#   python volume_engine.py                 # cập nhật tăng dần (chỉ các phiên mới)
+#   python volume_engine.py --full          # tính lại toàn bộ lịch sử
+#   python volume_engine.py --partition     # chỉ chia lại file tín hiệu theo ngày
+import argparse
+import json
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+PRICE_PATH = os.path.join("data", "stock_prices.csv")
+SIGNAL_PATH = os.path.join("Volume", "result", "volume_signal_daily.csv")
+# Lưu N phiên cuối của mỗi mã để lần cập nhật sau chỉ tính lại cửa sổ cuối
+TAIL_STATE_PATH = os.path.join("Volume", "result", "volume_tail.pkl")
+# Tín hiệu được chia theo ngày giao dịch: partitions/date=YYYY-MM-DD.csv
+PARTITION_DIR = os.path.join("Volume", "result", "partitions")
+MANIFEST_NAME = "_manifest.json"
+# Dòng của phiên mới nhất của từng mã (mã không giao dịch ở phiên cuối vẫn có dòng của phiên trước đó)
+LATEST_NAME = "latest.csv"
+
+MA_WINDOWS = [20, 50, 100, 200]
+BREAK_WINDOWS = [100, 200]
+# Số phiên lịch sử cần để tính đúng mọi cửa sổ của phiên mới
+TAIL_LENGTH = max(MA_WINDOWS + BREAK_WINDOWS)
+
+SIGNAL_COLUMNS = (
+    ["time", "symbol", "volume"]
+    + [f"vol_ma{n}" for n in MA_WINDOWS]
+    + [f"vol_vs_ma{n}_pct" for n in MA_WINDOWS]
+    + [f"flag_ma{n}" for n in MA_WINDOWS]
+    + [f"flag_break_vol_{n}" for n in BREAK_WINDOWS]
+)
+
+
+def _normalize_prices(prices):
+    df = prices[["time", "symbol", "volume"]].copy()
+    df["time"] = pd.to_datetime(df["time"]).dt.strftime("%Y-%m-%d")
+    df["symbol"] = df["symbol"].astype(str).str.strip().str.upper()
+    df["volume"] = pd.to_numeric(df["volume"], errors="coerce").fillna(0)
+    df = df.drop_duplicates(subset=["symbol", "time"], keep="last")
+    return df.sort_values(by=["symbol", "time"], ignore_index=True)
+
+
+def _flag(pct):
+    # % so với trung bình: >50, 20..50, -20..-50, <-50, còn lại NONE
+    conditions = [pct > 50, pct > 20, pct < -50, pct < -20]
+    choices = ["GT_50", "GT_20_50", "LT_50", "LT_20_50"]
+    return np.select(conditions, choices, default="NONE")
+
+
+def _compute(df):
+    # df: time, symbol, volume đã sắp xếp theo (symbol, time)
+    g = df.groupby("symbol", sort=False)["volume"]
+    out = df.copy()
+    for n in MA_WINDOWS:
+        ma = g.rolling(n, min_periods=n).mean().reset_index(level=0, drop=True).reindex(df.index)
+        pct = (df["volume"] / ma.replace(0, np.nan) - 1) * 100
+        out[f"vol_ma{n}"] = ma.round(2)
+        out[f"vol_vs_ma{n}_pct"] = pct.round(2)
+        out[f"flag_ma{n}"] = _flag(pct)
+    # Đột biến: khối lượng phiên lớn hơn mọi phiên trong N phiên trước đó
+    prev = g.shift(1)
+    for n in BREAK_WINDOWS:
+        prev_max = prev.groupby(df["symbol"], sort=False).rolling(n, min_periods=n).max().reset_index(level=0, drop=True)
+        out[f"flag_break_vol_{n}"] = df["volume"] > prev_max.reindex(df.index)
+    return out[SIGNAL_COLUMNS]
+
+
+def _tail(df):
+    return df.groupby("symbol", sort=False).tail(TAIL_LENGTH)[["time", "symbol", "volume"]]
+
+
+def compute_volume_signals(prices):
+    # Tính toàn bộ lịch sử; trả về (signals, tail_state)
+    df = _normalize_prices(prices)
+    signals = _compute(df)
+    return signals.sort_values(by=["time", "symbol"], ignore_index=True), _tail(df)
+
+
+def update_volume_signals(tail_state, new_prices):
+    # Chỉ tính các phiên mới: ghép TAIL_LENGTH phiên cuối của mỗi mã với dữ liệu mới,
+    # tính lại cửa sổ trượt và giữ lại các dòng mới.
+    # Trả về (signals của các phiên mới, tail_state mới)
+    new = _normalize_prices(new_prices)
+    last_time = tail_state.groupby("symbol")["time"].max()
+    new = new[new["time"] > new["symbol"].map(last_time).fillna("")]
+    if new.empty:
+        return pd.DataFrame(columns=SIGNAL_COLUMNS), tail_state
+
+    combined = pd.concat([tail_state.assign(_new=False), new.assign(_new=True)], ignore_index=True)
+    combined = combined.sort_values(by=["symbol", "time"], ignore_index=True)
+    is_new = combined.pop("_new").to_numpy()
+    signals = _compute(combined)[is_new]
+    return signals.sort_values(by=["time", "symbol"], ignore_index=True), _tail(combined)
+
+
+def _save_tail(tail_state, path):
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(tail_state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+def _load_tail(tail_path, signal_path):
+    if os.path.exists(tail_path):
+        with open(tail_path, "rb") as f:
+            return pickle.load(f)
+    # Chưa có state: lấy từ file tín hiệu đã có (file có cột volume của từng phiên)
+    if os.path.exists(signal_path):
+        df = pd.read_csv(signal_path, usecols=["time", "symbol", "volume"])
+        return _tail(_normalize_prices(df))
+    return None
+
+
+# --- Kho tín hiệu chia theo ngày ---
+def _source_signature(path):
+    try:
+        st_ = os.stat(path)
+    except OSError:
+        return None
+    return [st_.st_mtime_ns, st_.st_size]
+
+
+def _partition_path(partition_dir, date):
+    return os.path.join(partition_dir, f"date={date}.csv")
+
+
+def read_manifest(partition_dir=PARTITION_DIR):
+    # {"source": chữ ký file tín hiệu đã chia, "dates": [các ngày, tăng dần]}
+    try:
+        with open(os.path.join(partition_dir, MANIFEST_NAME), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_manifest(partition_dir, manifest):
+    path = os.path.join(partition_dir, MANIFEST_NAME)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, path)
+
+
+def write_partitions(signals, partition_dir=PARTITION_DIR, signal_path=SIGNAL_PATH, replace=False):
+    # Ghi signals vào các file theo ngày. replace=True: xoá toàn bộ partition cũ trước.
+    # Với ngày đã có file, dòng mới được gộp vào (dòng mới ghi đè cùng mã).
+    os.makedirs(partition_dir, exist_ok=True)
+    manifest = None if replace else read_manifest(partition_dir)
+    if manifest is None:
+        for name in os.listdir(partition_dir):
+            if name.startswith("date="):
+                os.remove(os.path.join(partition_dir, name))
+        dates = set()
+    else:
+        dates = set(manifest["dates"])
+
+    for date, part in signals.groupby("time", sort=True):
+        path = _partition_path(partition_dir, date)
+        if date in dates and os.path.exists(path):
+            part = pd.concat([pd.read_csv(path), part], ignore_index=True)
+            part = part.drop_duplicates(subset=["symbol"], keep="last")
+        tmp = f"{path}.tmp"
+        part.to_csv(tmp, index=False)
+        os.replace(tmp, path)
+        dates.add(date)
+
+    # Gộp dòng mới vào bảng phiên mới nhất của từng mã
+    latest_path = os.path.join(partition_dir, LATEST_NAME)
+    if manifest is not None and manifest.get("latest") and os.path.exists(latest_path):
+        signals = pd.concat([pd.read_csv(latest_path), signals], ignore_index=True)
+    latest = signals.sort_values("time", kind="stable").drop_duplicates(subset=["symbol"], keep="last")
+    tmp = f"{latest_path}.tmp"
+    latest.to_csv(tmp, index=False)
+    os.replace(tmp, latest_path)
+
+    _write_manifest(partition_dir, {
+        "source": _source_signature(signal_path), "dates": sorted(dates), "latest": LATEST_NAME,
+    })
+
+
+def ensure_partitions(signal_path=SIGNAL_PATH, partition_dir=PARTITION_DIR, price_path=PRICE_PATH):
+    # Đảm bảo kho theo ngày khớp với file tín hiệu hiện tại:
+    # - file tín hiệu bị ghi lại từ bên ngoài -> chia lại
+    # - chưa có file tín hiệu nhưng có giá ngày -> tính toàn bộ bằng engine
+    # Trả về manifest (None nếu không có dữ liệu)
+    if not os.path.exists(signal_path):
+        if not os.path.exists(price_path):
+            return None
+        run(price_path, signal_path, full=True, partition_dir=partition_dir)
+        return read_manifest(partition_dir)
+
+    manifest = read_manifest(partition_dir)
+    # Kho cũ chưa có bảng phiên mới nhất theo mã ("latest") cũng được chia lại
+    if manifest is None or manifest.get("source") != _source_signature(signal_path) or not manifest.get("latest"):
+        write_partitions(pd.read_csv(signal_path), partition_dir, signal_path, replace=True)
+        manifest = read_manifest(partition_dir)
+    return manifest
+
+
+def read_partitions(dates, partition_dir=PARTITION_DIR):
+    # Chỉ đọc các ngày được chọn
+    frames = [
+        pd.read_csv(_partition_path(partition_dir, d))
+        for d in dates if os.path.exists(_partition_path(partition_dir, d))
+    ]
+    if not frames:
+        return pd.DataFrame(columns=SIGNAL_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def read_latest(partition_dir=PARTITION_DIR):
+    # Phiên mới nhất của từng mã (mỗi mã một dòng)
+    path = os.path.join(partition_dir, LATEST_NAME)
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=SIGNAL_COLUMNS)
+    return pd.read_csv(path)
+
+
+def dates_in_range(manifest, start, end):
+    # Các ngày giao dịch có dữ liệu trong [start, end] (chuỗi YYYY-MM-DD)
+    return [d for d in manifest["dates"] if start <= d <= end]
+
+
+def run(price_path=PRICE_PATH, signal_path=SIGNAL_PATH, tail_path=TAIL_STATE_PATH, full=False,
+        partition_dir=PARTITION_DIR):
+    prices = pd.read_csv(price_path)
+    os.makedirs(os.path.dirname(signal_path) or ".", exist_ok=True)
+
+    tail_state = None if full else _load_tail(tail_path, signal_path)
+    if tail_state is None:
+        signals, tail_state = compute_volume_signals(prices)
+        tmp = f"{signal_path}.tmp"
+        signals.to_csv(tmp, index=False)
+        os.replace(tmp, signal_path)
+        write_partitions(signals, partition_dir, signal_path, replace=True)
+    else:
+        # Kho theo ngày phải khớp với file tín hiệu trước khi append
+        ensure_partitions(signal_path, partition_dir, price_path)
+        signals, tail_state = update_volume_signals(tail_state, prices)
+        if not signals.empty:
+            # Append các phiên mới vào cuối file, không ghi lại lịch sử
+            signals.to_csv(signal_path, mode="a", header=not os.path.exists(signal_path), index=False)
+            write_partitions(signals, partition_dir, signal_path)
+
+    _save_tail(tail_state, tail_path)
+    return len(signals)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tính tín hiệu khối lượng giao dịch (MA20-MA200, đột biến Vol 100/200).")
+    parser.add_argument("--prices", default=PRICE_PATH, help="File giá ngày (time, symbol, volume, ...)")
+    parser.add_argument("--out", default=SIGNAL_PATH, help="File tín hiệu đầu ra")
+    parser.add_argument("--tail-state", default=TAIL_STATE_PATH, help="File lưu các phiên cuối của mỗi mã")
+    parser.add_argument("--partitions", default=PARTITION_DIR, help="Thư mục kho tín hiệu theo ngày")
+    parser.add_argument("--full", action="store_true", help="Tính lại toàn bộ lịch sử")
+    parser.add_argument("--partition", action="store_true", help="Chỉ chia file tín hiệu hiện có theo ngày")
+    args = parser.parse_args()
+
+    if args.partition:
+        write_partitions(pd.read_csv(args.out), args.partitions, args.out, replace=True)
+        print(f"Đã chia {args.out} vào {args.partitions}")
+        return
+
+    n_rows = run(args.prices, args.out, args.tail_state, full=args.full, partition_dir=args.partitions)
+    print(f"Đã ghi {n_rows} dòng tín hiệu vào {args.out}")
+
+
+if __name__ == "__main__":
+    main()